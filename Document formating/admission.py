@@ -0,0 +1,168 @@
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+
+from fair_scheduler import DEFAULT_CONFIG as FAIR_DEFAULTS, FairLane, LOCAL_JOB
+
+
+# ================== DEFAULTS ==================
+DEFAULT_CONFIG = {
+    # Hard limits - anything above these is treated as a decompression bomb
+    'ADMISSION_MAX_UNCOMPRESSED': 512 * 1024 * 1024,
+    'ADMISSION_MAX_RATIO': 200,
+    'ADMISSION_MAX_PARTS': 10000,
+    # Jobs whose estimated cost is at or below this go to the small lane
+    'ADMISSION_SMALL_MAX_COST': 4 * 1024 * 1024,
+    'ADMISSION_SMALL_CONCURRENCY': 4,
+    'ADMISSION_LARGE_CONCURRENCY': 1,
+    # Seconds a job may wait for a lane slot before we give up with 503
+    'ADMISSION_QUEUE_TIMEOUT': 30,
+}
+
+# Media is copied through by python-docx, XML has to be parsed into lxml trees,
+# so XML bytes dominate the cost of a job.
+MEDIA_COST_WEIGHT = 0.05
+
+# Entries smaller than this are never flagged on their ratio alone
+MIN_RATIO_CHECK_SIZE = 1024 * 1024
+
+
+class DocumentRejected(Exception):
+    """Raised when a document must not be processed at all"""
+
+    def __init__(self, message, status=413):
+        super().__init__(message)
+        self.status = status
+
+
+class LaneBusy(Exception):
+    """Raised when no lane slot became free within the queue timeout"""
+
+
+# ================== ESTIMATOR ==================
+def estimate_cost(path):
+    """
+    Estimate the processing cost of a DOCX from its ZIP central directory.
+    Nothing is decompressed - only the part sizes recorded in the directory are read.
+    """
+    try:
+        with zipfile.ZipFile(path) as zf:
+            infos = zf.infolist()
+    except zipfile.BadZipFile:
+        raise DocumentRejected('File is not a valid .docx package', status=400)
+
+    estimate = {
+        'parts': len(infos),
+        'compressed': 0,
+        'uncompressed': 0,
+        'xml_bytes': 0,
+        'media_bytes': 0,
+        'max_ratio': 0.0,
+        'has_document': False,
+    }
+
+    for info in infos:
+        estimate['compressed'] += info.compress_size
+        estimate['uncompressed'] += info.file_size
+
+        if info.filename == 'word/document.xml':
+            estimate['has_document'] = True
+
+        if info.filename.endswith('.xml') or info.filename.endswith('.rels'):
+            estimate['xml_bytes'] += info.file_size
+        else:
+            estimate['media_bytes'] += info.file_size
+
+        if info.file_size >= MIN_RATIO_CHECK_SIZE:
+            ratio = info.file_size / max(info.compress_size, 1)
+            estimate['max_ratio'] = max(estimate['max_ratio'], ratio)
+
+    estimate['cost'] = int(estimate['xml_bytes'] +
+                           estimate['media_bytes'] * MEDIA_COST_WEIGHT)
+    return estimate
+
+
+# ================== LANES ==================
+class AdmissionController:
+    """
+    Rejects decompression bombs and routes jobs into small/large lanes.
+    Lane slots are shared out per client and priority class (FairLane).
+    """
+
+    def __init__(self, config=None):
+        settings = dict(DEFAULT_CONFIG)
+        for key in DEFAULT_CONFIG:
+            if config is not None and key in config:
+                settings[key] = config[key]
+
+        self.max_uncompressed = settings['ADMISSION_MAX_UNCOMPRESSED']
+        self.max_ratio = settings['ADMISSION_MAX_RATIO']
+        self.max_parts = settings['ADMISSION_MAX_PARTS']
+        self.small_max_cost = settings['ADMISSION_SMALL_MAX_COST']
+        self.queue_timeout = settings['ADMISSION_QUEUE_TIMEOUT']
+
+        reserved = (config or {}).get('FAIR_INTERACTIVE_RESERVED',
+                                      FAIR_DEFAULTS['FAIR_INTERACTIVE_RESERVED'])
+        self.lanes = {
+            'small': FairLane('small', settings['ADMISSION_SMALL_CONCURRENCY'], reserved),
+            'large': FairLane('large', settings['ADMISSION_LARGE_CONCURRENCY'], reserved),
+        }
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def check(self, path):
+        """Return the cost estimate for path, raising DocumentRejected for bombs"""
+        try:
+            estimate = estimate_cost(path)
+
+            if not estimate['has_document']:
+                raise DocumentRejected(
+                    'Package has no word/document.xml', status=400)
+            if estimate['parts'] > self.max_parts:
+                raise DocumentRejected(
+                    f"Too many parts in package ({estimate['parts']})")
+            if estimate['uncompressed'] > self.max_uncompressed:
+                raise DocumentRejected(
+                    'Document expands beyond the allowed size')
+            if estimate['max_ratio'] > self.max_ratio:
+                raise DocumentRejected(
+                    'Suspicious compression ratio - possible decompression bomb')
+        except DocumentRejected:
+            with self._lock:
+                self.rejected += 1
+            raise
+
+        return estimate
+
+    def lane_for(self, estimate):
+        if estimate['cost'] <= self.small_max_cost:
+            return self.lanes['small']
+        return self.lanes['large']
+
+    @contextmanager
+    def admit(self, path, job=None):
+        """
+        Check path and hold a slot in the matching lane while the job runs.
+        job (fair_scheduler.current_job()) says whose turn it is waiting for.
+        """
+        estimate = self.check(path)
+        lane = self.lane_for(estimate)
+        estimate['lane'] = lane.name
+        job = job or LOCAL_JOB
+
+        if not lane.acquire(self.queue_timeout, job, estimate['cost']):
+            raise LaneBusy(f'The {lane.name} document lane is busy')
+        start = time.monotonic()
+        try:
+            yield estimate
+        finally:
+            lane.release(job, time.monotonic() - start)
+
+    def stats(self):
+        with self._lock:
+            rejected = self.rejected
+        return {
+            'rejected': rejected,
+            'lanes': {name: lane.stats() for name, lane in self.lanes.items()},
+        }
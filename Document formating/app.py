@@ -1,21 +1,38 @@
-from flask import Flask, request, send_file, jsonify, render_template_string
-from flask_cors import CORS
+from flask import Blueprint, current_app, request, jsonify
+from werkzeug.local import LocalProxy
+import json
+import time
+import uuid
 from docx import Document
 from docx.shared import Pt
+from lxml import etree
 import os
 from werkzeug.utils import secure_filename
-import tempfile
 import traceback
+from admission import DocumentRejected, LaneBusy
+from profiling import stage
+from storyparts import iter_story_runs
+from workers import get_worker_pool, WorkerCrashed, WorkerJobError, WorkerPoolBusy
+from ingest import upload_digest, save_upload
+from fair_scheduler import current_job
+from server import admission, outputs
+import preview
+import ui
+
+bp = Blueprint('formatter', __name__)
 
-app = Flask(__name__)
-CORS(app)
+ALLOWED_EXTENSIONS = {'docx'}
 
+DEFAULT_CONFIG = dict(preview.DEFAULT_CONFIG)
+
+# Parsed preview prefixes, one cache per app
+previews = LocalProxy(lambda: current_app.extensions['previews'])
 
-UPLOAD_FOLDER = tempfile.gettempdir()
-ALLOWED_EXTENSIONS = {'docx'}
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+@bp.record_once
+def init_previews(state):
+    state.app.extensions['previews'] = preview.PreviewCache(
+        state.app.config['PREVIEW_CACHE_SIZE'])
 
 
 def allowed_file(filename):
@@ -25,33 +42,20 @@ def allowed_file(filename):
 def format_docx(input_path, output_path, font_name, font_size):
     """Format the Word document with specified font and size"""
     try:
-        doc = Document(input_path)
+        with stage('parse'):
+            doc = Document(input_path)
 
-        for paragraph in doc.paragraphs:
-            for run in paragraph.runs:
+        size = Pt(int(font_size))
+
+        # Every story part (body, headers/footers, notes, comments, text boxes)
+        # is walked once, however many sections link to it.
+        with stage('story_parts'):
+            for run in iter_story_runs(doc):
                 run.font.name = font_name
-                run.font.size = Pt(int(font_size))
-
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for paragraph in cell.paragraphs:
-                        for run in paragraph.runs:
-                            run.font.name = font_name
-                            run.font.size = Pt(int(font_size))
-
-        for section in doc.sections:
-            for paragraph in section.header.paragraphs:
-                for run in paragraph.runs:
-                    run.font.name = font_name
-                    run.font.size = Pt(int(font_size))
-
-            for paragraph in section.footer.paragraphs:
-                for run in paragraph.runs:
-                    run.font.name = font_name
-                    run.font.size = Pt(int(font_size))
-
-        doc.save(output_path)
+                run.font.size = size
+
+        with stage('save'):
+            doc.save(output_path)
         return True
     except Exception as e:
         print(f"Error formatting document: {str(e)}")
@@ -59,6 +63,20 @@ def format_docx(input_path, output_path, font_name, font_size):
         return False
 
 
+def run_format_job(input_path, output_path, font_name, font_size):
+    """Run format_docx in a recycled worker process, or in-process if pooling is off"""
+    pool = get_worker_pool(current_app.config, preload=['app'])
+    if pool is None:
+        return format_docx(input_path, output_path, font_name, font_size)
+
+    try:
+        return pool.run('app:format_docx', input_path, output_path,
+                        font_name, font_size)
+    except (WorkerCrashed, WorkerJobError) as e:
+        print(f"Error formatting document: {str(e)}")
+        return False
+
+
 # HTML Template embedded in Python
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -366,7 +384,7 @@ HTML_TEMPLATE = """
         </div>
 
         <div id="previewArea" class="preview-area">
-            <div class="preview-title">Preview (Sample text with selected formatting):</div>
+            <div class="preview-title" id="previewTitle">Preview (Sample text with selected formatting):</div>
             <div class="preview-text" id="previewText">
                 This is how your text will look after formatting. The quick brown fox jumps over the lazy dog. Lorem ipsum dolor sit amet, consectetur adipiscing elit.
             </div>
@@ -374,7 +392,8 @@ HTML_TEMPLATE = """
     </div>
 
     <script>
-        const API_URL = '/api';
+        const PREVIEW_URL = '{{ url_for("formatter.preview_document") }}';
+        const FORMAT_URL = '{{ url_for("formatter.format_document") }}';
         let uploadedFile = null;
 
         const uploadArea = document.getElementById('uploadArea');
@@ -387,6 +406,9 @@ HTML_TEMPLATE = """
         const fontSize = document.getElementById('fontSize');
         const previewArea = document.getElementById('previewArea');
         const previewText = document.getElementById('previewText');
+        const previewTitle = document.getElementById('previewTitle');
+        let previewId = null;
+        let previewTimer = null;
         const alert = document.getElementById('alert');
         const loading = document.getElementById('loading');
 
@@ -428,6 +450,7 @@ HTML_TEMPLATE = """
             fileInfo.classList.add('show');
             formatBtn.disabled = false;
             showAlert('File uploaded successfully!', 'success');
+            previewId = null;
             updatePreview();
         }
 
@@ -435,6 +458,45 @@ HTML_TEMPLATE = """
             previewText.style.fontFamily = fontFamily.value;
             previewText.style.fontSize = fontSize.value + 'pt';
             previewArea.classList.add('show');
+
+            // Ask the server for a real preview of the document's first paragraphs
+            clearTimeout(previewTimer);
+            if (uploadedFile) {
+                previewTimer = setTimeout(fetchPreview, 150);
+            }
+        }
+
+        async function fetchPreview() {
+            const formData = new FormData();
+            if (previewId) {
+                formData.append('previewId', previewId);
+            } else {
+                formData.append('file', uploadedFile);
+            }
+            formData.append('fontFamily', fontFamily.value);
+            formData.append('fontSize', fontSize.value);
+
+            try {
+                let response = await fetch(PREVIEW_URL, {
+                    method: 'POST',
+                    body: formData
+                });
+                if (response.status === 404 && previewId) {
+                    // Server forgot the upload - send it again
+                    previewId = null;
+                    return fetchPreview();
+                }
+                if (!response.ok) return;
+
+                const data = await response.json();
+                previewId = data.previewId;
+                previewText.innerHTML = data.html;
+                previewTitle.textContent = data.truncated
+                    ? 'Preview (beginning of your document):'
+                    : 'Preview (your document):';
+            } catch (error) {
+                // Keep the sample text preview
+            }
         }
 
         fontFamily.addEventListener('change', updatePreview);
@@ -454,7 +516,7 @@ HTML_TEMPLATE = """
                 formData.append('fontFamily', fontFamily.value);
                 formData.append('fontSize', fontSize.value);
 
-                const response = await fetch(`${API_URL}/format`, {
+                const response = await fetch(FORMAT_URL, {
                     method: 'POST',
                     body: formData
                 });
@@ -495,24 +557,88 @@ HTML_TEMPLATE = """
 </body>
 </html>
 """
+ui.register('formatter.home', HTML_TEMPLATE)
+
 
 
-@app.route('/')
+@bp.route('/')
 def home():
     """Serve the HTML interface"""
-    return render_template_string(HTML_TEMPLATE)
+    # Rendered and compressed once at startup
+    return ui.serve('formatter.home')
 
 
-@app.route('/api/health', methods=['GET'])
+@bp.route('/api/health', methods=['GET'])
 def health_check():
+    pool = get_worker_pool(current_app.config, preload=['app'], start=False)
+    # Set when served through asgi.py
+    asgi = current_app.extensions.get('asgi')
     return jsonify({
         'status': 'healthy',
         'message': 'Word formatter API is running',
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'admission': admission.stats(),
+        'workers': pool.stats() if pool else None,
+        'outputs': outputs.stats(),
+        'route_limits': asgi.stats() if asgi else None
+    })
+
+
+@bp.route('/api/preview', methods=['POST'])
+def preview_document():
+    """Render the first paragraphs of an upload with the chosen settings"""
+    start = time.perf_counter()
+    font_name = request.form.get('fontFamily', 'Calibri')
+    font_size = request.form.get('fontSize', '12')
+    config = request.form.get('config')
+
+    try:
+        settings = {'font_name': font_name, 'font_size': int(font_size),
+                    'config': json.loads(config) if config else None}
+    except ValueError:
+        return jsonify({'error': 'Invalid formatting settings'}), 400
+
+    file = request.files.get('file')
+    if file is not None:
+        if not allowed_file(file.filename):
+            return jsonify({'error': 'Only .docx files are allowed'}), 400
+
+        preview_id = upload_digest(file)[:32]
+        entry = previews.get(preview_id)
+        if entry is None:
+            try:
+                admission.check(file.stream)
+                with stage('parse_prefix'):
+                    entry = preview.parse_prefix(file.stream,
+                                                 current_app.config['PREVIEW_MAX_BLOCKS'],
+                                                 current_app.config['PREVIEW_PARSE_BUDGET'])
+            except DocumentRejected as e:
+                return jsonify({'error': str(e)}), e.status
+            except etree.XMLSyntaxError:
+                return jsonify({'error': 'File is not a valid .docx package'}), 400
+            previews.put(preview_id, entry)
+    else:
+        preview_id = request.form.get('previewId', '')
+        entry = previews.get(preview_id)
+        if entry is None:
+            return jsonify({'error': 'Unknown preview, upload the file again'}), 404
+
+    blocks, truncated = entry
+    try:
+        with stage('render'):
+            html = preview.render_preview(blocks, settings)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Invalid formatting settings'}), 400
+
+    return jsonify({
+        'previewId': preview_id,
+        'html': html,
+        'truncated': truncated,
+        'elapsedMs': round((time.perf_counter() - start) * 1000, 1)
     })
 
 
-@app.route('/api/format', methods=['POST'])
+@bp.route('/api/format', methods=['POST'])
 def format_document():
     try:
         print("=" * 50)
@@ -536,37 +662,38 @@ def format_document():
             return jsonify({'error': 'Only .docx files are allowed'}), 400
 
         filename = secure_filename(file.filename)
+        # Unique per request - concurrent uploads often share a file name
+        job_id = uuid.uuid4().hex[:16]
         input_path = os.path.join(
-            app.config['UPLOAD_FOLDER'], f"input_{filename}")
-        file.save(input_path)
+            current_app.config['UPLOAD_FOLDER'], f"input_{job_id}_{filename}")
+        save_upload(file, input_path)
 
         output_filename = f"formatted_{filename}"
         output_path = os.path.join(
-            app.config['UPLOAD_FOLDER'], output_filename)
-
-        print("Formatting document...")
-        success = format_docx(input_path, output_path, font_name, font_size)
+            current_app.config['OUTPUT_FOLDER'], f"{job_id}_{output_filename}")
+
+        try:
+            with admission.admit(input_path, current_job()) as estimate:
+                print(f"Admitted to {estimate['lane']} lane (cost {estimate['cost']})")
+                print("Formatting document...")
+                success = run_format_job(
+                    input_path, output_path, font_name, font_size)
+        except (DocumentRejected, LaneBusy, WorkerPoolBusy) as e:
+            if isinstance(e, (LaneBusy, WorkerPoolBusy)):
+                return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+            return jsonify({'error': str(e)}), e.status
+        finally:
+            if os.path.exists(input_path):
+                os.remove(input_path)
 
         if not success:
+            if os.path.exists(output_path):
+                os.remove(output_path)
             return jsonify({'error': 'Failed to format document'}), 500
 
         print("Sending formatted file...")
-        response = send_file(
-            output_path,
-            as_attachment=True,
-            download_name=output_filename,
-            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-        )
-
-        @response.call_on_close
-        def cleanup():
-            try:
-                if os.path.exists(input_path):
-                    os.remove(input_path)
-                if os.path.exists(output_path):
-                    os.remove(output_path)
-            except:
-                pass
+        # Stays downloadable from /outputs/<X-Output-Key> until it expires
+        response = outputs.store_and_send(output_path, output_filename)
 
         print("✅ Success!")
         print("=" * 50)
@@ -588,4 +715,5 @@ if __name__ == '__main__':
     print("✅ Server is ready!")
     print("=" * 60 + "\n")
 
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    from server import create_app
+    create_app(mounts={'formatter': ''}).run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,486 @@
+"""
+ASGI front end for the WSGI app built by server.create_app().
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+Uploads are read and downloads sent by the event loop. A thread from the
+executor only runs the Flask handler once the whole request body is spooled,
+and it is handed back before the response goes out. The .docx parts of an
+upload are checked by ingest's ZIP header scanner while they arrive, so a
+file that is not a .docx or expands too far is refused mid-upload. Slow clients therefore
+never hold a worker thread. Every route has a concurrency limit and a
+deadline, and light routes such as /api/health run on their own executor so
+they answer even when every heavy slot is busy.
+
+Files returned with send_file (e.g. results from the output store) are not
+spooled at all: the event loop sends them straight from the open file,
+through the server's zerocopysend extension when it offers one.
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import (NEED_DATA, Data, Epilogue, Field, File,
+                                       MultipartDecoder)
+
+from fair_scheduler import RateLimited, client_id
+from ingest import InvalidUpload, UploadTooLarge, scanner_for
+from server import create_app
+
+
+# ================== DEFAULTS ==================
+DEFAULT_CONFIG = {
+    # Path prefix -> (concurrent requests, seconds until 504). Longest prefix wins.
+    'ASGI_ROUTE_LIMITS': {
+        # Above the admission lanes, so jobs queue in the fair lanes instead
+        '/api/format': (8, 120),
+        '/api/preview': (8, 10),
+        '/smart/analyze': (8, 300),
+        '/analyzer/analyze': (4, 600),
+        '/analyzer/structure': (8, 30),
+        '/outputs/': (32, 30),
+    },
+    # Any other path
+    'ASGI_DEFAULT_LIMIT': (16, 60),
+    # Served on a separate small executor without limits
+    'ASGI_LIGHT_PATHS': ('/', '/analyzer/', '/smart/',
+                         '/api/health', '/api/stats', '/api/imports', '/api/clients',
+                         '/smart/api/stats', '/analyzer/api/stats'),
+    'ASGI_WORKER_THREADS': 16,
+    'ASGI_LIGHT_THREADS': 2,
+    # Seconds a request may wait for a route slot before it gets 503
+    'ASGI_QUEUE_TIMEOUT': 5,
+    # Seconds a client may take to send its request body before it gets 408
+    'ASGI_UPLOAD_TIMEOUT': 300,
+    # Request/response bodies above this many bytes are spooled to disk
+    'ASGI_SPOOL_MEMORY': 1024 * 1024,
+}
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _RequestTooLarge(Exception):
+    pass
+
+
+# ================== ROUTE LIMITS ==================
+class RouteLimit:
+    def __init__(self, prefix, limit, deadline):
+        self.prefix = prefix
+        self.limit = limit
+        self.deadline = deadline
+        self.semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def stats(self):
+        return {'limit': self.limit, 'deadline': self.deadline,
+                'active': self.active, 'rejected': self.rejected,
+                'timed_out': self.timed_out}
+
+
+# ================== WSGI BRIDGE ==================
+class _FileBody:
+    """wsgi.file_wrapper - keeps the open file reachable from the response"""
+
+    def __init__(self, file, block_size=CHUNK_SIZE):
+        self.file = file
+        self.block_size = block_size
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.file.read(self.block_size)
+        if not data:
+            raise StopIteration
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def _file_range(iterable):
+    """(file, offset, count) if the response body is a real file, else None"""
+    offset = count = None
+    if isinstance(getattr(iterable, 'iterable', None), _FileBody):
+        # werkzeug's range wrapper around the file, for a Range request
+        offset, count = iterable.start_byte, iterable.byte_range
+        iterable = iterable.iterable
+    if not isinstance(iterable, _FileBody):
+        return None
+    try:
+        size = os.fstat(iterable.file.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        # BytesIO and other in-memory streams are spooled as usual
+        return None
+    if offset is None:
+        offset = iterable.file.tell()
+    if count is None:
+        count = size - offset
+    return iterable.file, offset, count
+
+
+def _environ(scope, body, length):
+    path = scope['path'].encode('utf-8').decode('latin-1')
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path,
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': _FileBody,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+            continue
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = f'HTTP_{name}'
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _call_wsgi(wsgi_app, environ, spool_memory):
+    """
+    Run the handler and spool its whole response, in an executor thread.
+    Returns (status, headers, body file, offset, length). A file response is
+    returned as the open file instead of being copied into a spool.
+    """
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = headers
+
+    iterable = wsgi_app(environ, start_response)
+    file_range = _file_range(iterable)
+    if file_range is not None:
+        # Closed by _send_response once the file has been sent
+        return (started['status'], started['headers'], *file_range)
+
+    out = tempfile.SpooledTemporaryFile(max_size=spool_memory)
+    try:
+        for chunk in iterable:
+            out.write(chunk)
+    finally:
+        # Runs call_on_close handlers, e.g. removing a sent output file
+        if hasattr(iterable, 'close'):
+            iterable.close()
+    length = out.tell()
+    out.seek(0)
+    return started['status'], started['headers'], out, 0, length
+
+
+# ================== UPLOAD SCANNING ==================
+class _UploadScanner:
+    """
+    Feeds the .docx file parts of a multipart body to a ZipHeaderScanner
+    chunk by chunk, as the receive loop gets them. Raises InvalidUpload or
+    UploadTooLarge; bodies it can't follow are left to the handler.
+    """
+
+    def __init__(self, content_type, config):
+        mimetype, options = parse_options_header(content_type)
+        boundary = options.get('boundary')
+        self._decoder = None
+        if mimetype == 'multipart/form-data' and boundary:
+            self._decoder = MultipartDecoder(boundary.encode('latin-1'))
+        self._config = config
+        self._scanner = None
+
+    def feed(self, chunk, more):
+        if self._decoder is None:
+            return
+        try:
+            self._decoder.receive_data(chunk)
+            if not more:
+                self._decoder.receive_data(None)
+            while True:
+                event = self._decoder.next_event()
+                if event is NEED_DATA:
+                    return
+                if isinstance(event, Epilogue):
+                    break
+                if isinstance(event, File):
+                    filename = event.filename or ''
+                    self._scanner = (scanner_for(self._config)
+                                     if filename.lower().endswith('.docx') else None)
+                elif isinstance(event, Field):
+                    self._scanner = None
+                elif isinstance(event, Data) and self._scanner is not None:
+                    self._scanner.feed(event.data)
+        except ValueError:
+            # Malformed multipart - werkzeug reports it to the handler
+            pass
+        self._decoder = None
+
+
+# ================== ADAPTER ==================
+class ASGIAdapter:
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        config = wsgi_app.config
+        for key, value in DEFAULT_CONFIG.items():
+            config.setdefault(key, value)
+        self.config = config
+
+        self.executor = ThreadPoolExecutor(config['ASGI_WORKER_THREADS'],
+                                           thread_name_prefix='asgi-worker')
+        self.light_executor = ThreadPoolExecutor(config['ASGI_LIGHT_THREADS'],
+                                                 thread_name_prefix='asgi-light')
+        self.light_paths = tuple(config['ASGI_LIGHT_PATHS'])
+        self._urls = wsgi_app.url_map.bind('')
+        self._limits = None
+        self._limits_lock = threading.Lock()
+        # Lets /api/health report slot usage
+        wsgi_app.extensions['asgi'] = self
+
+    @property
+    def limits(self):
+        # Built on first use so the semaphores belong to the serving loop
+        with self._limits_lock:
+            if self._limits is None:
+                limits = [RouteLimit(prefix, *value) for prefix, value
+                          in self.config['ASGI_ROUTE_LIMITS'].items()]
+                limits.sort(key=lambda limit: -len(limit.prefix))
+                limits.append(RouteLimit('', *self.config['ASGI_DEFAULT_LIMIT']))
+                self._limits = limits
+            return self._limits
+
+    def limit_for(self, path):
+        for limit in self.limits:
+            if path.startswith(limit.prefix):
+                return limit
+
+    def endpoint(self, scope):
+        try:
+            endpoint, _ = self._urls.match(scope['path'], scope['method'])
+        except HTTPException:
+            endpoint = None
+        return endpoint
+
+    def body_limit(self, endpoint):
+        """The route's UPLOAD_LIMITS entry, else MAX_CONTENT_LENGTH"""
+        limit = self.config.get('UPLOAD_LIMITS', {}).get(endpoint)
+        return limit if limit is not None else self.config.get('MAX_CONTENT_LENGTH')
+
+    def schedule(self, scope, endpoint):
+        """
+        fair_scheduler job for the request, charged to the client's token
+        bucket before the body is read. Raises RateLimited.
+        """
+        scheduler = self.wsgi_app.extensions.get('scheduler')
+        if scheduler is None:
+            return None
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                   for name, value in scope['headers']}
+        client = scope.get('client') or ('', 0)
+        header = scheduler.header.lower() if scheduler.header else None
+        return scheduler.job_for(
+            endpoint, client_id(headers, client[0], header),
+            headers.get('x-priority'))
+
+    def stats(self):
+        if self._limits is None:
+            return {}
+        return {limit.prefix or '*': limit.stats() for limit in self._limits}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                self.light_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # -------- request body --------
+    async def _read_body(self, receive, max_length, scanner):
+        body = tempfile.SpooledTemporaryFile(max_size=self.config['ASGI_SPOOL_MEMORY'])
+        length = 0
+        more = True
+        try:
+            while more:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    body.close()
+                    return None, 0
+                chunk = message.get('body', b'')
+                length += len(chunk)
+                if max_length is not None and length > max_length:
+                    raise _RequestTooLarge()
+                more = message.get('more_body', False)
+                scanner.feed(chunk, more)
+                body.write(chunk)
+        except BaseException:
+            body.close()
+            raise
+        body.seek(0)
+        return body, length
+
+    # -------- request --------
+    async def _http(self, scope, receive, send):
+        path = scope['path']
+        loop = asyncio.get_running_loop()
+
+        endpoint = self.endpoint(scope)
+        max_length = self.body_limit(endpoint)
+        declared = dict(scope['headers']).get(b'content-length')
+        if (max_length is not None and declared is not None
+                and declared.isdigit() and int(declared) > max_length):
+            # Refused before a single body byte is read
+            await _send_error(send, 413, 'File too large')
+            return
+        try:
+            job = self.schedule(scope, endpoint)
+        except RateLimited as e:
+            await _send_error(send, 429, e.description,
+                              [(b'retry-after', str(e.retry_after).encode())])
+            return
+
+        content_type = dict(scope['headers']).get(b'content-type', b'')
+        scanner = _UploadScanner(content_type.decode('latin-1'), self.config)
+        try:
+            body, length = await asyncio.wait_for(
+                self._read_body(receive, max_length, scanner),
+                self.config['ASGI_UPLOAD_TIMEOUT'])
+        except asyncio.TimeoutError:
+            await _send_error(send, 408, 'Upload took too long')
+            return
+        except _RequestTooLarge:
+            await _send_error(send, 413, 'File too large')
+            return
+        except (InvalidUpload, UploadTooLarge) as e:
+            # Refused before the rest of the upload is read
+            await _send_error(send, e.code, e.description)
+            return
+        if body is None:
+            return
+
+        environ = _environ(scope, body, length)
+        if job is not None:
+            environ['fair_scheduler.job'] = job
+        spool_memory = self.config['ASGI_SPOOL_MEMORY']
+
+        if path in self.light_paths:
+            try:
+                result = await loop.run_in_executor(
+                    self.light_executor, _call_wsgi, self.wsgi_app, environ,
+                    spool_memory)
+            finally:
+                body.close()
+            await _send_response(send, scope, *result)
+            return
+
+        limit = self.limit_for(path)
+        try:
+            await asyncio.wait_for(limit.semaphore.acquire(),
+                                   self.config['ASGI_QUEUE_TIMEOUT'])
+        except asyncio.TimeoutError:
+            limit.rejected += 1
+            body.close()
+            await _send_error(send, 503, 'Server busy, try again shortly',
+                              [(b'retry-after', b'5')])
+            return
+
+        limit.active += 1
+        future = loop.run_in_executor(self.executor, _call_wsgi, self.wsgi_app,
+                                      environ, spool_memory)
+
+        def release(_):
+            # The slot is held until the handler really finishes, even after a 504
+            limit.active -= 1
+            limit.semaphore.release()
+            body.close()
+
+        future.add_done_callback(release)
+
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), limit.deadline)
+        except asyncio.TimeoutError:
+            limit.timed_out += 1
+            future.add_done_callback(_discard_result)
+            print(f"{path} passed its {limit.deadline}s deadline")
+            await _send_error(send, 504, 'Request took too long')
+            return
+
+        # The executor thread is free again; the client reads at its own pace
+        await _send_response(send, scope, *result)
+
+
+def _discard_result(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result()[2].close()
+
+
+async def _send_response(send, scope, status, headers, out, offset, length):
+    try:
+        headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                   for name, value in headers if name.lower() != 'content-length']
+        headers.append((b'content-length', str(length).encode()))
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': headers})
+        if ('http.response.zerocopysend' in scope.get('extensions', {})
+                and isinstance(out, io.BufferedReader)):
+            # The server sends the file with os.sendfile
+            await send({'type': 'http.response.zerocopysend', 'file': out,
+                        'offset': offset, 'count': length})
+            return
+        out.seek(offset)
+        remaining = length
+        while remaining > 0:
+            chunk = out.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            await send({'type': 'http.response.body', 'body': chunk,
+                        'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        out.close()
+
+
+async def _send_error(send, status, message, extra_headers=()):
+    body = json.dumps({'error': message}).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(body)).encode()),
+                            *extra_headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+application = ASGIAdapter(create_app())
@@ -0,0 +1,236 @@
+"""
+Offline bulk formatter.
+
+Reformats every .docx under a source directory into a mirror tree, using a
+process pool. Every finished file is appended to a checkpoint manifest so an
+interrupted run picks up where it stopped:
+
+    python bulk_format.py in_dir out_dir --font Calibri --size 12
+    python bulk_format.py in_dir out_dir --mode smart --config smart.json --workers 8
+
+Files that failed or were rejected are not tried again until they change on
+disk, or the run is given --retry-failed.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+from admission import AdmissionController, DocumentRejected
+
+
+MANIFEST_NAME = '.bulk_manifest.jsonl'
+
+DEFAULT_SMART_CONFIG = {
+    'title_font': 'Times New Roman',
+    'title_size': 26,
+    'heading_font': 'Calibri',
+    'heading_size': 18,
+    'para_font': 'Calibri',
+    'para_size': 12,
+    'bold_titles': True,
+    'highlight': False,
+}
+
+# Set once per worker process by _init_worker
+_worker = {}
+
+
+# ================== WORKER ==================
+def _init_worker(mode, options):
+    # Import the formatter once per process, not once per file
+    if mode == 'smart':
+        import docformat
+        _worker['module'] = docformat
+    else:
+        import app
+        _worker['module'] = app
+    _worker['mode'] = mode
+    _worker['options'] = options
+    _worker['admission'] = AdmissionController()
+
+
+def _format_one(task):
+    rel_path, src, dst = task
+    start = time.perf_counter()
+    result = {'path': rel_path, 'status': 'ok', 'error': None}
+    tmp = dst + '.partial'
+
+    try:
+        _worker['admission'].check(src)
+
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+
+        module = _worker['module']
+        options = _worker['options']
+        if _worker['mode'] == 'smart':
+            elements = module.extract_text_structure(src)
+            module.format_docx(src, elements, tmp, options['config'])
+        elif not module.format_docx(src, tmp, options['font'], options['size']):
+            raise RuntimeError('format_docx failed')
+
+        # Only a complete output ever appears under its final name
+        os.replace(tmp, dst)
+    except DocumentRejected as e:
+        result['status'] = 'rejected'
+        result['error'] = str(e)
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+    finally:
+        # Don't leave half-written output behind a failure
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+# ================== MANIFEST ==================
+def load_manifest(path):
+    """Return {relative path: last record} from a checkpoint manifest"""
+    done = {}
+    if not os.path.exists(path):
+        return done
+
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A torn last line from an interrupted run
+                continue
+            done[record['path']] = record
+    return done
+
+
+def is_finished(record, src, dst, retry_failed):
+    """
+    True if the manifest already has a result for this version of src:
+    a successful output, or a failure/rejection unless retry_failed.
+    """
+    if record is None:
+        return False
+
+    stat = os.stat(src)
+    if (record.get('size') != stat.st_size or
+            record.get('mtime') != int(stat.st_mtime)):
+        # Changed since the last attempt
+        return False
+    if record['status'] != 'ok':
+        return not retry_failed
+    return os.path.exists(dst)
+
+
+def find_documents(src_root):
+    for dirpath, dirnames, filenames in os.walk(src_root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith('.docx') and not name.startswith('~$'):
+                yield os.path.join(dirpath, name)
+
+
+# ================== PROGRESS ==================
+def _format_eta(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m{seconds % 60:02d}s"
+
+
+def print_progress(done, total, nbytes, failed, started):
+    elapsed = max(time.perf_counter() - started, 1e-6)
+    rate = done / elapsed
+    eta = (total - done) / rate if rate else 0
+    print(f"[{done}/{total}] {rate:.1f} files/s, "
+          f"{nbytes / elapsed / 1024 / 1024:.1f} MB/s, "
+          f"{failed} failed, ETA {_format_eta(eta)}", flush=True)
+
+
+# ================== MAIN ==================
+def run(src_root, dst_root, mode, options, workers, manifest_path,
+        retry_failed=False, progress_every=5.0):
+    manifest = load_manifest(manifest_path)
+
+    tasks = []
+    source_stats = {}
+    skipped = 0
+    for src in find_documents(src_root):
+        rel_path = os.path.relpath(src, src_root)
+        dst = os.path.join(dst_root, rel_path)
+        if is_finished(manifest.get(rel_path), src, dst, retry_failed):
+            skipped += 1
+            continue
+        tasks.append((rel_path, src, dst))
+        source_stats[rel_path] = os.stat(src)
+
+    total = len(tasks)
+    print(f"{total} documents to format, {skipped} already done "
+          f"({workers} workers, mode={mode})")
+    if not total:
+        return 0
+
+    done = failed = nbytes = 0
+    started = last_report = time.perf_counter()
+
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    with open(manifest_path, 'a', encoding='utf-8') as manifest_file, \
+            multiprocessing.Pool(workers, initializer=_init_worker,
+                                 initargs=(mode, options)) as pool:
+        chunksize = max(1, min(32, total // (workers * 8)))
+        for result in pool.imap_unordered(_format_one, tasks, chunksize):
+            stat = source_stats[result['path']]
+            result['size'] = stat.st_size
+            result['mtime'] = int(stat.st_mtime)
+            manifest_file.write(json.dumps(result) + '\n')
+            manifest_file.flush()
+
+            done += 1
+            nbytes += stat.st_size
+            if result['status'] != 'ok':
+                failed += 1
+                print(f"  {result['status']}: {result['path']} - {result['error']}")
+
+            now = time.perf_counter()
+            if now - last_report >= progress_every or done == total:
+                print_progress(done, total, nbytes, failed, started)
+                last_report = now
+
+    print(f"Finished in {_format_eta(time.perf_counter() - started)}: "
+          f"{done - failed} ok, {failed} failed")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Reformat a directory tree of .docx files')
+    parser.add_argument('src', help='Directory to read .docx files from')
+    parser.add_argument('dst', help='Directory to write the mirror tree to')
+    parser.add_argument('--mode', choices=['simple', 'smart'], default='simple',
+                        help='simple = app.format_docx, smart = docformat.format_docx')
+    parser.add_argument('--font', default='Calibri')
+    parser.add_argument('--size', default='12')
+    parser.add_argument('--config', help='JSON file with the smart formatter config')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--manifest',
+                        help=f'Checkpoint manifest (default: DST/{MANIFEST_NAME})')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='Also redo unchanged files that failed or were rejected before')
+    args = parser.parse_args(argv)
+
+    config = dict(DEFAULT_SMART_CONFIG)
+    if args.config:
+        with open(args.config, encoding='utf-8') as f:
+            config.update(json.load(f))
+
+    options = {'font': args.font, 'size': args.size, 'config': config}
+    manifest_path = args.manifest or os.path.join(args.dst, MANIFEST_NAME)
+
+    return run(args.src, args.dst, args.mode, options, args.workers,
+               manifest_path, retry_failed=args.retry_failed)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
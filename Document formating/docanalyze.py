@@ -1,28 +1,56 @@
-from flask import Flask, render_template_string, request, jsonify, send_file
+from flask import Blueprint, current_app, request, jsonify, Response
 import os
+import re
+import traceback
+import json
+import difflib
+import threading
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from werkzeug.utils import secure_filename
-from transformers import LayoutLMv3ForTokenClassification, LayoutLMv3Processor
-from PIL import Image
-import torch
 from docx import Document
 from docx.enum.text import WD_COLOR_INDEX
-from pdf2image import convert_from_path
-import pythoncom
-import win32com.client
-
-app = Flask(__name__)
-
-app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['OUTPUT_FOLDER'] = 'outputs'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
-
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
-
-# ---------------- MODEL ----------------
-model_name = "microsoft/layoutlmv3-base"
-processor = LayoutLMv3Processor.from_pretrained(model_name)
-model = LayoutLMv3ForTokenClassification.from_pretrained(model_name)
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from lxml import etree
+from admission import DocumentRejected, LaneBusy
+from profiling import stage, timed_import
+from server import admission, stage_cache, inflight, outputs
+from ingest import upload_digest, save_upload
+from fair_scheduler import current_job
+from stage_cache import content_digest, image_digest, tensors_digest
+from docxstream import iter_document_elements, EXTRACTOR_VERSION
+from elements import ElementTable
+from pipeline import pipeline
+import ui
+
+bp = Blueprint('analyzer', __name__)
+
+DEFAULT_CONFIG = {
+    # /structure answers with NDJSON above this many elements unless ?format= says otherwise
+    'STRUCTURE_NDJSON_THRESHOLD': 2000,
+    # 'runs' highlights every run, 'shading' shades whole paragraphs/table cells
+    'HIGHLIGHT_MODE': 'runs',
+    # Load LayoutLMv3 in the background at startup instead of on first use
+    'LAYOUTLM_PRELOAD': False,
+    # Skip rendering, OCR and the model entirely (load tests, machines without the weights)
+    'LAYOUTLM_STUB': False,
+    # Hub id or local path of a LayoutLMv3 token classifier fine-tuned on
+    # LABEL_MAP, and its branch, tag or commit. Without one, uncertain
+    # elements keep their style/numbering labels.
+    'LAYOUTLM_MODEL': None,
+    'LAYOUTLM_REVISION': 'main',
+    # Page rasterization. LayoutLMv3 itself sees 224x224, but OCR reads the
+    # rendered page and needs roughly 100 DPI to find the words reliably.
+    'RENDER_DPI': 100,
+    'RENDER_GRAYSCALE': True,
+    # Elements the style/numbering pass scored below this are rendered and
+    # relabelled by LayoutLMv3. 0 never runs the model.
+    'LAYOUTLM_MIN_CONFIDENCE': 0.7,
+    # Pages buffered between the render, inference and highlight stages
+    'PIPELINE_QUEUE_SIZE': 2,
+}
 
 # ---------------- LABEL MAP ----------------
 LABEL_MAP = {
@@ -39,6 +67,88 @@ LABEL_MAP = {
     10: "I-LIST"
 }
 
+# ---------------- MODEL ----------------
+# OCR and tokenizer; the base weights themselves have no trained
+# classification head, so the model comes from LAYOUTLM_MODEL
+processor_name = "microsoft/layoutlmv3-base"
+# Set from LAYOUTLM_MODEL / LAYOUTLM_REVISION when the blueprint is
+# registered. Cached OCR and logits are keyed by the commit the revision
+# resolved to.
+model_name = None
+model_revision = "main"
+_model = None
+_model_trained = False
+_model_lock = threading.Lock()
+
+
+def head_is_trained(model, loading_info):
+    """
+    True if the checkpoint's classification head was fine-tuned on LABEL_MAP.
+    A head transformers had to initialize (missing weights) or one labelled
+    LABEL_0, LABEL_1... would relabel elements at random.
+    """
+    if any(key.startswith('classifier') for key in loading_info.get('missing_keys', ())):
+        return False
+    id2label = {int(label_id): label for label_id, label in model.config.id2label.items()}
+    return id2label == LABEL_MAP
+
+
+def get_model():
+    """(processor, model), loaded on first use - torch/transformers included"""
+    global _model, _model_trained
+    with _model_lock:
+        if _model is None:
+            transformers = timed_import('transformers')
+            with stage('model_load'):
+                processor = transformers.LayoutLMv3Processor.from_pretrained(
+                    processor_name)
+                classifier = transformers.LayoutLMv3ForTokenClassification
+                model, loading_info = classifier.from_pretrained(
+                    model_name, revision=model_revision, output_loading_info=True)
+            _model_trained = head_is_trained(model, loading_info)
+            if not _model_trained:
+                print(f"LayoutLM: {model_name} has no classification head trained on "
+                      f"LABEL_MAP, uncertain elements keep their style labels")
+            _model = processor, model
+        return _model
+
+
+def model_trained():
+    """Load the configured checkpoint and report whether its head can be used"""
+    if model_name is None:
+        return False
+    get_model()
+    return _model_trained
+
+
+def model_id():
+    """Model name and resolved revision, for cache keys"""
+    _, model = get_model()
+    revision = getattr(model.config, '_commit_hash', None) or model_revision
+    return f"{model_name}@{revision}"
+
+
+@bp.record_once
+def configure_model(state):
+    global model_name, model_revision
+    config = state.app.config
+    model_name = config['LAYOUTLM_MODEL']
+    model_revision = config['LAYOUTLM_REVISION']
+    if config['LAYOUTLM_STUB']:
+        return
+    if model_name is None:
+        print("LayoutLM: no fine-tuned checkpoint configured (LAYOUTLM_MODEL), "
+              "uncertain elements keep their style labels")
+    elif config['LAYOUTLM_PRELOAD']:
+        threading.Thread(target=get_model, name='layoutlm-preload',
+                         daemon=True).start()
+
+
+# Long pages are split into overlapping windows of WINDOW_SIZE tokens;
+# neighbouring windows share WINDOW_STRIDE tokens of context.
+WINDOW_SIZE = 512
+WINDOW_STRIDE = 128
+
 # ---------------- TRUE TEXT HIGHLIGHT COLORS ----------------
 HIGHLIGHT_COLORS = {
     'TITLE': WD_COLOR_INDEX.RED,
@@ -48,6 +158,15 @@ HIGHLIGHT_COLORS = {
     'LIST': WD_COLOR_INDEX.DARK_BLUE
 }
 
+# Fill colours of the highlight colours, for paragraph/cell shading
+SHADING_FILLS = {
+    WD_COLOR_INDEX.RED: 'FF0000',
+    WD_COLOR_INDEX.VIOLET: '800080',
+    WD_COLOR_INDEX.BRIGHT_GREEN: '00FF00',
+    WD_COLOR_INDEX.YELLOW: 'FFFF00',
+    WD_COLOR_INDEX.DARK_BLUE: '000080',
+}
+
 # ---------------- HTML ----------------
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -180,7 +299,7 @@ async function uploadFile() {
     loader.style.display = "block";
 
     try {
-        const response = await fetch("/analyze", {
+        const response = await fetch("{{ url_for('analyzer.analyze') }}", {
             method: "POST",
             body: formData
         });
@@ -209,140 +328,618 @@ async function uploadFile() {
 </body>
 </html>
 """
+ui.register('analyzer.index', HTML_TEMPLATE)
+
 
 # ---------------- DOCX → IMAGE ----------------
+WD_EXPORT_FORMAT_PDF = 17
+WD_EXPORT_FROM_TO = 3
 
 
-def convert_docx_to_image(docx_path):
+def export_pdf(docx_path, first_page=None, last_page=None):
+    """Have Word write the document, or only pages first..last, as a PDF"""
+    pythoncom = timed_import('pythoncom')
+    win32com_client = timed_import('win32com.client')
+
+    pdf_path = os.path.splitext(docx_path)[0] + '.pdf'
+    pythoncom.CoInitialize()
+    word = None
     try:
-        pythoncom.CoInitialize()
-        word = win32com.client.Dispatch("Word.Application")
+        word = win32com_client.Dispatch("Word.Application")
         word.Visible = False
-
-        doc = word.Documents.Open(docx_path)
-        pdf_path = docx_path.replace('.docx', '.pdf')
-        doc.SaveAs(pdf_path, FileFormat=17)
-        doc.Close()
-        word.Quit()
+        doc = word.Documents.Open(docx_path, ReadOnly=True)
+        try:
+            if first_page is None:
+                doc.ExportAsFixedFormat(pdf_path, WD_EXPORT_FORMAT_PDF)
+            else:
+                doc.ExportAsFixedFormat(pdf_path, WD_EXPORT_FORMAT_PDF,
+                                        Range=WD_EXPORT_FROM_TO,
+                                        From=first_page, To=last_page)
+        finally:
+            doc.Close(False)
+    finally:
+        # A failed export must not leave Word running in the background
+        if word is not None:
+            word.Quit()
         pythoncom.CoUninitialize()
-
-        images = convert_from_path(pdf_path)
-        os.remove(pdf_path)
-        return images[0] if images else None
-    except Exception as e:
-        print("DOCX to image error:", e)
-        return None
+    return pdf_path
+
+
+def iter_page_images(docx_path, pages=None, dpi=100, grayscale=True, prefetch=2):
+    """
+    Yield (page number, image) for the requested 1-based pages, in order
+    (every page when pages is None).
+
+    Word exports only the span of pages asked for, and each page is
+    rasterized on its own, up to prefetch pages ahead in background threads.
+    Memory therefore holds a few pages at most, however long the document
+    is. The PDF is removed once the generator is exhausted or closed.
+    """
+    pdf2image = timed_import('pdf2image')
+    pages = sorted(set(pages)) if pages is not None else None
+    if pages == []:
+        return
+
+    if pages is None:
+        pdf_path = export_pdf(docx_path)
+        offset = 0
+    else:
+        pdf_path = export_pdf(docx_path, pages[0], pages[-1])
+        offset = pages[0] - 1
+
+    executor = ThreadPoolExecutor(max(1, prefetch), thread_name_prefix='render')
+    try:
+        if pages is None:
+            pages = range(1, pdf2image.pdfinfo_from_path(pdf_path)['Pages'] + 1)
+
+        def render(page):
+            number = page - offset
+            images = pdf2image.convert_from_path(
+                pdf_path, dpi=dpi, first_page=number, last_page=number,
+                grayscale=grayscale)
+            return images[0] if images else None
+
+        pending = deque()
+        for page in pages:
+            pending.append((page, executor.submit(render, page)))
+            if len(pending) > prefetch:
+                number, future = pending.popleft()
+                yield number, future.result()
+        while pending:
+            number, future = pending.popleft()
+            yield number, future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
+
+
+def iter_rendered_pages(docx_path, pages, dpi=100, grayscale=True):
+    """
+    (page, image) for the requested pages (every page when pages is None).
+    Pages rendered before come from the stage cache, first; pages that
+    can't be rendered are left out.
+    """
+    # Pagination depends on the whole document - an edit on page 1 can move
+    # every later page - so pages are keyed by the document, not their own content
+    digest = content_digest(docx_path)
+
+    def key(page):
+        return f"{digest}:{page}:{dpi}:{int(grayscale)}"
+
+    # A whole-document render records the page count, so later requests for
+    # every page can be served page by page from the cache as well
+    count_key = f"{digest}:pages"
+    if pages is None:
+        count = stage_cache.get('page_images', count_key)
+        if count is not None:
+            pages = range(1, count + 1)
+
+    missing = None
+    if pages is not None:
+        missing = []
+        for page in pages:
+            image = stage_cache.get('page_images', key(page))
+            if image is None:
+                missing.append(page)
+            else:
+                yield page, image
+
+    if missing != []:
+        try:
+            count = 0
+            with closing(iter_page_images(os.path.abspath(docx_path), missing,
+                                          dpi, grayscale)) as rendered:
+                for page, image in rendered:
+                    count = page
+                    if image is not None:
+                        stage_cache.put('page_images', key(page), image)
+                        yield page, image
+            if missing is None:
+                stage_cache.put('page_images', count_key, count)
+        except Exception as e:
+            print("DOCX to image error:", e)
 
 # ---------------- TEXT EXTRACTION ----------------
 
 
 def extract_text_from_docx(docx_path):
-    doc = Document(docx_path)
-    elements = []
-    para_idx = 0
+    # Streamed straight from word/document.xml - tables come out where they
+    # actually are in the document instead of after all paragraphs
+    return ElementTable.from_records(iter_document_elements(docx_path))
+
+# ---------------- LAYOUTLM (WINDOWED) ----------------
+
+
+def ocr_page(image):
+    """Run OCR once per page: pixel values plus the page's words and boxes"""
+    processor, _ = get_model()
+    # Pages are rendered in grayscale; the processor wants 3 channels
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    features = processor.image_processor(image, return_tensors="pt")
+    return features['pixel_values'][0], features['words'][0], features['boxes'][0]
+
+
+def encode_windows(pixel_values, words, boxes, stride=WINDOW_STRIDE):
+    """
+    Tokenize all of a page's words into overlapping windows instead of
+    truncating at the first WINDOW_SIZE tokens.
+    Returns the batched encoding and the token -> word index map of each window.
+    """
+    processor, _ = get_model()
+    encoding = processor.tokenizer(
+        words,
+        boxes=boxes,
+        truncation=True,
+        max_length=WINDOW_SIZE,
+        stride=stride,
+        padding="max_length",
+        return_overflowing_tokens=True,
+        return_tensors="pt",
+    )
+    encoding.pop('overflow_to_sample_mapping', None)
+
+    num_windows = encoding['input_ids'].shape[0]
+    word_ids = [encoding.word_ids(i) for i in range(num_windows)]
+    encoding['pixel_values'] = pixel_values.unsqueeze(0).repeat(num_windows, 1, 1, 1)
+    return encoding, word_ids
+
+
+def merge_window_logits(logits, word_ids, num_words):
+    """Average the logits of every token of every window that covers a word"""
+    torch = timed_import('torch')
+    flat_ids = torch.tensor([-1 if w is None else w
+                             for window in word_ids for w in window])
+    flat_logits = logits.reshape(-1, logits.shape[-1])
+    keep = flat_ids >= 0
+
+    sums = torch.zeros(num_words, logits.shape[-1])
+    sums.index_add_(0, flat_ids[keep], flat_logits[keep])
+    counts = torch.bincount(flat_ids[keep], minlength=num_words).clamp(min=1)
+    return sums / counts.unsqueeze(1)
+
+
+def predict_word_labels(images, stride=WINDOW_STRIDE):
+    """
+    Label every word of every page. The windows of all pages go through the
+    model as one batched forward pass.
+    Returns one list of (word, box, label) per page.
+    """
+    torch = timed_import('torch')
+    # Different weights or processor settings must never reuse cached results
+    model_key = model_id()
+    pages = []
+    batches = []
+    for image in images:
+        pixel_values, words, boxes = stage_cache.get_or_compute(
+            'ocr', f"{model_key}:{image_digest(image)}", lambda: ocr_page(image))
+        if not words:
+            pages.append(None)
+            continue
 
-    for para in doc.paragraphs:
-        if not para.text.strip():
-            para_idx += 1
+        encoding, word_ids = encode_windows(pixel_values, words, boxes, stride)
+        key = f"{model_key}:{tensors_digest(encoding)}"
+        word_logits = stage_cache.get('logits', key)
+        if word_logits is None:
+            batches.append(encoding)
+        pages.append((words, boxes, word_ids, encoding['input_ids'].shape[0],
+                      key, word_logits))
+
+    # Only pages whose encoded input was not seen before reach the model
+    if batches:
+        batch = {key: torch.cat([b[key] for b in batches])
+                 for key in batches[0].keys()}
+        _, model = get_model()
+        with torch.no_grad():
+            logits = model(**batch).logits
+
+    results = []
+    offset = 0
+    for page in pages:
+        if page is None:
+            results.append([])
             continue
+        words, boxes, word_ids, num_windows, key, word_logits = page
+        if word_logits is None:
+            word_logits = merge_window_logits(
+                logits[offset:offset + num_windows], word_ids, len(words))
+            offset += num_windows
+            stage_cache.put('logits', key, word_logits)
 
-        if para.style.name == 'Title':
-            elements.append(
-                {'type': 'TITLE', 'text': para.text, 'para_idx': para_idx})
-        elif 'Heading' in para.style.name:
-            elements.append(
-                {'type': 'HEADING', 'text': para.text, 'para_idx': para_idx})
-        else:
-            elements.append(
-                {'type': 'PARAGRAPH', 'text': para.text, 'para_idx': para_idx})
+        labels = word_logits.argmax(-1).tolist()
+        results.append([(word, box, LABEL_MAP.get(label, "O"))
+                        for word, box, label in zip(words, boxes, labels)])
+    return results
 
-        para_idx += 1
 
-    for i, table in enumerate(doc.tables):
-        rows = []
-        for row in table.rows:
-            rows.append(" | ".join(cell.text for cell in row.cells))
-        elements.append(
-            {'type': 'TABLE', 'text': "\n".join(rows), 'table_idx': i})
+def label_page(image):
+    """LayoutLMv3's (word, box, label) for one page"""
+    return predict_word_labels([image])[0]
 
-    return elements
+# ---------------- TIERED CLASSIFICATION ----------------
 
-# ---------------- LAYOUTLM (OPTIONAL) ----------------
 
+# A row is relabelled only if at least this share of its words is found on
+# the page; the model's most common type among them then wins
+MIN_WORD_MATCH = 0.6
 
-def analyze_with_layoutlmv3(image, elements):
-    try:
-        encoding = processor(image, return_tensors="pt", truncation=True)
-        with torch.no_grad():
-            outputs = model(**encoding)
-        return elements
-    except Exception as e:
-        print("LayoutLM error:", e)
-        return elements
+
+def pages_to_render(elements, rows):
+    """
+    Pages holding the given rows, or None (every page) when the document
+    carries no page hints and everything seems to be on page 1.
+    """
+    if max(elements.page, default=0) <= 1:
+        return None
+    return sorted({elements.page[row] or 1 for row in rows})
+
+
+def _normalize(word):
+    return re.sub(r'\W+', '', word.lower())
+
+
+def _vote(tokens, page_tokens, labels, allowed):
+    """(type, share) the matched page words were mostly labelled, or None"""
+    matcher = difflib.SequenceMatcher(None, page_tokens, tokens, autojunk=False)
+    matched = [labels[block.a + i] for block in matcher.get_matching_blocks()
+               for i in range(block.size)]
+    if not matched or len(matched) < MIN_WORD_MATCH * len(tokens):
+        return None
+    counts = Counter(label.split('-', 1)[-1] for label in matched)
+    counts = Counter({t: n for t, n in counts.items() if t in allowed})
+    if not counts:
+        return None
+    element_type, votes = counts.most_common(1)[0]
+    return element_type, votes / len(matched)
+
+
+def merge_word_labels(elements, rows, page_labels):
+    """
+    Merge model word labels back into the element table. Each row's words
+    are found on its estimated page (else on any rendered page) by text
+    matching, and the type most of them were given replaces the heuristic
+    one. Tables can only stay tables or become plain (layout) paragraphs.
+    page_labels maps page -> [(word, box, label)]. Returns the rows found.
+    """
+    pages = {page: ([_normalize(word) for word, _, _ in words],
+                    [label for _, _, label in words])
+             for page, words in page_labels.items() if words}
+    found = []
+    for row in rows:
+        tokens = [t for t in map(_normalize, elements.text_at(row).split()) if t]
+        if not tokens:
+            continue
+        is_table = elements.type_at(row) == 'TABLE'
+        allowed = ('TABLE', 'PARAGRAPH') if is_table else (
+            'TITLE', 'HEADING', 'PARAGRAPH', 'LIST')
+
+        page = elements.page[row]
+        candidates = ([pages[page]] if page in pages else []) + [
+            value for number, value in pages.items() if number != page]
+        for page_tokens, labels in candidates:
+            vote = _vote(tokens, page_tokens, labels, allowed)
+            if vote is not None:
+                element_type, share = vote
+                elements.set_type(row, element_type, confidence=share)
+                found.append(row)
+                break
+    return found
 
 # ---------------- TRUE TEXT HIGHLIGHT ----------------
 
 
-def highlight_docx(input_path, elements, output_path):
+# Children that must come after w:shd inside w:pPr / w:tcPr
+PPR_AFTER_SHD = tuple(qn(t) for t in (
+    'w:tabs', 'w:suppressAutoHyphens', 'w:kinsoku', 'w:wordWrap',
+    'w:overflowPunct', 'w:topLinePunct', 'w:autoSpaceDE', 'w:autoSpaceDN',
+    'w:bidi', 'w:adjustRightInd', 'w:snapToGrid', 'w:spacing', 'w:ind',
+    'w:contextualSpacing', 'w:mirrorIndents', 'w:suppressOverlap', 'w:jc',
+    'w:textDirection', 'w:textAlignment', 'w:textboxTightWrap', 'w:outlineLvl',
+    'w:divId', 'w:cnfStyle', 'w:rPr', 'w:sectPr', 'w:pPrChange'))
+TCPR_AFTER_SHD = tuple(qn(t) for t in (
+    'w:noWrap', 'w:tcMar', 'w:textDirection', 'w:tcFitText', 'w:vAlign',
+    'w:hideMark', 'w:headers', 'w:cellIns', 'w:cellDel', 'w:cellMerge',
+    'w:tcPrChange'))
+
+
+def set_shading(props, fill, successors):
+    """Replace the w:shd of a w:pPr/w:tcPr with a solid fill"""
+    for old in props.findall(qn('w:shd')):
+        props.remove(old)
+    shd = OxmlElement('w:shd')
+    shd.set(qn('w:val'), 'clear')
+    shd.set(qn('w:color'), 'auto')
+    shd.set(qn('w:fill'), fill)
+    for child in props:
+        if child.tag in successors:
+            child.addprevious(shd)
+            break
+    else:
+        props.append(shd)
+
+
+def remove_shading(input_path, output_path):
+    """Strip the paragraph/cell shading added by highlight_docx(mode='shading')"""
     doc = Document(input_path)
+    fills = set(SHADING_FILLS.values())
+    body = doc.element.body
+    for shd in list(body.iter(qn('w:shd'))):
+        props = shd.getparent()
+        if (props.tag in (qn('w:pPr'), qn('w:tcPr'))
+                and shd.get(qn('w:fill')) in fills):
+            props.remove(shd)
+    doc.save(output_path)
 
-    para_map = {el['para_idx']: el['type']
-                for el in elements if 'para_idx' in el}
-
-    # Highlight paragraphs
-    for idx, para in enumerate(doc.paragraphs):
-        if idx in para_map:
-            color = HIGHLIGHT_COLORS.get(para_map[idx])
-            if color:
-                for run in para.runs:
-                    run.font.color.rgb = None
-                    run.font.highlight_color = color
-
-    # Highlight tables
-    for el in elements:
-        if 'table_idx' in el and el['table_idx'] < len(doc.tables):
-            table = doc.tables[el['table_idx']]
-            for row in table.rows:
-                for cell in row.cells:
-                    for para in cell.paragraphs:
-                        for run in para.runs:
-                            run.font.highlight_color = WD_COLOR_INDEX.YELLOW
 
-    doc.save(output_path)
+class Highlighter:
+    """
+    Colours the elements of one document one at a time, so elements can be
+    highlighted as soon as their type is final.
+    mode='runs' sets the highlight colour on every run. mode='shading' sets
+    one w:shd per paragraph and per table cell instead and leaves the runs
+    untouched, so it costs one write per paragraph/cell and is easy to undo
+    (remove_shading).
+    """
+
+    def __init__(self, input_path, mode='runs'):
+        self.doc = Document(input_path)
+        self.shading = mode == 'shading'
+        self.paragraphs = self.doc.paragraphs
+        self.tables = self.doc.tables
+
+    def element(self, elements, row):
+        element_type = elements.type_at(row)
+        para_idx = elements.para_idx[row]
+        if para_idx >= 0:
+            if para_idx < len(self.paragraphs):
+                self.paragraph(self.paragraphs[para_idx], element_type)
+        elif elements.table_idx[row] < len(self.tables):
+            # A table the model took for layout keeps the paragraph colour
+            self.table(self.tables[elements.table_idx[row]], element_type)
+
+    def paragraph(self, para, element_type):
+        color = HIGHLIGHT_COLORS.get(element_type)
+        if color and self.shading:
+            set_shading(para._p.get_or_add_pPr(), SHADING_FILLS[color],
+                        PPR_AFTER_SHD)
+        elif color:
+            for run in para.runs:
+                run.font.color.rgb = None
+                run.font.highlight_color = color
+
+    def table(self, table, element_type='TABLE'):
+        color = HIGHLIGHT_COLORS.get(element_type, HIGHLIGHT_COLORS['TABLE'])
+        if self.shading:
+            fill = SHADING_FILLS[color]
+            for tr in table._tbl.tr_lst:
+                for tc in tr.tc_lst:
+                    set_shading(tc.get_or_add_tcPr(), fill, TCPR_AFTER_SHD)
+            return
+        for row in table.rows:
+            for cell in row.cells:
+                for para in cell.paragraphs:
+                    for run in para.runs:
+                        run.font.highlight_color = color
+
+    def save(self, output_path):
+        self.doc.save(output_path)
+
+
+def highlight_docx(input_path, elements, output_path, mode='runs'):
+    highlighter = Highlighter(input_path, mode)
+    for row in range(len(elements)):
+        highlighter.element(elements, row)
+    highlighter.save(output_path)
+
+# ---------------- PIPELINE ----------------
+
+
+def relabelling_enabled(config):
+    """False when stubbed, or without a loadable checkpoint trained on LABEL_MAP"""
+    if config['LAYOUTLM_STUB']:
+        return False
+    try:
+        return model_trained()
+    except Exception as e:
+        print(f"LayoutLM failed to load, keeping style labels: {e}")
+        return False
+
+
+def analyze_document(input_path, elements, output_path, config):
+    """
+    Classify and highlight one document.
+
+    Confident elements are highlighted straight away. The pages holding
+    uncertain ones stream through rendering and inference, each in its own
+    pipeline thread, while this thread merges every page's labels and
+    highlights its elements as soon as they arrive. Page N+1 is therefore
+    rendered while page N is in the model.
+    """
+    rows = elements.uncertain_rows(config['LAYOUTLM_MIN_CONFIDENCE'])
+    pending = set(rows)
+
+    with stage('highlight'):
+        highlighter = Highlighter(input_path, config['HIGHLIGHT_MODE'])
+        for row in range(len(elements)):
+            if row not in pending:
+                highlighter.element(elements, row)
+
+    if rows and not relabelling_enabled(config):
+        # Nothing would be relabelled, so nothing is rendered either - the
+        # style/numbering labels stand
+        with stage('highlight'):
+            for row in rows:
+                highlighter.element(elements, row)
+        print(f"LayoutLM off, kept style labels for {len(rows)} uncertain elements")
+    elif rows:
+        by_page = defaultdict(list)
+        for row in rows:
+            by_page[elements.page[row]].append(row)
+        page_labels = {}
+
+        pages = iter_rendered_pages(input_path, pages_to_render(elements, rows),
+                                    config['RENDER_DPI'], config['RENDER_GRAYSCALE'])
+        labelled = pipeline(('render', pages),
+                            [('inference', lambda item: (item[0], label_page(item[1])))],
+                            config['PIPELINE_QUEUE_SIZE'],
+                            current_app._get_current_object().app_context)
+        try:
+            for page, words in labelled:
+                page_labels[page] = words
+                with stage('highlight'):
+                    for row in merge_word_labels(elements, by_page.pop(page, []),
+                                                 {page: words}):
+                        highlighter.element(elements, row)
+                        pending.discard(row)
+        except Exception as e:
+            # Pages labelled before the failure still count
+            print(f"LayoutLM failed, keeping style labels: {e}")
+            traceback.print_exc()
+
+        # Rows on a mis-estimated or unrendered page: any page, else the
+        # style/numbering label stands
+        with stage('highlight'):
+            matched = len(rows) - len(pending)
+            matched += len(merge_word_labels(elements, sorted(pending), page_labels))
+            for row in sorted(pending):
+                highlighter.element(elements, row)
+        print(f"LayoutLM labelled {sum(len(w) for w in page_labels.values())} words "
+              f"on {len(page_labels)} page(s), matched {matched} of "
+              f"{len(rows)} uncertain elements")
+
+    with stage('save'):
+        highlighter.save(output_path)
+    return elements
 
 # ---------------- ROUTES ----------------
 
 
-@app.route('/')
+@bp.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    # Rendered and compressed once at startup
+    return ui.serve('analyzer.index')
 
 
-@app.route('/analyze', methods=['POST'])
+@bp.route('/analyze', methods=['POST'])
 def analyze():
     file = request.files.get('file')
     if not file or not file.filename.endswith('.docx'):
         return jsonify({'error': 'Invalid file'}), 400
 
     filename = secure_filename(file.filename)
-    input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(input_path)
+    output_file = filename.replace('.docx', '_highlighted.docx')
+    digest = upload_digest(file)
+
+    def run_analysis():
+        # Named by content so concurrent uploads of same-named files don't clash
+        input_path = os.path.join(current_app.config['UPLOAD_FOLDER'],
+                                  f"{digest[:16]}_{filename}")
+        output_path = os.path.join(current_app.config['OUTPUT_FOLDER'],
+                                   f"{digest[:16]}_{output_file}")
+        save_upload(file, input_path)
+
+        try:
+            with admission.admit(input_path, current_job()):
+                with stage('extract'):
+                    elements = stage_cache.get_or_compute(
+                        'element_table', f"{digest}:{EXTRACTOR_VERSION}",
+                        lambda: extract_text_from_docx(input_path))
+
+                # Only what the style/numbering pass could not decide goes to
+                # the model, only its pages are rendered, and rendering,
+                # inference and highlighting overlap page by page
+                analyze_document(input_path, elements, output_path, current_app.config)
+        finally:
+            os.remove(input_path)
+        return outputs.put(output_path, output_file)
+
+    # Identical documents submitted while one is being analyzed share its run
+    try:
+        output_key, coalesced = inflight.do(('analyze', digest), run_analysis)
+    except DocumentRejected as e:
+        return jsonify({'error': str(e)}), e.status
+    except LaneBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
 
-    elements = extract_text_from_docx(input_path)
+    # Stays downloadable from /outputs/<X-Output-Key> until it expires
+    return outputs.send(output_key)
 
-    image = convert_docx_to_image(os.path.abspath(input_path))
-    if image:
-        elements = analyze_with_layoutlmv3(image, elements)
 
-    output_file = filename.replace('.docx', '_highlighted.docx')
-    output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_file)
+@bp.route('/structure', methods=['POST'])
+def structure():
+    """Element classification only - no rendering, inference or DOCX output"""
+    file = request.files.get('file')
+    if not file or not file.filename.endswith('.docx'):
+        return jsonify({'error': 'Invalid file'}), 400
 
-    highlight_docx(input_path, elements, output_path)
-    os.remove(input_path)
+    include_text = request.args.get('text', '0') == '1'
+    digest = upload_digest(file)
 
-    return send_file(output_path, as_attachment=True)
+    # The upload is read in place - zipfile only needs a seekable stream
+    try:
+        with admission.admit(file.stream, current_job()):
+            with stage('extract'):
+                elements = stage_cache.get_or_compute(
+                    'element_table', f"{digest}:{EXTRACTOR_VERSION}",
+                    lambda: extract_text_from_docx(file.stream))
+    except DocumentRejected as e:
+        return jsonify({'error': str(e)}), e.status
+    except etree.XMLSyntaxError:
+        return jsonify({'error': 'File is not a valid .docx package'}), 400
+    except LaneBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+
+    output = request.args.get('format')
+    if output is None:
+        big = len(elements) > current_app.config['STRUCTURE_NDJSON_THRESHOLD']
+        output = 'ndjson' if big else 'json'
+
+    if output == 'ndjson':
+        def generate():
+            for row in range(len(elements)):
+                yield json.dumps(elements.record(row, include_text)) + '\n'
+
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    return jsonify({
+        'sha256': digest,
+        'count': len(elements),
+        'elements': elements.to_dicts(include_text)
+    })
+
+
+@bp.route('/api/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        'admission': admission.stats(),
+        'coalescing': inflight.stats(),
+        'stage_cache': stage_cache.stats(),
+        'outputs': outputs.stats()
+    })
 
 
 # ---------------- RUN ----------------
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    from server import create_app
+    create_app(mounts={'analyzer': ''}).run(debug=True, port=5000)
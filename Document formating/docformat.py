@@ -1,32 +1,36 @@
-from flask import Flask, render_template_string, request, send_file, jsonify
-import os, json
+from flask import Blueprint, current_app, request, jsonify
+import os, json, hashlib
 from werkzeug.utils import secure_filename
 
 from docx import Document
 from docx.shared import Pt
 from docx.enum.text import WD_COLOR_INDEX
 
-import pythoncom
-import win32com.client
-from pdf2image import convert_from_path
-
 from docx.oxml import OxmlElement, ns
 
+from admission import DocumentRejected, LaneBusy
+from profiling import stage
+from workers import get_worker_pool, WorkerCrashed, WorkerJobError, WorkerPoolBusy
+from server import admission, stage_cache, inflight, outputs
+from ingest import upload_digest, save_upload
+from fair_scheduler import current_job
+from docxstream import iter_document_elements, EXTRACTOR_VERSION
+from elements import ElementTable
+import sharding
+import ui
+
 
 # ================== FLASK SETUP ==================
-app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['OUTPUT_FOLDER'] = 'outputs'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+bp = Blueprint("smart", __name__)
 
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
+DEFAULT_CONFIG = dict(sharding.DEFAULT_CONFIG)
 
 # ================== COLORS ==================
 HIGHLIGHT_COLORS = {
     "TITLE": WD_COLOR_INDEX.YELLOW,
     "HEADING": WD_COLOR_INDEX.BRIGHT_GREEN,
     "PARAGRAPH": WD_COLOR_INDEX.GRAY_25,
+    "LIST": WD_COLOR_INDEX.PINK,
     "TABLE": WD_COLOR_INDEX.TURQUOISE
 }
 
@@ -115,7 +119,7 @@ async function submitDoc(){
     fd.append("file", file);
     fd.append("config", JSON.stringify(config));
 
-    let res = await fetch("/analyze", {method:"POST", body:fd});
+    let res = await fetch("{{ url_for('smart.analyze') }}", {method:"POST", body:fd});
     let blob = await res.blob();
 
     let a = document.createElement("a");
@@ -127,32 +131,14 @@ async function submitDoc(){
 </body>
 </html>
 """
+ui.register("smart.index", HTML_TEMPLATE)
+
 
 # ================== UTILITIES ==================
 def extract_text_structure(docx_path):
-    doc = Document(docx_path)
-    elements = []
-    idx = 0
-
-    for p in doc.paragraphs:
-        if not p.text.strip():
-            idx += 1
-            continue
-
-        if p.style.name == "Title":
-            t = "TITLE"
-        elif "Heading" in p.style.name:
-            t = "HEADING"
-        else:
-            t = "PARAGRAPH"
-
-        elements.append({"type": t, "para_idx": idx})
-        idx += 1
-
-    for i, _ in enumerate(doc.tables):
-        elements.append({"type": "TABLE", "table_idx": i})
-
-    return elements
+    # Streamed from word/document.xml in document order, without building a Document
+    return ElementTable.from_records(
+        iter_document_elements(docx_path, include_text=False))
 
 def add_border_to_run_images(run, border_pt=0.25):
     """
@@ -224,64 +210,73 @@ def add_border_to_run_images(run, border_pt=0.25):
     ## graphic.append(ln)
 
 
-def format_docx(input_path, elements, output_path, config):
-    doc = Document(input_path)
+def format_paragraph(para, ptype, config):
+    for run in para.runs:
+        # IMAGE HANDLING
+        if run._element.xpath('.//w:drawing'):
+            with stage("images"):
+                add_border_to_run_images(run, border_pt=0.25)
+            continue
 
-    para_map = {e["para_idx"]: e["type"] for e in elements if "para_idx" in e}
+        if not ptype:
+            continue
 
-    # -------- FORMAT PARAGRAPHS --------
-    for idx, para in enumerate(doc.paragraphs):
-        ptype = para_map.get(idx)
+        if ptype == "TITLE":
+            run.font.name = config["title_font"]
+            run.font.size = Pt(int(config["title_size"]))
+            run.font.bold = config["bold_titles"]
 
-        for run in para.runs:
-            # IMAGE HANDLING
-            if run._element.xpath('.//w:drawing'):
-                add_border_to_run_images(run, border_pt=0.25)
-                continue
+        elif ptype == "HEADING":
+            run.font.name = config["heading_font"]
+            run.font.size = Pt(int(config["heading_size"]))
+            run.font.bold = True
 
-            if not ptype:
-                continue
+        elif ptype in ("PARAGRAPH", "LIST"):
+            run.font.name = config["para_font"]
+            run.font.size = Pt(int(config["para_size"]))
 
-            if ptype == "TITLE":
-                run.font.name = config["title_font"]
-                run.font.size = Pt(int(config["title_size"]))
-                run.font.bold = config["bold_titles"]
+        if config["highlight"]:
+            run.font.highlight_color = HIGHLIGHT_COLORS.get(ptype)
 
-            elif ptype == "HEADING":
-                run.font.name = config["heading_font"]
-                run.font.size = Pt(int(config["heading_size"]))
-                run.font.bold = True
 
-            elif ptype == "PARAGRAPH":
-                run.font.name = config["para_font"]
-                run.font.size = Pt(int(config["para_size"]))
+def format_table(table, config):
+    for row in table.rows:
+        for cell in row.cells:
+            for para in cell.paragraphs:
+                for run in para.runs:
+                    # IMAGE IN TABLE
+                    if run._element.xpath('.//w:drawing'):
+                        with stage("images"):
+                            add_border_to_run_images(run, border_pt=0.25)
+                    elif config["highlight"]:
+                        run.font.highlight_color = WD_COLOR_INDEX.YELLOW
 
-            if config["highlight"]:
-                run.font.highlight_color = HIGHLIGHT_COLORS.get(ptype)
+
+def format_docx(input_path, elements, output_path, config):
+    with stage("parse"):
+        doc = Document(input_path)
+
+    # -------- FORMAT PARAGRAPHS --------
+    for idx, para in enumerate(doc.paragraphs):
+        format_paragraph(para, elements.type_of_para(idx), config)
 
     # -------- FORMAT TABLES --------
-    for e in elements:
-        if e["type"] == "TABLE" and e["table_idx"] < len(doc.tables):
-            table = doc.tables[e["table_idx"]]
-            for row in table.rows:
-                for cell in row.cells:
-                    for para in cell.paragraphs:
-                        for run in para.runs:
-                            # IMAGE IN TABLE
-                            if run._element.xpath('.//w:drawing'):
-                                add_border_to_run_images(run, border_pt=0.25)
-                            elif config["highlight"]:
-                                run.font.highlight_color = WD_COLOR_INDEX.YELLOW
-
-    doc.save(output_path)
+    tables = doc.tables
+    for row_idx in elements.table_rows():
+        if elements.table_idx[row_idx] < len(tables):
+            format_table(tables[elements.table_idx[row_idx]], config)
+
+    with stage("save"):
+        doc.save(output_path)
 
 
 # ================== ROUTES ==================
-@app.route("/")
+@bp.route("/")
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    # Rendered and compressed once at startup
+    return ui.serve("smart.index")
 
-@app.route("/analyze", methods=["POST"])
+@bp.route("/analyze", methods=["POST"])
 def analyze():
     file = request.files.get("file")
     config = json.loads(request.form.get("config"))
@@ -292,21 +287,73 @@ def analyze():
     original_name = secure_filename(file.filename)
     base, ext = os.path.splitext(original_name)
 
-    input_path = os.path.join(app.config["UPLOAD_FOLDER"], original_name)
     output_filename = f"{base}_formatted{ext}"
-    output_path = os.path.join(app.config["OUTPUT_FOLDER"], output_filename)
 
     # fname = secure_filename(file.filename)
-    # in_path = os.path.join(app.config["UPLOAD_FOLDER"], fname)
-    # out_path = os.path.join(app.config["OUTPUT_FOLDER"], fname.replace(".docx","_formatted.docx"))
-
-    file.save(input_path)
-
-    elements = extract_text_structure(input_path)
-    format_docx(input_path, elements, output_path, config)
-
-    return send_file(output_path, as_attachment=True, download_name=output_filename)
+    # in_path = os.path.join(current_app.config["UPLOAD_FOLDER"], fname)
+    # out_path = os.path.join(current_app.config["OUTPUT_FOLDER"], fname.replace(".docx","_formatted.docx"))
+
+    digest = upload_digest(file)
+    job_key = hashlib.sha256(
+        (digest + json.dumps(config, sort_keys=True)).encode()).hexdigest()[:16]
+
+    def run_format():
+        input_path = os.path.join(current_app.config["UPLOAD_FOLDER"], f"{job_key}_{original_name}")
+        output_path = os.path.join(current_app.config["OUTPUT_FOLDER"], f"{job_key}_{output_filename}")
+        save_upload(file, input_path)
+
+        try:
+            with admission.admit(input_path, current_job()) as estimate:
+                shard_min_cost = current_app.config["SHARD_MIN_COST"]
+                if shard_min_cost is not None and estimate["cost"] >= shard_min_cost:
+                    # One huge document: spread its sections over all cores
+                    with stage("format_sharded"):
+                        sharding.format_docx_sharded(input_path, output_path, config,
+                                                     current_app.config["SHARD_WORKERS"],
+                                                     current_app.config["SHARD_SIZE"])
+                else:
+                    with stage("extract"):
+                        # Re-running with a different font config skips extraction
+                        elements = stage_cache.get_or_compute(
+                            "structure_table", f"{digest}:{EXTRACTOR_VERSION}",
+                            lambda: extract_text_structure(input_path))
+                    with stage("format"):
+                        pool = get_worker_pool(current_app.config, preload=["docformat"])
+                        if pool is None:
+                            format_docx(input_path, elements, output_path, config)
+                        else:
+                            pool.run("docformat:format_docx",
+                                     input_path, elements, output_path, config)
+        finally:
+            os.remove(input_path)
+        return outputs.put(output_path, output_filename)
+
+    # Same document + same config while one is in flight -> share its result
+    try:
+        output_key, coalesced = inflight.do(job_key, run_format)
+    except DocumentRejected as e:
+        return jsonify({"error": str(e)}), e.status
+    except (LaneBusy, WorkerPoolBusy) as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    except (WorkerCrashed, WorkerJobError) as e:
+        print(f"Error formatting document: {str(e)}")
+        return jsonify({"error": f"Formatting failed: {e}"}), 500
+
+    # Stays downloadable from /outputs/<X-Output-Key> until it expires
+    return outputs.send(output_key)
+
+@bp.route("/api/stats", methods=["GET"])
+def stats():
+    pool = get_worker_pool(current_app.config, preload=["docformat"], start=False)
+    return jsonify({
+        "admission": admission.stats(),
+        "coalescing": inflight.stats(),
+        "stage_cache": stage_cache.stats(),
+        "outputs": outputs.stats(),
+        "workers": pool.stats() if pool else None
+    })
 
 # ================== RUN ==================
 if __name__ == "__main__":
-    app.run(debug=True, port=5000)
+    from server import create_app
+    create_app(mounts={"smart": ""}).run(debug=True, port=5000)
@@ -0,0 +1,498 @@
+import re
+import zipfile
+
+from lxml import etree
+from docx.styles import BabelFish
+
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+W = '{%s}' % W_NS
+
+BODY = W + 'body'
+P = W + 'p'
+TBL = W + 'tbl'
+R = W + 'r'
+
+# Run children that contribute text, the same set python-docx's Run.text reads
+RUN_TEXT = {
+    W + 't': None,
+    W + 'tab': '\t',
+    W + 'br': '\n',
+    W + 'cr': '\n',
+    W + 'noBreakHyphen': '-',
+    W + 'ptab': '\t',
+}
+
+# Part of the cache key of everything extracted from a document: bump it
+# whenever a change here alters what iter_document_elements yields, or the
+# pickled layout of ElementTable changes
+EXTRACTOR_VERSION = 4
+
+
+# ================== STYLES ==================
+def _read_part(zf, name):
+    try:
+        return etree.fromstring(zf.read(name))
+    except KeyError:
+        return None
+
+
+def _num_pr(ppr):
+    """(numId, ilvl) of a w:pPr's w:numPr, None where a value is not given"""
+    num_pr = ppr.find(W + 'numPr') if ppr is not None else None
+    if num_pr is None:
+        return None
+    num_id = num_pr.find(W + 'numId')
+    ilvl = num_pr.find(W + 'ilvl')
+    return (num_id.get(W + 'val') if num_id is not None else None,
+            int(ilvl.get(W + 'val')) if ilvl is not None else None)
+
+
+def load_styles(zf):
+    """
+    Paragraph styles from styles.xml, which is small and parsed in one go.
+    Returns (UI names by id ("Heading 1", "Title"...), id of the default
+    paragraph style, (numId, ilvl) by id of the styles that number their
+    paragraphs - directly or through basedOn). The numbering of list
+    (numbering-type) styles is included, for numStyleLink in numbering.xml.
+    """
+    names = {}
+    default_id = None
+    root = _read_part(zf, 'word/styles.xml')
+    if root is None:
+        return names, default_id, {}
+
+    list_styles = []
+    based_on = {}
+    own_numbering = {}
+    for style in root.iter(W + 'style'):
+        style_type = style.get(W + 'type')
+        style_id = style.get(W + 'styleId')
+        if style_type == 'numbering':
+            list_styles.append(style_id)
+        elif style_type == 'paragraph':
+            name = style.find(W + 'name')
+            names[style_id] = BabelFish.internal2ui(
+                name.get(W + 'val') if name is not None else style_id)
+            if style.get(W + 'default') in ('1', 'true', 'on'):
+                default_id = style_id
+        else:
+            continue
+
+        parent = style.find(W + 'basedOn')
+        if parent is not None:
+            based_on[style_id] = parent.get(W + 'val')
+        num_pr = _num_pr(style.find(W + 'pPr'))
+        if num_pr is not None:
+            own_numbering[style_id] = num_pr
+
+    numbering = {}
+    for style_id in [*names, *list_styles]:
+        # Walk up basedOn; the nearest numId/ilvl wins, cycles are cut off
+        num_id = ilvl = None
+        seen = set()
+        current = style_id
+        while current is not None and current not in seen:
+            seen.add(current)
+            own_num_id, own_ilvl = own_numbering.get(current, (None, None))
+            if num_id is None:
+                num_id = own_num_id
+            if ilvl is None:
+                ilvl = own_ilvl
+            current = based_on.get(current)
+        if num_id is not None:
+            numbering[style_id] = (num_id, ilvl or 0)
+    return names, default_id, numbering
+
+
+def load_numbering(zf, style_numbering=None):
+    """
+    Index numbering.xml once: numId -> {ilvl: numFmt}, following
+    w:num -> w:abstractNum (or its numStyleLink) plus w:lvlOverride.
+    numIds that number nothing (numFmt "none" on every level) are left out.
+    """
+    root = _read_part(zf, 'word/numbering.xml')
+    if root is None:
+        return {}
+
+    abstract_levels = {}
+    style_links = {}
+    for abstract in root.iterchildren(W + 'abstractNum'):
+        abstract_id = abstract.get(W + 'abstractNumId')
+        abstract_levels[abstract_id] = {
+            int(lvl.get(W + 'ilvl', 0)): _num_fmt(lvl)
+            for lvl in abstract.iterchildren(W + 'lvl')}
+        link = abstract.find(W + 'numStyleLink')
+        if link is not None:
+            style_links[abstract_id] = link.get(W + 'val')
+
+    num_abstract = {}
+    overrides = {}
+    for num in root.iterchildren(W + 'num'):
+        num_id = num.get(W + 'numId')
+        abstract_id = num.find(W + 'abstractNumId')
+        if abstract_id is None:
+            continue
+        num_abstract[num_id] = abstract_id.get(W + 'val')
+        overrides[num_id] = {
+            int(override.get(W + 'ilvl', 0)): _num_fmt(override.find(W + 'lvl'))
+            for override in num.iterchildren(W + 'lvlOverride')
+            if override.find(W + 'lvl') is not None}
+
+    index = {}
+    for num_id, abstract_id in num_abstract.items():
+        levels = abstract_levels.get(abstract_id, {})
+        link = style_links.get(abstract_id)
+        if link is not None and style_numbering and link in style_numbering:
+            # List style: its levels live on the numbering the style points at
+            linked = num_abstract.get(style_numbering[link][0])
+            levels = abstract_levels.get(linked, levels)
+        levels = {**levels, **overrides[num_id]}
+        if any(fmt != 'none' for fmt in levels.values()):
+            index[num_id] = levels
+    return index
+
+
+def _num_fmt(lvl):
+    fmt = lvl.find(W + 'numFmt') if lvl is not None else None
+    return fmt.get(W + 'val') if fmt is not None else 'decimal'
+
+
+# How sure the style-based classification is, by how the type was decided
+STYLE_CONFIDENCE = {
+    'TITLE': 0.95,
+    'HEADING': 0.95,
+    'LIST': 0.95,
+    'PARAGRAPH': 0.8,
+}
+# Body-styled paragraphs that look like headings, tables without a style
+# (data or just layout?) - left for the model to decide
+AMBIGUOUS_CONFIDENCE = 0.5
+
+# Longer paragraphs are never taken for unstyled headings
+HEADING_MAX_CHARS = 100
+# Direct run size (half-points) from which short text reads as a heading
+HEADING_MIN_SIZE = 28
+
+
+def classify_style(style_name):
+    if style_name == 'Title':
+        return 'TITLE'
+    if 'Heading' in style_name:
+        return 'HEADING'
+    return 'PARAGRAPH'
+
+
+def is_on(props, tag):
+    """True if a w:rPr/w:pPr toggle (w:b, w:caps...) is set and not switched off"""
+    elem = props.find(W + tag) if props is not None else None
+    return elem is not None and elem.get(W + 'val') not in ('0', 'false', 'off')
+
+
+def looks_like_heading(p, text):
+    """
+    Short body-styled text formatted like a heading: an outline level, or
+    every run bold, all caps or large. Only direct formatting is read.
+    """
+    text = text.strip()
+    if not text or len(text) > HEADING_MAX_CHARS or text[-1] in '.,;!?':
+        return False
+    ppr = p.find(W + 'pPr')
+    if ppr is not None and ppr.find(W + 'outlineLvl') is not None:
+        return True
+
+    runs = [r for r in p.iter(R) if r.find(W + 't') is not None]
+    if not runs:
+        return False
+    props = [r.find(W + 'rPr') for r in runs]
+    if all(is_on(rpr, 'b') for rpr in props):
+        return True
+    if all(is_on(rpr, 'caps') for rpr in props) or (text.isupper() and len(text) > 3):
+        return True
+    sizes = [rpr.find(W + 'sz') if rpr is not None else None for rpr in props]
+    return all(sz is not None and int(sz.get(W + 'val', 0)) >= HEADING_MIN_SIZE
+               for sz in sizes)
+
+
+def classify_table(tbl):
+    """(type, confidence) of a w:tbl - unstyled tables are often just layout"""
+    if tbl.find(f'{W}tblPr/{W}tblStyle') is None:
+        return 'TABLE', AMBIGUOUS_CONFIDENCE
+    return 'TABLE', 1.0
+
+
+class ParagraphClassifier:
+    """
+    Classifies body paragraphs from their style and numbering. Holds only
+    plain dicts, so it can be shipped to worker processes that classify parts
+    of a document.
+    """
+
+    def __init__(self, style_names, default_style, style_numbering=None,
+                 numbering=None):
+        self.style_names = style_names
+        self.default_style = default_style
+        self.default_name = style_names.get(default_style, 'Normal')
+        self.style_numbering = style_numbering or {}
+        self.numbering = numbering or {}
+
+    @classmethod
+    def from_package(cls, zf):
+        names, default_style, style_numbering = load_styles(zf)
+        return cls(names, default_style, style_numbering,
+                   load_numbering(zf, style_numbering))
+
+    def style_name(self, p):
+        style = p.find(f'{W}pPr/{W}pStyle')
+        if style is None:
+            return self.default_name
+        return self.style_names.get(style.get(W + 'val'), self.default_name)
+
+    def list_level(self, p):
+        """
+        (numId, ilvl) if the paragraph is a numbered/bulleted list item,
+        from its own w:numPr or its style's. None otherwise.
+        """
+        ppr = p.find(W + 'pPr')
+        style = ppr.find(W + 'pStyle') if ppr is not None else None
+        style_id = style.get(W + 'val') if style is not None else self.default_style
+        num_id, ilvl = self.style_numbering.get(style_id, (None, 0))
+
+        direct = _num_pr(ppr)
+        if direct is not None:
+            num_id = direct[0] if direct[0] is not None else num_id
+            ilvl = direct[1] if direct[1] is not None else ilvl
+
+        # numId 0 (or one numbering.xml doesn't define) switches numbering off
+        levels = self.numbering.get(num_id)
+        if levels is None or levels.get(ilvl, 'decimal') == 'none':
+            return None
+        return num_id, ilvl
+
+    def classify(self, p, text=None):
+        """(type, confidence) of a non-empty w:p; text saves re-reading it"""
+        element_type = classify_style(self.style_name(p))
+        # Numbered headings stay headings; everything else numbered is a list
+        if element_type == 'PARAGRAPH' and self.list_level(p) is not None:
+            element_type = 'LIST'
+        if element_type == 'PARAGRAPH' and looks_like_heading(
+                p, paragraph_text(p) if text is None else text):
+            return element_type, AMBIGUOUS_CONFIDENCE
+        return element_type, STYLE_CONFIDENCE[element_type]
+
+
+# ================== TEXT ==================
+def _run_text(r, parts):
+    for child in r:
+        if child.tag in RUN_TEXT:
+            text = RUN_TEXT[child.tag]
+            parts.append((child.text or '') if text is None else text)
+
+
+def iter_runs(p):
+    """The w:r of a w:p that python-docx's Paragraph.runs sees, plus hyperlink runs"""
+    for child in p:
+        if child.tag == R:
+            yield child
+        elif child.tag == W + 'hyperlink':
+            yield from child.iterchildren(R)
+
+
+def paragraph_text(p, spans=None):
+    """
+    Text of a w:p as python-docx's Paragraph.text sees it (direct runs and
+    hyperlink runs). If spans is a list, (start, end) of every run is appended.
+    """
+    parts = []
+    length = 0
+    for r in iter_runs(p):
+        before = len(parts)
+        _run_text(r, parts)
+        run_length = sum(len(s) for s in parts[before:])
+        if spans is not None and run_length:
+            spans.append((length, length + run_length))
+        length += run_length
+    return ''.join(parts)
+
+
+def table_text(tbl):
+    """Rows joined by newlines, cells by " | " - like joining row.cells text"""
+    rows = []
+    for tr in tbl.iterchildren(W + 'tr'):
+        cells = []
+        for tc in tr.iterchildren(W + 'tc'):
+            text = '\n'.join(paragraph_text(p) for p in tc.iterchildren(P))
+            span = tc.find(f'{W}tcPr/{W}gridSpan')
+            cells.extend([text] * (int(span.get(W + 'val')) if span is not None else 1))
+        rows.append(' | '.join(cells))
+    return '\n'.join(rows)
+
+
+# ================== PAGES ==================
+SECT_PR = W + 'sectPr'
+
+# Section types that start the section on a new page
+PAGE_SECTION_TYPES = ('nextPage', 'oddPage', 'evenPage')
+
+_SECT_PR_START = re.compile(rb'<w:sectPr[\s/>]')
+_SECT_TYPE = re.compile(rb'<w:type\s+w:val="(\w+)"')
+
+
+def _sect_pr_end(buffer, start):
+    """End of the w:sectPr starting at start, None if it isn't all in buffer"""
+    tag_end = buffer.find(b'>', start)
+    if tag_end < 0:
+        return None
+    if buffer[tag_end - 1:tag_end] == b'/':
+        return tag_end + 1
+    # A tracked change's old sectPr is nested inside the new one and ends
+    # first, but the section's own w:type comes before it
+    end = buffer.find(b'</w:sectPr>', tag_end)
+    return None if end < 0 else end + len(b'</w:sectPr>')
+
+
+def section_types(zf, chunk_size=1024 * 1024):
+    """
+    The w:type of every section of word/document.xml in order ('nextPage'
+    where none is given), the body-level w:sectPr last. A section's type says
+    how it starts after the previous one, so it is only known once the whole
+    section has been read - the streaming extractor needs them up front.
+    Found by scanning the raw bytes: sectPrs are rare and tiny, parsing the
+    whole part a second time would cost as much as extracting it.
+    """
+    types = []
+    buffer = b''
+    with zf.open('word/document.xml') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            buffer += chunk
+            position = 0
+            while True:
+                start = _SECT_PR_START.search(buffer, position)
+                if start is None:
+                    # Keep what could be the start of a split '<w:sectPr'
+                    buffer = buffer[max(position, len(buffer) - 16):]
+                    break
+                end = _sect_pr_end(buffer, start.start())
+                if end is None:
+                    buffer = buffer[start.start():]
+                    break
+                section_type = _SECT_TYPE.search(buffer, start.start(), end)
+                types.append(section_type.group(1).decode() if section_type
+                             else 'nextPage')
+                position = end
+            if not chunk:
+                return types
+
+
+class PageCounter:
+    """
+    Estimates the page each body element starts on, from the page breaks
+    Word recorded when it last laid the document out (w:lastRenderedPageBreak)
+    and from manual page breaks and section breaks that start a new page.
+    Documents Word never saved only have the manual ones, so everything
+    between two of those counts as one page. Odd/even page sections count
+    as one page even where Word inserts a blank one.
+    """
+
+    def __init__(self, section_types=()):
+        self.page = 1
+        self._manual = False
+        self._section_types = list(section_types)
+        self._section = 0
+
+    def _break(self, manual):
+        if manual:
+            self.page += 1
+            self._manual = True
+        elif self._manual:
+            # Word marks the page a manual break started as well
+            self._manual = False
+        else:
+            self.page += 1
+
+    def _section_break(self):
+        """The paragraph just read ends a section; the next one's type decides"""
+        self._section += 1
+        if self._section < len(self._section_types):
+            next_type = self._section_types[self._section]
+        else:
+            next_type = 'nextPage'
+        if next_type in PAGE_SECTION_TYPES:
+            self._break(True)
+
+    def element(self, elem):
+        """Page elem starts on; moves past the breaks inside it"""
+        ppr = elem.find(W + 'pPr') if elem.tag == P else None
+        if is_on(ppr, 'pageBreakBefore'):
+            self._break(True)
+        start = None
+        for node in elem.iter(W + 't', W + 'br', W + 'lastRenderedPageBreak'):
+            if node.tag == W + 't':
+                if start is None and node.text:
+                    start = self.page
+            elif node.tag == W + 'br':
+                if node.get(W + 'type') == 'page':
+                    self._break(True)
+            else:
+                self._break(False)
+        page = self.page if start is None else start
+        if ppr is not None and ppr.find(SECT_PR) is not None:
+            self._section_break()
+        return page
+
+
+# ================== STREAMING EXTRACTOR ==================
+def iter_document_elements(docx_path, include_text=True):
+    """
+    Stream element records out of word/document.xml in document order.
+
+    Paragraphs are numbered like doc.paragraphs (empty ones count but are not
+    emitted) and tables like doc.tables, and every record carries its
+    estimated page (PageCounter). Each body-level element is dropped
+    from the tree as soon as it has been emitted, so memory use does not grow
+    with the length of the document.
+    """
+    with zipfile.ZipFile(docx_path) as zf:
+        classifier = ParagraphClassifier.from_package(zf)
+        pages = PageCounter(section_types(zf))
+
+        with zf.open('word/document.xml') as f:
+            para_idx = 0
+            table_idx = 0
+
+            for _, elem in etree.iterparse(f, events=('end',), tag=(P, TBL),
+                                           resolve_entities=False, huge_tree=True):
+                parent = elem.getparent()
+                if parent is None or parent.tag != BODY:
+                    # Paragraphs inside tables are read with their table
+                    continue
+
+                page = pages.element(elem)
+                if elem.tag == P:
+                    spans = []
+                    text = paragraph_text(elem, spans)
+                    if text.strip():
+                        element_type, confidence = classifier.classify(elem, text)
+                        record = {'type': element_type,
+                                  'para_idx': para_idx,
+                                  'confidence': confidence,
+                                  'page': page}
+                        if include_text:
+                            record['text'] = text
+                            record['spans'] = spans
+                        yield record
+                    para_idx += 1
+                else:
+                    element_type, confidence = classify_table(elem)
+                    record = {'type': element_type, 'table_idx': table_idx,
+                              'confidence': confidence, 'page': page}
+                    if include_text:
+                        record['text'] = table_text(elem)
+                    yield record
+                    table_idx += 1
+
+                # Free everything parsed so far at body level
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del parent[0]
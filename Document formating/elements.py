@@ -0,0 +1,153 @@
+from array import array
+
+
+# Type codes stored per element - index into this tuple
+ELEMENT_TYPES = ('PARAGRAPH', 'TITLE', 'HEADING', 'TABLE', 'LIST')
+TYPE_CODES = {name: code for code, name in enumerate(ELEMENT_TYPES)}
+
+
+class ElementTable:
+    """
+    Columnar container for the elements of a document.
+
+    Instead of one dict per element, types and indices live in typed arrays
+    and all element text in one string addressed by offsets. Paragraph
+    elements can be looked up by para_idx in O(1), and the whole table
+    pickles as a handful of byte strings, so passing it to worker processes
+    or the stage cache is cheap.
+    """
+
+    def __init__(self):
+        self.types = array('B')
+        self.para_idx = array('l')      # -1 for tables
+        self.table_idx = array('l')     # -1 for paragraphs
+        self.confidence = array('d')
+        self.page = array('l')          # estimated start page, 0 if unknown
+        self.text_offsets = array('q', [0])
+        self._text_parts = []
+        self._text = ''
+        # para_idx -> row, -1 where the paragraph has no element (empty ones)
+        self._para_rows = array('l')
+
+    @classmethod
+    def from_records(cls, records):
+        """Build a table from element records (e.g. iter_document_elements)"""
+        table = cls()
+        for record in records:
+            table.append(record['type'],
+                         para_idx=record.get('para_idx', -1),
+                         table_idx=record.get('table_idx', -1),
+                         text=record.get('text', ''),
+                         confidence=record.get('confidence', 1.0),
+                         page=record.get('page', 0))
+        return table
+
+    def append(self, element_type, para_idx=-1, table_idx=-1, text='',
+               confidence=1.0, page=0):
+        row = len(self.types)
+        self.types.append(TYPE_CODES[element_type])
+        self.para_idx.append(para_idx)
+        self.table_idx.append(table_idx)
+        self.confidence.append(confidence)
+        self.page.append(page)
+        self._text_parts.append(text)
+        self.text_offsets.append(self.text_offsets[-1] + len(text))
+
+        if para_idx >= 0:
+            if para_idx >= len(self._para_rows):
+                self._para_rows.extend([-1] * (para_idx + 1 - len(self._para_rows)))
+            self._para_rows[para_idx] = row
+        return row
+
+    def __len__(self):
+        return len(self.types)
+
+    # -------- text buffer --------
+    @property
+    def text(self):
+        if self._text_parts:
+            self._text += ''.join(self._text_parts)
+            self._text_parts = []
+        return self._text
+
+    def text_at(self, row):
+        return self.text[self.text_offsets[row]:self.text_offsets[row + 1]]
+
+    # -------- lookups --------
+    def type_at(self, row):
+        return ELEMENT_TYPES[self.types[row]]
+
+    def set_type(self, row, element_type, confidence=None):
+        self.types[row] = TYPE_CODES[element_type]
+        if confidence is not None:
+            self.confidence[row] = confidence
+
+    def row_of_para(self, para_idx):
+        if 0 <= para_idx < len(self._para_rows):
+            return self._para_rows[para_idx]
+        return -1
+
+    def type_of_para(self, para_idx):
+        """Element type of paragraph para_idx, or None if it has no element"""
+        row = self.row_of_para(para_idx)
+        return None if row < 0 else ELEMENT_TYPES[self.types[row]]
+
+    def table_rows(self):
+        """Rows of all table elements"""
+        return [row for row, code in enumerate(self.types)
+                if code == TYPE_CODES['TABLE']]
+
+    def uncertain_rows(self, threshold):
+        """Rows classified with confidence below threshold"""
+        return [row for row, confidence in enumerate(self.confidence)
+                if confidence < threshold]
+
+    def record(self, row, include_text=True):
+        """One element as a dict, for JSON responses"""
+        element = {
+            'index': row,
+            'type': self.type_at(row),
+            'confidence': round(self.confidence[row], 3),
+            'offset': [self.text_offsets[row], self.text_offsets[row + 1]],
+        }
+        if self.page[row]:
+            element['page'] = self.page[row]
+        if self.para_idx[row] >= 0:
+            element['para_idx'] = self.para_idx[row]
+        else:
+            element['table_idx'] = self.table_idx[row]
+        if include_text:
+            element['text'] = self.text_at(row)
+        return element
+
+    def to_dicts(self, include_text=True):
+        return [self.record(row, include_text) for row in range(len(self))]
+
+    # -------- pickling --------
+    def __getstate__(self):
+        return {
+            'types': self.types.tobytes(),
+            'para_idx': self.para_idx.tobytes(),
+            'table_idx': self.table_idx.tobytes(),
+            'confidence': self.confidence.tobytes(),
+            'page': self.page.tobytes(),
+            'text_offsets': self.text_offsets.tobytes(),
+            'text': self.text,
+            'para_rows': self._para_rows.tobytes(),
+        }
+
+    def __setstate__(self, state):
+        self.types = array('B', state['types'])
+        self.para_idx = array('l')
+        self.para_idx.frombytes(state['para_idx'])
+        self.table_idx = array('l')
+        self.table_idx.frombytes(state['table_idx'])
+        self.confidence = array('d', state['confidence'])
+        self.page = array('l')
+        self.page.frombytes(state['page'])
+        self.text_offsets = array('q')
+        self.text_offsets.frombytes(state['text_offsets'])
+        self._text = state['text']
+        self._text_parts = []
+        self._para_rows = array('l')
+        self._para_rows.frombytes(state['para_rows'])
@@ -0,0 +1,379 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import namedtuple
+
+from flask import current_app, g, jsonify, request
+from werkzeug.exceptions import TooManyRequests
+
+
+# ================== DEFAULTS ==================
+DEFAULT_CONFIG = {
+    # Scheduled endpoint -> priority class of its jobs unless the client has one
+    'FAIR_ENDPOINTS': {
+        'formatter.format_document': 'interactive',
+        'smart.analyze': 'interactive',
+        'analyzer.analyze': 'interactive',
+        'analyzer.structure': 'interactive',
+    },
+    # Client id -> any of weight, rate, burst, priority. Missing keys come
+    # from FAIR_DEFAULT_CLIENT, e.g.
+    # {'partner-a': {'weight': 2, 'rate': 10, 'burst': 100, 'priority': 'bulk'}}
+    'FAIR_CLIENTS': {},
+    # weight: share of a lane relative to other waiting clients
+    # rate/burst: token bucket in jobs per second; rate None disables it
+    'FAIR_DEFAULT_CLIENT': {'weight': 1, 'rate': None, 'burst': 20, 'priority': None},
+    # Header naming the client, e.g. 'X-Client-Id'. Only set it when an
+    # authenticating proxy overwrites it - anyone can send it otherwise.
+    # None keys clients by address.
+    'FAIR_CLIENT_HEADER': None,
+    # Clients with nothing queued or running are forgotten after this many
+    # seconds, and the least recently seen beyond FAIR_MAX_CLIENTS
+    'FAIR_CLIENT_IDLE_SECONDS': 600,
+    'FAIR_MAX_CLIENTS': 10000,
+    # Slots of every lane bulk jobs may not take (one-slot lanes excepted)
+    'FAIR_INTERACTIVE_RESERVED': 1,
+}
+
+# Highest priority first
+PRIORITIES = ('interactive', 'bulk')
+
+
+class RateLimited(TooManyRequests):
+    """The client has used up its token bucket"""
+
+    def __init__(self, client, retry_after):
+        retry_after = max(math.ceil(retry_after), 1)
+        super().__init__(f'Too many requests from {client}, retry in {retry_after}s',
+                         retry_after=retry_after)
+
+
+# Who a job belongs to and which class it is scheduled in
+Job = namedtuple('Job', ['client', 'priority'])
+
+
+# ================== TOKEN BUCKET ==================
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Take a token; returns 0, or the seconds until one is available"""
+        if self.rate is None:
+            return 0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+# ================== CLIENTS ==================
+class Client:
+    def __init__(self, name, weight, rate, burst, priority):
+        self.name = name
+        self.weight = weight
+        self.priority = priority
+        self.bucket = TokenBucket(rate, burst)
+        self._lock = threading.Lock()
+        self.counters = {'submitted': 0, 'rate_limited': 0, 'started': 0,
+                         'timed_out': 0, 'queued': 0, 'active': 0}
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.busy_seconds = 0.0
+        self.last_seen = time.monotonic()
+
+    def submit(self):
+        with self._lock:
+            self.last_seen = time.monotonic()
+            self.counters['submitted'] += 1
+            retry_after = self.bucket.take()
+            if retry_after:
+                self.counters['rate_limited'] += 1
+        return retry_after
+
+    # -------- called by FairLane --------
+    def queued(self, delta):
+        with self._lock:
+            self.counters['queued'] += delta
+
+    def started(self, waited):
+        with self._lock:
+            self.counters['started'] += 1
+            self.counters['active'] += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def timed_out(self):
+        with self._lock:
+            self.counters['timed_out'] += 1
+
+    def finished(self, busy):
+        with self._lock:
+            self.counters['active'] -= 1
+            self.busy_seconds += busy
+            self.last_seen = time.monotonic()
+
+    def idle(self):
+        """True if the client has no jobs queued or running"""
+        with self._lock:
+            return not self.counters['queued'] and not self.counters['active']
+
+    def stats(self):
+        with self._lock:
+            started = self.counters['started']
+            return dict(self.counters,
+                        weight=self.weight,
+                        priority=self.priority,
+                        mean_wait_ms=round(self.wait_seconds / started * 1000, 1)
+                        if started else 0.0,
+                        max_wait_ms=round(self.max_wait_seconds * 1000, 1),
+                        busy_seconds=round(self.busy_seconds, 1))
+
+
+class FairScheduler:
+    """Per-client settings, token buckets and metrics"""
+
+    def __init__(self, config):
+        self.endpoints = dict(config['FAIR_ENDPOINTS'])
+        self.client_settings = config['FAIR_CLIENTS']
+        self.defaults = config['FAIR_DEFAULT_CLIENT']
+        self.header = config['FAIR_CLIENT_HEADER']
+        self.idle_seconds = config['FAIR_CLIENT_IDLE_SECONDS']
+        self.max_clients = config['FAIR_MAX_CLIENTS']
+        self._lock = threading.Lock()
+        self._clients = {}
+        self.forgotten = 0
+
+    def client(self, name):
+        with self._lock:
+            client = self._clients.get(name)
+            if client is None:
+                self._forget_idle()
+                settings = dict(self.defaults, **self.client_settings.get(name, {}))
+                client = Client(name, settings['weight'], settings['rate'],
+                                settings['burst'], settings['priority'])
+                self._clients[name] = client
+            return client
+
+    def _forget_idle(self):
+        """
+        Drop idle clients past FAIR_CLIENT_IDLE_SECONDS, then the least
+        recently seen idle ones while at FAIR_MAX_CLIENTS (caller holds the
+        lock). Their buckets would have refilled by the time they come back.
+        """
+        now = time.monotonic()
+        idle = sorted((c for c in self._clients.values() if c.idle()),
+                      key=lambda c: c.last_seen)
+        for client in idle:
+            if (now - client.last_seen < self.idle_seconds
+                    and len(self._clients) < self.max_clients):
+                break
+            del self._clients[client.name]
+            self.forgotten += 1
+
+    def job_for(self, endpoint, client_id, requested=None):
+        """
+        Job for a request to a scheduled endpoint, or None for other endpoints.
+        Clients may ask for 'bulk' (X-Priority) but never rise above their
+        configured class. Raises RateLimited when the bucket is empty.
+        """
+        default = self.endpoints.get(endpoint)
+        if default is None:
+            return None
+        client = self.client(client_id)
+        priority = client.priority if client.priority in PRIORITIES else default
+        if requested == 'bulk':
+            priority = 'bulk'
+
+        retry_after = client.submit()
+        if retry_after:
+            raise RateLimited(client.name, retry_after)
+        return Job(client, priority)
+
+    def stats(self):
+        with self._lock:
+            clients = list(self._clients.values())
+        return {client.name: client.stats() for client in clients}
+
+
+# Jobs started outside a scheduled request (bulk_format, scripts)
+LOCAL_JOB = Job(Client('local', 1, None, 0, None), 'interactive')
+
+
+# ================== LANE ==================
+class _Waiter:
+    __slots__ = ('job', 'granted', 'cancelled', 'share')
+
+    def __init__(self, job):
+        self.job = job
+        self.granted = False
+        self.cancelled = False
+        # Virtual time charged to the client's finish tag when queued
+        self.share = 0.0
+
+
+class FairLane:
+    """
+    A lane with `limit` slots handed out by priority, then by weighted fair
+    share. Interactive jobs always go before queued bulk jobs, and bulk jobs
+    never take the last `reserved` slots, so however long the bulk backlog,
+    an interactive job only waits behind other interactive jobs. Lanes too
+    small to reserve anything still give bulk jobs one slot, but a bulk job
+    in a reserved slot lends it out: an interactive job may start beside it
+    rather than wait for it to finish. Within a class each
+    client gets start-time fair queueing by job cost / weight: a client with
+    a thousand queued jobs gets no more slots than one with a single job.
+    """
+
+    def __init__(self, name, limit, reserved=0):
+        self.name = name
+        self.limit = limit
+        # Bulk jobs may hold at most this many slots...
+        self.bulk_limit = max(limit - reserved, 1)
+        # ...of which this many are reserved ones they give up to interactive jobs
+        self.lent = max(self.bulk_limit - (limit - reserved), 0)
+        self._cond = threading.Condition()
+        self._sequence = itertools.count()
+        self._queues = {priority: [] for priority in PRIORITIES}
+        self._vtime = {priority: 0.0 for priority in PRIORITIES}
+        self._finish = {priority: {} for priority in PRIORITIES}
+        self._running = {priority: 0 for priority in PRIORITIES}
+        self.active = 0
+        self.waiting = 0
+        self.served = 0
+        self.timed_out = 0
+
+    def _free(self, priority):
+        if priority == 'bulk':
+            return (self.active < self.limit and
+                    self._running['bulk'] < self.bulk_limit)
+        return self.active < self.limit + min(self._running['bulk'], self.lent)
+
+    # -------- queue (caller holds the lock) --------
+    def _enqueue(self, waiter, cost):
+        priority = waiter.job.priority
+        finish = self._finish[priority]
+        start = max(self._vtime[priority], finish.get(waiter.job.client.name, 0.0))
+        waiter.share = max(cost, 1) / waiter.job.client.weight
+        finish[waiter.job.client.name] = start + waiter.share
+        heapq.heappush(self._queues[priority], (start, next(self._sequence), waiter))
+
+    def _cancel(self, waiter):
+        waiter.cancelled = True
+        # A job that never ran must not push its client's later jobs back
+        finish = self._finish[waiter.job.priority]
+        name = waiter.job.client.name
+        if name in finish:
+            finish[name] -= waiter.share
+
+    def _start(self, waiter):
+        waiter.granted = True
+        self.active += 1
+        self._running[waiter.job.priority] += 1
+
+    def _dispatch(self):
+        granted = False
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            while queue and self._free(priority):
+                start, _, waiter = heapq.heappop(queue)
+                if waiter.cancelled:
+                    continue
+                self._vtime[priority] = start
+                self._start(waiter)
+                granted = True
+        if not self._queues['bulk'] and not self._queues['interactive']:
+            # Idle - old finish tags no longer matter
+            for priority in PRIORITIES:
+                self._finish[priority].clear()
+        if granted:
+            self._cond.notify_all()
+
+    # -------- public API --------
+    def acquire(self, timeout, job, cost=1):
+        queued_at = time.monotonic()
+        waiter = _Waiter(job)
+        with self._cond:
+            self._enqueue(waiter, cost)
+            self.waiting += 1
+            job.client.queued(1)
+            self._dispatch()
+            deadline = queued_at + timeout
+            while not waiter.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    if not waiter.granted:
+                        self._cancel(waiter)
+                    break
+            self.waiting -= 1
+            job.client.queued(-1)
+            if not waiter.granted:
+                self.timed_out += 1
+                job.client.timed_out()
+                return False
+        job.client.started(time.monotonic() - queued_at)
+        return True
+
+    def release(self, job, busy):
+        with self._cond:
+            self.active -= 1
+            self._running[job.priority] -= 1
+            self.served += 1
+            self._dispatch()
+        job.client.finished(busy)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'limit': self.limit,
+                'bulk_limit': self.bulk_limit,
+                'lent': self.lent,
+                'active': self.active,
+                'waiting': self.waiting,
+                'served': self.served,
+                'timed_out': self.timed_out,
+                'running': dict(self._running),
+            }
+
+
+# ================== SETUP ==================
+def current_job():
+    """The job of the request being handled, set by init_scheduler"""
+    return g.get('fair_job')
+
+
+def client_id(headers, remote_addr, header):
+    """The trusted header's value if one is configured, else the address"""
+    return (header and headers.get(header)) or remote_addr or 'anonymous'
+
+
+def init_scheduler(app):
+    scheduler = FairScheduler(app.config)
+    app.extensions['scheduler'] = scheduler
+
+    @app.before_request
+    def schedule_request():
+        # asgi.py may have charged the bucket already, before reading the body
+        job = request.environ.get('fair_scheduler.job')
+        if job is None:
+            job = scheduler.job_for(
+                request.endpoint,
+                client_id(request.headers, request.remote_addr, scheduler.header),
+                request.headers.get('X-Priority'))
+        g.fair_job = job
+
+    @app.errorhandler(RateLimited)
+    def rate_limited(e):
+        return jsonify({'error': e.description}), 429, {'Retry-After': str(e.retry_after)}
+
+    @app.route('/api/clients', methods=['GET'])
+    def client_stats():
+        return jsonify(current_app.extensions['scheduler'].stats())
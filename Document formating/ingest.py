@@ -0,0 +1,227 @@
+import hashlib
+import os
+import struct
+import tempfile
+
+from flask import Request, current_app, jsonify
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+from admission import DEFAULT_CONFIG as ADMISSION_DEFAULTS
+from stage_cache import stream_digest
+
+
+# ================== DEFAULTS ==================
+DEFAULT_CONFIG = {
+    # Endpoint -> max request body in bytes. Other routes use MAX_CONTENT_LENGTH.
+    'UPLOAD_LIMITS': {
+        'formatter.format_document': 256 * 1024 * 1024,
+        'formatter.preview_document': 256 * 1024 * 1024,
+        'smart.analyze': 256 * 1024 * 1024,
+        'analyzer.analyze': 64 * 1024 * 1024,
+        'analyzer.structure': 256 * 1024 * 1024,
+    },
+}
+
+LOCAL_HEADER = b'PK\x03\x04'
+CENTRAL_HEADER = b'PK\x01\x02'
+OLE_HEADER = b'\xd0\xcf\x11\xe0'
+LOCAL_HEADER_SIZE = 30
+
+
+class InvalidUpload(BadRequest):
+    """The upload is not a .docx package - raised while it is still arriving"""
+
+
+class UploadTooLarge(RequestEntityTooLarge):
+    """The upload declares more content than admission would ever accept"""
+
+
+# ================== ZIP SCANNING ==================
+class ZipHeaderScanner:
+    """
+    Walks the local file headers of a ZIP as its bytes arrive, so files that
+    are not ZIPs, or that declare too many parts or too much content, are
+    rejected before the rest of the upload is read.
+    Gives up quietly (done) where sizes are only known after the data
+    (data descriptors, ZIP64) - admission still checks the central directory.
+    """
+
+    def __init__(self, max_uncompressed, max_parts):
+        self.max_uncompressed = max_uncompressed
+        self.max_parts = max_parts
+        self.parts = 0
+        self.uncompressed = 0
+        self.done = False
+        self._buffer = bytearray()
+        self._skip = 0
+
+    def feed(self, data):
+        if self.done:
+            return
+        if self._skip:
+            skipped = min(self._skip, len(data))
+            self._skip -= skipped
+            data = data[skipped:]
+        self._buffer += data
+
+        while len(self._buffer) >= LOCAL_HEADER_SIZE:
+            signature = bytes(self._buffer[:4])
+            if signature != LOCAL_HEADER:
+                if self.parts and signature == CENTRAL_HEADER:
+                    self.done = True
+                    return
+                if not self.parts and signature == OLE_HEADER:
+                    raise InvalidUpload('Encrypted documents and legacy .doc files '
+                                        'are not supported')
+                if not self.parts:
+                    raise InvalidUpload('File is not a valid .docx package')
+                self.done = True
+                return
+
+            (flags, compressed, uncompressed, name_length,
+             extra_length) = struct.unpack('<6xH10xIIHH', self._buffer[:LOCAL_HEADER_SIZE])
+            if flags & 0x08 or 0xFFFFFFFF in (compressed, uncompressed):
+                self.done = True
+                return
+
+            self.parts += 1
+            self.uncompressed += uncompressed
+            if self.parts > self.max_parts:
+                raise UploadTooLarge(f'Document has more than {self.max_parts} parts')
+            if self.uncompressed > self.max_uncompressed:
+                raise UploadTooLarge('Document expands beyond the allowed size')
+
+            entry = LOCAL_HEADER_SIZE + name_length + extra_length + compressed
+            if len(self._buffer) >= entry:
+                del self._buffer[:entry]
+            else:
+                self._skip = entry - len(self._buffer)
+                self._buffer.clear()
+                return
+
+
+def scanner_for(config):
+    """A ZipHeaderScanner with the admission limits of config"""
+    return ZipHeaderScanner(
+        config.get('ADMISSION_MAX_UNCOMPRESSED',
+                   ADMISSION_DEFAULTS['ADMISSION_MAX_UNCOMPRESSED']),
+        config.get('ADMISSION_MAX_PARTS', ADMISSION_DEFAULTS['ADMISSION_MAX_PARTS']))
+
+
+# ================== SPOOL ==================
+class UploadSpool:
+    """
+    File object werkzeug streams one uploaded file into. The bytes go
+    straight to a temporary file next to UPLOAD_FOLDER's inputs while being
+    hashed and scanned, so the upload is never held in memory and never
+    copied again afterwards.
+    """
+
+    def __init__(self, folder, scanner):
+        fd, self.path = tempfile.mkstemp(dir=folder, suffix='.upload')
+        self._file = os.fdopen(fd, 'w+b')
+        self._sha256 = hashlib.sha256()
+        self._scanner = scanner
+        self.size = 0
+        self.persisted = False
+
+    def write(self, data):
+        self._scanner.feed(data)
+        self._sha256.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+    def persist(self, path):
+        """
+        Move the upload to path. The file is closed first - Windows can't
+        rename or later remove an open file - and only reopened, from the
+        start, if it is read through this object again.
+        """
+        self._file.close()
+        self._file = None
+        os.replace(self.path, path)
+        self.path = path
+        self.persisted = True
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if not self.persisted:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.path, 'rb')
+        return self._file
+
+    def __getattr__(self, name):
+        # read, seek, tell, readline, flush... straight from the file
+        return getattr(self._open(), name)
+
+    def __iter__(self):
+        return iter(self._open())
+
+
+class IngestRequest(Request):
+    """Request with per-route body limits and .docx uploads streamed to disk"""
+
+    @property
+    def max_content_length(self):
+        if self.url_rule is not None:
+            limit = current_app.config['UPLOAD_LIMITS'].get(self.url_rule.endpoint)
+            if limit is not None:
+                return limit
+        return current_app.config['MAX_CONTENT_LENGTH']
+
+    @max_content_length.setter
+    def max_content_length(self, value):
+        # Limits come from UPLOAD_LIMITS / MAX_CONTENT_LENGTH only
+        pass
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        if not filename or not filename.lower().endswith('.docx'):
+            return super()._get_file_stream(total_content_length, content_type,
+                                            filename, content_length)
+        config = current_app.config
+        spool = UploadSpool(config['UPLOAD_FOLDER'], scanner_for(config))
+        # Also closed when parsing stops half-way and request.files never sees it
+        self.__dict__.setdefault('_spools', []).append(spool)
+        return spool
+
+    def close(self):
+        super().close()
+        for spool in self.__dict__.get('_spools', ()):
+            spool.close()
+
+
+# ================== ROUTE HELPERS ==================
+def upload_digest(file):
+    """sha256 of an uploaded file - free when it was spooled by IngestRequest"""
+    if isinstance(file.stream, UploadSpool):
+        file.stream.seek(0)
+        return file.stream.hexdigest()
+    return stream_digest(file.stream)
+
+
+def save_upload(file, path):
+    """file.save(path), but a spooled upload is renamed instead of copied"""
+    if isinstance(file.stream, UploadSpool) and not file.stream.persisted:
+        file.stream.persist(path)
+    else:
+        file.save(path)
+
+
+def init_ingest(app):
+    app.request_class = IngestRequest
+
+    @app.errorhandler(InvalidUpload)
+    @app.errorhandler(RequestEntityTooLarge)
+    def upload_rejected(e):
+        return jsonify({'error': e.description}), e.code
@@ -0,0 +1,394 @@
+"""
+Localhost load generator.
+
+Replays a .docx corpus against a running instance (or one started in-process
+with --serve) and reports throughput, latency percentiles, error rates and the
+server's Server-Timing stages per endpoint:
+
+    python loadtest.py run corpus/ --serve --concurrency 8 --duration 60
+    python loadtest.py run corpus/ --url http://127.0.0.1:5000 --rate 20 \
+        --mix format=6,structure=2,health=2 --out after.json
+    python loadtest.py compare before.json after.json
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+
+# ================== ENDPOINTS ==================
+SMART_CONFIG = {
+    'title_font': 'Times New Roman', 'title_size': 26,
+    'heading_font': 'Calibri', 'heading_size': 18,
+    'para_font': 'Calibri', 'para_size': 12,
+    'bold_titles': True, 'highlight': True,
+}
+
+# name -> (method, path, form fields, sends a document)
+ENDPOINTS = {
+    'format': ('POST', '/api/format', {'fontFamily': 'Calibri', 'fontSize': '12'}, True),
+    'preview': ('POST', '/api/preview', {'fontFamily': 'Calibri', 'fontSize': '12'}, True),
+    'smart': ('POST', '/smart/analyze', {'config': json.dumps(SMART_CONFIG)}, True),
+    'analyze': ('POST', '/analyzer/analyze', {}, True),
+    'structure': ('POST', '/analyzer/structure', {}, True),
+    'health': ('GET', '/api/health', {}, False),
+}
+
+DEFAULT_MIX = 'format=5,smart=2,analyze=1,structure=2,health=2'
+
+# Config of the in-process server (--serve)
+SERVE_CONFIG = {
+    'LAYOUTLM_STUB': True,
+    # One client sends everything - measure the server, not its rate limit
+    'FAIR_DEFAULT_CLIENT': {'weight': 1, 'rate': None, 'burst': 0, 'priority': None},
+}
+
+
+def encode_multipart(fields, filename, data):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; '
+                     f'name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; '
+                 f'filename="{filename}"\r\nContent-Type: application/vnd.'
+                 f'openxmlformats-officedocument.wordprocessingml.document'
+                 f'\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def load_corpus(path):
+    if os.path.isfile(path):
+        paths = [path]
+    else:
+        paths = sorted(os.path.join(root, name)
+                       for root, _, names in os.walk(path)
+                       for name in names if name.lower().endswith('.docx'))
+    if not paths:
+        raise SystemExit(f"No .docx files under {path}")
+    return [(os.path.basename(p), open(p, 'rb').read()) for p in paths]
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint {name!r} (one of {', '.join(ENDPOINTS)})")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+class RequestPlan:
+    """Pre-encoded request bodies, so the client spends no CPU per request"""
+
+    def __init__(self, corpus, mix):
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.bodies = {}
+        for name in self.names:
+            method, path, fields, sends_file = ENDPOINTS[name]
+            if sends_file:
+                self.bodies[name] = [encode_multipart(fields, filename, data)
+                                     for filename, data in corpus]
+            else:
+                self.bodies[name] = [(None, None)]
+
+    def pick(self, rng):
+        name = rng.choices(self.names, self.weights)[0]
+        return name, rng.choice(self.bodies[name])
+
+
+# ================== CLIENT ==================
+def parse_server_timing(header):
+    stages = {}
+    for item in (header or '').split(','):
+        name, _, params = item.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'dur' and name:
+                stages[name] = float(value)
+    return stages
+
+
+def send_request(host, port, name, body, content_type, timeout):
+    method, path, _, _ = ENDPOINTS[name]
+    headers = {'Content-Type': content_type} if content_type else {}
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        return response.status, parse_server_timing(response.getheader('Server-Timing'))
+    finally:
+        conn.close()
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.results = defaultdict(list)   # endpoint -> [(latency, status, stages)]
+        self.recording = False
+
+    def add(self, name, latency, status, stages):
+        if not self.recording:
+            return
+        with self.lock:
+            self.results[name].append((latency, status, stages))
+
+
+def run_one(target, plan, recorder, rng_lock, rng, timeout, scheduled=None):
+    with rng_lock:
+        name, (body, content_type) = plan.pick(rng)
+    # Open-loop latency counts from when the request was due, so a backed-up
+    # server is not hidden by requests that started late (coordinated omission)
+    start = scheduled if scheduled is not None else time.perf_counter()
+    try:
+        status, stages = send_request(*target, name, body, content_type, timeout)
+    except (OSError, http.client.HTTPException):
+        status, stages = 0, {}
+    recorder.add(name, time.perf_counter() - start, status, stages)
+
+
+def closed_loop(target, plan, recorder, concurrency, end, timeout, seed):
+    rng, rng_lock = random.Random(seed), threading.Lock()
+
+    def client():
+        while time.perf_counter() < end:
+            run_one(target, plan, recorder, rng_lock, rng, timeout)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def open_loop(target, plan, recorder, rate, end, timeout, seed, max_in_flight):
+    rng, rng_lock = random.Random(seed), threading.Lock()
+    arrivals = random.Random(seed + 1)
+
+    with ThreadPoolExecutor(max_in_flight) as executor:
+        due = time.perf_counter()
+        while due < end:
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(run_one, target, plan, recorder, rng_lock, rng,
+                            timeout, due)
+            # Poisson arrivals
+            due += arrivals.expovariate(rate)
+
+
+# ================== REPORT ==================
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    # Nearest rank
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(latency for latency, _, _ in samples)
+    statuses = defaultdict(int)
+    stage_totals = defaultdict(float)
+    stage_counts = defaultdict(int)
+    for _, status, stages in samples:
+        statuses[str(status)] += 1
+        for name, ms in stages.items():
+            stage_totals[name] += ms
+            stage_counts[name] += 1
+
+    errors = sum(count for status, count in statuses.items()
+                 if status == '0' or int(status) >= 400)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 1)
+
+    return {
+        'count': len(samples),
+        'throughput': round(len(samples) / elapsed, 2) if elapsed else 0,
+        'errors': errors,
+        'error_rate': round(errors / len(samples), 4) if samples else 0,
+        'status': dict(statuses),
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'max_ms': ms(latencies[-1]) if latencies else None,
+        # Mean server-side milliseconds per stage, over responses reporting it
+        'stages_ms': {name: round(stage_totals[name] / stage_counts[name], 1)
+                      for name in sorted(stage_totals)},
+    }
+
+
+def print_report(report):
+    print(f"\n{'endpoint':<10} {'count':>7} {'rps':>8} {'err%':>6} "
+          f"{'p50':>9} {'p95':>9} {'p99':>9}  stages (mean ms)")
+    rows = sorted(report['endpoints'].items()) + [('TOTAL', report['total'])]
+    for name, s in rows:
+        stages = ', '.join(f"{k}={v}" for k, v in s.get('stages_ms', {}).items())
+        print(f"{name:<10} {s['count']:>7} {s['throughput']:>8} "
+              f"{s['error_rate'] * 100:>5.1f}% {_fmt(s['p50_ms']):>9} "
+              f"{_fmt(s['p95_ms']):>9} {_fmt(s['p99_ms']):>9}  {stages}")
+
+
+def _fmt(ms):
+    return '-' if ms is None else f"{ms:.1f}ms"
+
+
+# ================== IN-PROCESS SERVER ==================
+def start_server(port, config):
+    """Serve create_app() on localhost from a background thread"""
+    from werkzeug.serving import make_server
+    from server import create_app
+
+    app = create_app(config)
+    httpd = make_server('127.0.0.1', port, app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, name='loadtest-server',
+                     daemon=True).start()
+    return httpd
+
+
+# ================== COMMANDS ==================
+def run(args):
+    corpus = load_corpus(args.corpus)
+    mix = parse_mix(args.mix)
+    plan = RequestPlan(corpus, mix)
+
+    httpd = None
+    if args.serve:
+        config = dict(SERVE_CONFIG)
+        if args.server_config:
+            with open(args.server_config, encoding='utf-8') as f:
+                config.update(json.load(f))
+        httpd = start_server(args.port, config)
+        url = f"http://127.0.0.1:{httpd.server_port}"
+    else:
+        url = args.url
+
+    parts = urlsplit(url)
+    if parts.hostname not in ('127.0.0.1', 'localhost', '::1'):
+        raise SystemExit(f"Refusing to load {parts.hostname} - localhost only")
+    target = (parts.hostname, parts.port or 80)
+
+    recorder = Recorder()
+    mode = (f"rate {args.rate}/s" if args.rate else f"concurrency {args.concurrency}")
+    print(f"{len(corpus)} documents, mix {args.mix}, {mode}, "
+          f"{args.warmup}s warmup + {args.duration}s against {url}")
+
+    def load(seconds):
+        end = time.perf_counter() + seconds
+        if args.rate:
+            open_loop(target, plan, recorder, args.rate, end, args.timeout,
+                      args.seed, args.max_in_flight)
+        else:
+            closed_loop(target, plan, recorder, args.concurrency, end,
+                        args.timeout, args.seed)
+
+    if args.warmup:
+        load(args.warmup)
+
+    recorder.recording = True
+    started = time.perf_counter()
+    load(args.duration)
+    elapsed = time.perf_counter() - started
+    recorder.recording = False
+
+    if httpd is not None:
+        httpd.shutdown()
+
+    all_samples = [s for samples in recorder.results.values() for s in samples]
+    report = {
+        'meta': {
+            'url': url, 'mix': args.mix, 'corpus': args.corpus,
+            'documents': len(corpus), 'concurrency': args.concurrency,
+            'rate': args.rate, 'duration': args.duration,
+            'elapsed': round(elapsed, 2), 'label': args.label,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'endpoints': {name: summarize(samples, elapsed)
+                      for name, samples in recorder.results.items()},
+        'total': summarize(all_samples, elapsed),
+    }
+    print_report(report)
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved to {args.out}")
+    return 1 if report['total']['errors'] else 0
+
+
+def compare(args):
+    with open(args.before, encoding='utf-8') as f:
+        before = json.load(f)
+    with open(args.after, encoding='utf-8') as f:
+        after = json.load(f)
+
+    print(f"{before['meta'].get('label') or args.before} -> "
+          f"{after['meta'].get('label') or args.after}\n")
+    print(f"{'endpoint':<10} {'metric':<11} {'before':>11} {'after':>11} {'change':>9}")
+    names = sorted(set(before['endpoints']) | set(after['endpoints'])) + ['TOTAL']
+    for name in names:
+        b = before['total'] if name == 'TOTAL' else before['endpoints'].get(name)
+        a = after['total'] if name == 'TOTAL' else after['endpoints'].get(name)
+        if b is None or a is None:
+            print(f"{name:<10} only in {'after' if b is None else 'before'}")
+            continue
+        for metric in ('throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'error_rate'):
+            old, new = b[metric], a[metric]
+            change = (f"{(new - old) / old * 100:+.1f}%"
+                      if old not in (None, 0) and new is not None else '')
+            print(f"{name:<10} {metric:<11} {str(old):>11} {str(new):>11} {change:>9}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load-test the formatter on localhost')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('run', help='Generate load and report latencies')
+    p.add_argument('corpus', help='.docx file or directory of .docx files')
+    p.add_argument('--url', default='http://127.0.0.1:5000')
+    p.add_argument('--serve', action='store_true',
+                   help='Start create_app() in-process (model stubbed) instead of using --url')
+    p.add_argument('--port', type=int, default=0, help='Port for --serve (0 = any free)')
+    p.add_argument('--server-config', help='JSON file of app config overrides for --serve')
+    p.add_argument('--mix', default=DEFAULT_MIX,
+                   help=f'endpoint=weight list (default {DEFAULT_MIX})')
+    p.add_argument('--concurrency', type=int, default=4,
+                   help='Closed loop: clients each sending one request at a time')
+    p.add_argument('--rate', type=float,
+                   help='Open loop: mean arrivals per second (overrides --concurrency)')
+    p.add_argument('--max-in-flight', type=int, default=256)
+    p.add_argument('--duration', type=float, default=30, help='Measured seconds')
+    p.add_argument('--warmup', type=float, default=5, help='Unmeasured seconds first')
+    p.add_argument('--timeout', type=float, default=300)
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--label', help='Name of this run in comparisons')
+    p.add_argument('--out', help='Save the report as JSON')
+    p.set_defaults(func=run)
+
+    p = commands.add_parser('compare', help='Compare two saved reports')
+    p.add_argument('before')
+    p.add_argument('after')
+    p.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
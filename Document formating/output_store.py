@@ -0,0 +1,300 @@
+import io
+import json
+import os
+import threading
+import time
+import uuid
+
+from flask import current_app, jsonify, request, send_file
+
+from stage_cache import file_digest
+
+
+# ================== DEFAULTS ==================
+DEFAULT_CONFIG = {
+    # Seconds a result stays downloadable from /outputs/<key>
+    'OUTPUT_TTL': 3600,
+    # Total size of stored results; the oldest are evicted beyond it
+    'OUTPUT_MAX_MB': 2048,
+    # Seconds between background sweeps
+    'OUTPUT_SWEEP_INTERVAL': 60,
+    # Flask's USE_X_SENDFILE hands downloads to Apache/lighttpd instead
+}
+
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+
+# ================== STORE ==================
+class _ServedBlob(io.BufferedReader):
+    """A blob opened for one download; unpins its key once closed"""
+
+    def __init__(self, raw, release):
+        super().__init__(raw)
+        self._release = release
+
+    def close(self):
+        release, self._release = self._release, None
+        try:
+            super().close()
+        finally:
+            if release is not None:
+                release()
+
+
+class OutputStore:
+    """
+    Finished documents, kept for a while so they can be downloaded again.
+
+    Every stored result gets its own random key, so same-named uploads never
+    overwrite each other. The bytes live in blobs named by their sha256:
+    identical outputs (same document, same settings) are stored once and
+    shared by all their keys. A background thread removes keys older than
+    ttl and, beyond max_bytes, the oldest keys until the blobs fit again;
+    keys that are being downloaded are pinned and left for a later sweep.
+    Keys are kept as small JSON files next to the blobs and survive restarts.
+    """
+
+    def __init__(self, folder, ttl, max_bytes, sweep_interval=60):
+        self.folder = folder
+        self.blob_folder = os.path.join(folder, 'blobs')
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._pins = {}         # key -> downloads in progress
+        self._blobs = {}        # digest -> [size, keys using it]
+        self._bytes = 0
+        self._wake = threading.Event()
+        self._sweeper = None
+        self.counters = {'stored': 0, 'deduplicated': 0, 'expired': 0,
+                         'evicted': 0, 'downloads': 0}
+
+        os.makedirs(self.blob_folder, exist_ok=True)
+        self._load_index()
+
+    @classmethod
+    def from_config(cls, config):
+        settings = {key: config.get(key, value)
+                    for key, value in DEFAULT_CONFIG.items()}
+        return cls(os.path.join(config['OUTPUT_FOLDER'], 'store'),
+                   settings['OUTPUT_TTL'],
+                   settings['OUTPUT_MAX_MB'] * 1024 * 1024,
+                   settings['OUTPUT_SWEEP_INTERVAL'])
+
+    def _meta_path(self, key):
+        return os.path.join(self.folder, f"{key}.json")
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_folder, digest)
+
+    def _load_index(self):
+        for name in os.listdir(self.folder):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.folder, name)) as f:
+                    entry = json.load(f)
+                size = os.path.getsize(self.blob_path(entry['digest']))
+            except (OSError, ValueError, KeyError):
+                self._remove(self._meta_path(name[:-5]))
+                continue
+            self._add(name[:-5], entry, size)
+
+        # Blobs whose keys were lost, e.g. in a crash between the two writes
+        for digest in os.listdir(self.blob_folder):
+            if digest not in self._blobs:
+                self._remove(self.blob_path(digest))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    # -------- index (caller holds the lock) --------
+    def _add(self, key, entry, size):
+        self._entries[key] = entry
+        blob = self._blobs.setdefault(entry['digest'], [size, 0])
+        if blob[1] == 0:
+            self._bytes += size
+        blob[1] += 1
+
+    def _drop(self, key):
+        """Forget key; returns the blob to delete if nothing else uses it"""
+        entry = self._entries.pop(key)
+        blob = self._blobs[entry['digest']]
+        blob[1] -= 1
+        if blob[1] == 0:
+            del self._blobs[entry['digest']]
+            self._bytes -= blob[0]
+            return entry['digest']
+        return None
+
+    # -------- public API --------
+    def put(self, path, download_name, mimetype=DOCX_MIMETYPE):
+        """Move the finished file at path into the store and return its key"""
+        digest = file_digest(path)
+        size = os.path.getsize(path)
+        key = uuid.uuid4().hex
+        now = time.time()
+        entry = {'digest': digest, 'name': download_name, 'mimetype': mimetype,
+                 'size': size, 'created': now, 'expires': now + self.ttl}
+
+        with self._lock:
+            if digest in self._blobs:
+                # Same bytes already stored - share them
+                self._remove(path)
+                self.counters['deduplicated'] += 1
+            else:
+                os.replace(path, self.blob_path(digest))
+            self._add(key, entry, size)
+            self.counters['stored'] += 1
+            over_quota = self._bytes > self.max_bytes
+
+        with open(self._meta_path(key), 'w') as f:
+            json.dump(entry, f)
+        if over_quota:
+            self._wake.set()
+        return key
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry['expires'] < time.time():
+            return None
+        return entry
+
+    def _pin(self, key):
+        with self._lock:
+            if key not in self._entries:
+                # Swept since it was looked up
+                return False
+            self._pins[key] = self._pins.get(key, 0) + 1
+            self.counters['downloads'] += 1
+            return True
+
+    def _unpin(self, key):
+        with self._lock:
+            self._pins[key] -= 1
+            if not self._pins[key]:
+                del self._pins[key]
+
+    def send(self, key, entry=None):
+        """
+        Download response for a stored result, or 404 once it is gone.
+        send_file hands the open file to the server (wsgi.file_wrapper), so
+        servers with sendfile support - gunicorn, asgi.py - send it without
+        copying it through Python, and it answers Range and If-None-Match
+        requests from the file itself. The key stays pinned until the server
+        closes the file. Results are private to whoever holds the key, so
+        nothing on the way may cache them.
+        """
+        entry = entry or self.get(key)
+        if entry is None or not self._pin(key):
+            return jsonify({'error': 'Result not found or expired'}), 404
+        path = self.blob_path(entry['digest'])
+
+        if current_app.config.get('USE_X_SENDFILE'):
+            # The front server opens the blob as soon as the headers reach
+            # it, and an open file outlives its removal
+            self._unpin(key)
+            response = send_file(path, mimetype=entry['mimetype'],
+                                 as_attachment=True, download_name=entry['name'],
+                                 conditional=True, etag=entry['digest'])
+        else:
+            try:
+                file = _ServedBlob(io.FileIO(path, 'rb'), lambda: self._unpin(key))
+            except OSError:
+                self._unpin(key)
+                return jsonify({'error': 'Result not found or expired'}), 404
+            response = send_file(file, mimetype=entry['mimetype'],
+                                 as_attachment=True, download_name=entry['name'],
+                                 etag=entry['digest'])
+            # send_file only knows the size (and so ranges) of paths
+            size = os.fstat(file.fileno()).st_size
+            response.content_length = size
+            response.make_conditional(request, accept_ranges=True,
+                                      complete_length=size)
+
+        response.headers['Cache-Control'] = 'private, no-store'
+        response.headers['X-Output-Key'] = key
+        return response
+
+    def store_and_send(self, path, download_name, mimetype=DOCX_MIMETYPE):
+        return self.send(self.put(path, download_name, mimetype))
+
+    # -------- eviction --------
+    def sweep(self):
+        """Drop expired keys, then the oldest keys while over max_bytes"""
+        now = time.time()
+        keys = []
+        blobs = []
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry['expires'] < now and key not in self._pins:
+                    keys.append(key)
+                    blobs.append(self._drop(key))
+                    self.counters['expired'] += 1
+
+            if self._bytes > self.max_bytes:
+                oldest = sorted((k for k in self._entries if k not in self._pins),
+                                key=lambda k: self._entries[k]['created'])
+                for key in oldest:
+                    if self._bytes <= self.max_bytes:
+                        break
+                    keys.append(key)
+                    blobs.append(self._drop(key))
+                    self.counters['evicted'] += 1
+
+            # Removed under the lock, so put() never dedups onto a deleted blob
+            for digest in blobs:
+                if digest is not None:
+                    self._remove(self.blob_path(digest))
+
+        for key in keys:
+            self._remove(self._meta_path(key))
+        return len(keys)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.sweep_interval)
+            self._wake.clear()
+            try:
+                removed = self.sweep()
+                if removed:
+                    print(f"Output store: removed {removed} results")
+            except Exception as e:
+                print(f"Output store sweep failed: {e}")
+
+    def start(self):
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=self._run, daemon=True,
+                                             name='output-sweeper')
+            self._sweeper.start()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters,
+                        entries=len(self._entries),
+                        pinned=len(self._pins),
+                        blobs=len(self._blobs),
+                        mb=round(self._bytes / 1024 / 1024, 1))
+
+
+# ================== SETUP ==================
+def init_output_store(app):
+    store = OutputStore.from_config(app.config)
+    store.sweep()
+    store.start()
+    app.extensions['output_store'] = store
+
+    @app.route('/outputs/<key>', methods=['GET'])
+    def download_output(key):
+        store = current_app.extensions['output_store']
+        entry = store.get(key) if all(c in '0123456789abcdef' for c in key) else None
+        if entry is None:
+            return jsonify({'error': 'Result not found or expired'}), 404
+        return store.send(key, entry)
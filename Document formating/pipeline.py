@@ -0,0 +1,132 @@
+import queue
+import threading
+from contextlib import nullcontext
+
+import profiling
+from profiling import stage
+
+
+_DONE = object()
+
+
+class _Failed:
+    """Sent down the queues in place of items once a stage has raised"""
+
+    def __init__(self, error):
+        self.error = error
+
+
+class _UpstreamFailed(Exception):
+    def __init__(self, failure):
+        super().__init__(failure.error)
+        self.failure = failure
+
+
+# ================== QUEUES ==================
+def _put(q, item, stop):
+    """Blocking put that gives up once stop is set"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain(q, stop):
+    """
+    Items of q until the upstream stage is done (or stop is set).
+    Raises _UpstreamFailed if a stage upstream raised.
+    """
+    while not stop.is_set():
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _DONE:
+            return
+        if isinstance(item, _Failed):
+            raise _UpstreamFailed(item)
+        yield item
+
+
+# ================== STAGES ==================
+def _run_stage(name, items, fn, out, stop, context, timings):
+    """
+    Thread body of one stage: fn(item) for every item (or the items
+    themselves for the source) into the output queue. An exception - its
+    own or one from upstream - goes down the queue after the items so far.
+    """
+    with context() if context is not None else nullcontext():
+        profiling._local.timings = {}
+        end = _DONE
+        try:
+            while True:
+                if fn is None:
+                    # The source: producing the next item is the work
+                    with stage(name):
+                        item = next(items, _DONE)
+                    if item is _DONE:
+                        break
+                else:
+                    item = next(items, _DONE)
+                    if item is _DONE:
+                        break
+                    with stage(name):
+                        item = fn(item)
+                if not _put(out, item, stop):
+                    break
+        except _UpstreamFailed as e:
+            end = e.failure
+        except Exception as e:
+            end = _Failed(e)
+        finally:
+            if hasattr(items, 'close'):
+                # e.g. a generator that cleans up temporary files
+                items.close()
+            timings.append(profiling.current_timings())
+            profiling._local.timings = None
+            _put(out, end, stop)
+
+
+def pipeline(source, stages=(), maxsize=2, context=None):
+    """
+    Stream items through stages that run concurrently, one thread each.
+
+    source is (name, iterable) and every stage (name, fn), where fn maps one
+    item to the next. Stages are connected by queues of maxsize items, so a
+    fast stage runs at most maxsize items ahead of a slow one and the total
+    time approaches that of the slowest stage rather than the sum of all.
+    Results are yielded in the calling thread. If a stage raises, the
+    results produced before it are still yielded and then its exception is
+    re-raised in the calling thread; closing the generator stops every
+    thread. context, if given, is entered in each thread (e.g.
+    app.app_context), and stage timings are added to the current request.
+    """
+    name, items = source
+    stop = threading.Event()
+    timings = []
+    queues = [queue.Queue(maxsize) for _ in range(len(stages) + 1)]
+
+    threads = [threading.Thread(target=_run_stage, name=f'pipeline-{name}',
+                                args=(name, iter(items), None, queues[0], stop,
+                                      context, timings), daemon=True)]
+    for index, (name, fn) in enumerate(stages):
+        threads.append(threading.Thread(target=_run_stage, name=f'pipeline-{name}',
+                                        args=(name, _drain(queues[index], stop), fn,
+                                              queues[index + 1], stop, context,
+                                              timings), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    try:
+        yield from _drain(queues[-1], stop)
+    except _UpstreamFailed as e:
+        raise e.failure.error
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        for stage_timings in timings:
+            profiling.merge_timings(stage_timings)
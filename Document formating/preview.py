@@ -0,0 +1,173 @@
+import html
+import re
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+
+from lxml import etree
+
+from docxstream import (W, P, TBL, BODY, ParagraphClassifier, paragraph_text,
+                        iter_runs, is_on, RUN_TEXT)
+
+
+# ================== DEFAULTS ==================
+DEFAULT_CONFIG = {
+    # Body-level paragraphs/tables rendered in a preview
+    'PREVIEW_MAX_BLOCKS': 30,
+    # Seconds we may spend parsing a new upload before we cut the prefix short
+    'PREVIEW_PARSE_BUDGET': 0.5,
+    # Parsed uploads kept server-side for follow-up tweaks
+    'PREVIEW_CACHE_SIZE': 64,
+}
+
+# CSS equivalents of docformat.HIGHLIGHT_COLORS
+PREVIEW_HIGHLIGHTS = {
+    'TITLE': '#ffff00',
+    'HEADING': '#00ff00',
+    'PARAGRAPH': '#c0c0c0',
+    'LIST': '#ff00ff',
+    'TABLE': '#ffff00',
+}
+
+
+# ================== PARSING ==================
+def _runs(p):
+    runs = []
+    for r in iter_runs(p):
+        parts = []
+        for child in r:
+            if child.tag in RUN_TEXT:
+                text = RUN_TEXT[child.tag]
+                parts.append((child.text or '') if text is None else text)
+        if parts:
+            rpr = r.find(W + 'rPr')
+            runs.append((''.join(parts), is_on(rpr, 'b'), is_on(rpr, 'i'),
+                         is_on(rpr, 'u')))
+    return runs
+
+
+def parse_prefix(docx_file, max_blocks, budget):
+    """
+    Parse only the first max_blocks non-empty paragraphs/tables of the body.
+    Parsing stops early once budget seconds are used up.
+    Returns (blocks, truncated).
+    """
+    deadline = time.perf_counter() + budget
+    blocks = []
+
+    with zipfile.ZipFile(docx_file) as zf:
+        classifier = ParagraphClassifier.from_package(zf)
+
+        with zf.open('word/document.xml') as f:
+            for _, elem in etree.iterparse(f, events=('end',), tag=(P, TBL),
+                                           resolve_entities=False, huge_tree=True):
+                parent = elem.getparent()
+                if parent is None or parent.tag != BODY:
+                    continue
+
+                if elem.tag == P:
+                    runs = _runs(elem)
+                    text = ''.join(r[0] for r in runs)
+                    if text.strip():
+                        element_type, _ = classifier.classify(elem, text)
+                        blocks.append({'kind': 'p', 'type': element_type,
+                                       'runs': runs})
+                else:
+                    rows = [[
+                        '\n'.join(paragraph_text(p) for p in tc.iterchildren(P))
+                        for tc in tr.iterchildren(W + 'tc')]
+                        for tr in elem.iterchildren(W + 'tr')]
+                    blocks.append({'kind': 'table', 'type': 'TABLE', 'rows': rows})
+
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del parent[0]
+
+                if len(blocks) >= max_blocks:
+                    return blocks, True
+                if time.perf_counter() > deadline:
+                    return blocks, True
+
+    return blocks, False
+
+
+# ================== RENDERING ==================
+def _css_font(name):
+    # Font names come straight from the request - keep them inert inside style=""
+    return re.sub(r"[^\w \-]", "", str(name))
+
+
+def _block_style(block_type, settings):
+    """CSS for a block - simple font settings or a docformat-style config"""
+    config = settings.get('config')
+    if not config:
+        return (f"font-family:'{_css_font(settings['font_name'])}';"
+                f"font-size:{int(settings['font_size'])}pt;"), None
+
+    if block_type == 'TITLE':
+        font, size = config['title_font'], config['title_size']
+        bold = config.get('bold_titles')
+    elif block_type == 'HEADING':
+        font, size, bold = config['heading_font'], config['heading_size'], True
+    else:
+        font, size, bold = config['para_font'], config['para_size'], None
+
+    css = f"font-family:'{_css_font(font)}';font-size:{int(size)}pt;"
+    if bold is not None:
+        css += f"font-weight:{'bold' if bold else 'normal'};"
+    highlight = PREVIEW_HIGHLIGHTS.get(block_type) if config.get('highlight') else None
+    return css, highlight
+
+
+def render_preview(blocks, settings):
+    out = []
+    for block in blocks:
+        css, highlight = _block_style(block['type'], settings)
+        mark = f"background:{highlight};" if highlight else ""
+
+        if block['kind'] == 'table':
+            out.append(f'<table style="border-collapse:collapse;{css}">')
+            for row in block['rows']:
+                out.append('<tr>' + ''.join(
+                    f'<td style="border:1px solid #ccc;padding:2px 6px;{mark}">'
+                    f'{html.escape(cell)}</td>' for cell in row) + '</tr>')
+            out.append('</table>')
+            continue
+
+        spans = []
+        for text, bold, italic, underline in block['runs']:
+            run_css = mark
+            if bold:
+                run_css += "font-weight:bold;"
+            if italic:
+                run_css += "font-style:italic;"
+            if underline:
+                run_css += "text-decoration:underline;"
+            spans.append(f'<span style="{run_css}">{html.escape(text)}</span>')
+        out.append(f'<p style="margin:0 0 6px;{css}">{"".join(spans)}</p>')
+    return '\n'.join(out)
+
+
+# ================== CACHE ==================
+class PreviewCache:
+    """LRU of parsed upload prefixes, keyed by preview id (the upload's hash)"""
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, preview_id):
+        with self._lock:
+            entry = self._entries.get(preview_id)
+            if entry is not None:
+                self._entries.move_to_end(preview_id)
+            return entry
+
+    def put(self, preview_id, entry):
+        with self._lock:
+            self._entries[preview_id] = entry
+            self._entries.move_to_end(preview_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
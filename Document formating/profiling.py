@@ -0,0 +1,274 @@
+import cProfile
+import importlib
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import current_app, request, jsonify, send_file
+
+
+# ================== DEFAULTS ==================
+DEFAULT_CONFIG = {
+    # Opt-in per-request profiling (X-Profile header or ?profile=<token>)
+    'PROFILING_ALLOWED': False,
+    # X-Profile must carry this token; without one on-demand profiling and
+    # the /api/imports and /api/profiles endpoints stay off
+    'PROFILING_TOKEN': None,
+    # Seconds - requests slower than this get their sampled profile saved.
+    # None disables the sampler completely (no thread is started).
+    'PROFILING_SLOW_THRESHOLD': None,
+    'PROFILING_SAMPLE_INTERVAL': 0.01,
+    'PROFILE_FOLDER': 'profiles',
+}
+
+_local = threading.local()
+
+
+# ================== STAGE TIMINGS ==================
+@contextmanager
+def stage(name):
+    """
+    Time a processing stage of the current request.
+    Outside a request (CLI, workers) this is a no-op.
+    """
+    timings = getattr(_local, 'timings', None)
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def current_timings():
+    return dict(getattr(_local, 'timings', None) or {})
+
+
+def merge_timings(timings):
+    """Add timings measured elsewhere (e.g. in a worker process) to this request"""
+    current = getattr(_local, 'timings', None)
+    if current is None:
+        return
+    for name, seconds in timings.items():
+        current[name] = current.get(name, 0.0) + seconds
+
+
+def server_timing_header(timings):
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}"
+                     for name, seconds in timings.items())
+
+
+# ================== SAMPLER ==================
+class SlowRequestSampler:
+    """
+    Samples the stacks of in-flight requests from a background thread.
+    Samples are kept only for requests that end up slower than the threshold.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name='slow-request-sampler', daemon=True)
+        self._thread.start()
+
+    def begin(self, ident):
+        with self._lock:
+            self._active[ident] = Counter()
+
+    def end(self, ident):
+        with self._lock:
+            return self._active.pop(ident, Counter())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for ident, samples in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[_collapse(frame)] += 1
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(
+            f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+# ================== IMPORT TIMES ==================
+# module name -> seconds its first import took in this process
+IMPORT_TIMES = {}
+_import_lock = threading.RLock()
+
+
+def timed_import(name):
+    """
+    importlib.import_module that records how long the first import took.
+    Heavy dependencies are imported through this when first needed, so the
+    import report shows what a cold start and each first request paid for.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+
+    with _import_lock:
+        if name in sys.modules:
+            return sys.modules[name]
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        IMPORT_TIMES[name] = time.perf_counter() - start
+    return module
+
+
+def import_report():
+    return {name: round(seconds * 1000, 1)
+            for name, seconds in sorted(IMPORT_TIMES.items(), key=lambda kv: -kv[1])}
+
+
+# ================== REPORTS ==================
+def _write_report(folder, kind, timings, elapsed, stats=None, samples=None):
+    profile_id = uuid.uuid4().hex
+    os.makedirs(folder, exist_ok=True)
+
+    out = io.StringIO()
+    out.write(f"{kind} profile for {request.method} {request.path}\n")
+    out.write(f"Total: {elapsed * 1000:.1f} ms\n\n")
+    out.write("Stage breakdown:\n")
+    for name, seconds in sorted(timings.items(), key=lambda kv: -kv[1]):
+        out.write(f"  {name:<24} {seconds * 1000:10.1f} ms\n")
+    out.write("\n")
+
+    if stats is not None:
+        stats.dump_stats(os.path.join(folder, f"{profile_id}.prof"))
+        ps = pstats.Stats(stats, stream=out).sort_stats('cumulative')
+        ps.print_stats(40)
+        ps.print_callees(20)
+
+    if samples:
+        total = sum(samples.values())
+        out.write(f"Sampled stacks ({total} samples):\n")
+        with open(os.path.join(folder, f"{profile_id}.folded"), 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        for stack, count in samples.most_common(20):
+            leaf = stack.rsplit(";", 3)[-3:]
+            out.write(f"  {count:6d}  {' <- '.join(reversed(leaf))}\n")
+
+    with open(os.path.join(folder, f"{profile_id}.txt"), 'w') as f:
+        f.write(out.getvalue())
+
+    return profile_id
+
+
+# ================== FLASK HOOKS ==================
+def _authorized():
+    """The request carries the configured profiling token"""
+    config = current_app.config
+    token = config['PROFILING_TOKEN']
+    if not config['PROFILING_ALLOWED'] or not token:
+        return False
+    flag = request.headers.get('X-Profile') or request.args.get('profile')
+    return flag == token
+
+
+def init_profiling(app):
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    samplers = {}
+    samplers_lock = threading.Lock()
+
+    def get_sampler():
+        """The sampler for the configured interval, started on first use"""
+        interval = current_app.config['PROFILING_SAMPLE_INTERVAL']
+        with samplers_lock:
+            if interval not in samplers:
+                samplers[interval] = SlowRequestSampler(interval)
+            return samplers[interval]
+
+    @app.before_request
+    def start_profiling():
+        _local.timings = {}
+        _local.start = time.perf_counter()
+        _local.profiler = None
+        _local.sampler = None
+
+        if _authorized():
+            _local.profiler = cProfile.Profile()
+            _local.profiler.enable()
+        elif current_app.config['PROFILING_SLOW_THRESHOLD'] is not None:
+            # Read per request, so config changed after create_app applies
+            _local.sampler = get_sampler()
+            _local.sampler.begin(threading.get_ident())
+
+    @app.after_request
+    def finish_profiling(response):
+        start = getattr(_local, 'start', None)
+        if start is None:
+            return response
+
+        elapsed = time.perf_counter() - start
+        timings = current_timings()
+        folder = app.config['PROFILE_FOLDER']
+
+        profiler = _local.profiler
+        if profiler is not None:
+            profiler.disable()
+            profile_id = _write_report(folder, 'On-demand', timings, elapsed,
+                                       stats=profiler)
+            response.headers['X-Profile-Id'] = profile_id
+        elif getattr(_local, 'sampler', None) is not None:
+            samples = _local.sampler.end(threading.get_ident())
+            threshold = current_app.config['PROFILING_SLOW_THRESHOLD']
+            if threshold is not None and elapsed >= threshold:
+                profile_id = _write_report(folder, 'Slow request', timings,
+                                           elapsed, samples=samples)
+                response.headers['X-Profile-Id'] = profile_id
+                print(f"Slow request {request.path} ({elapsed:.2f}s) "
+                      f"profiled as {profile_id}")
+
+        if timings:
+            response.headers['Server-Timing'] = server_timing_header(timings)
+
+        _local.timings = None
+        _local.start = None
+        _local.profiler = None
+        _local.sampler = None
+        return response
+
+    @app.route('/api/imports', methods=['GET'])
+    def get_import_times():
+        if not _authorized():
+            return jsonify({'error': 'Profiling is disabled'}), 404
+        # Milliseconds, slowest first
+        return jsonify(import_report())
+
+    @app.route('/api/profiles/<profile_id>', methods=['GET'])
+    def get_profile(profile_id):
+        if not _authorized():
+            return jsonify({'error': 'Profiling is disabled'}), 404
+        if not all(c in '0123456789abcdef' for c in profile_id):
+            return jsonify({'error': 'Invalid profile id'}), 400
+
+        path = os.path.join(app.config['PROFILE_FOLDER'], f"{profile_id}.txt")
+        if not os.path.exists(path):
+            return jsonify({'error': 'Profile not found'}), 404
+        return send_file(os.path.abspath(path), mimetype='text/plain')
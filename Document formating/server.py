@@ -0,0 +1,92 @@
+import os
+import time
+
+from flask import Flask, current_app
+from flask_cors import CORS
+from werkzeug.local import LocalProxy
+
+from admission import AdmissionController
+import fair_scheduler
+import ingest
+import output_store
+from profiling import init_profiling, timed_import, import_report
+from singleflight import SingleFlight
+from stage_cache import StageCache
+import ui
+
+
+# ================== DEFAULTS ==================
+DEFAULT_CONFIG = {
+    'UPLOAD_FOLDER': 'uploads',
+    'OUTPUT_FOLDER': 'outputs',
+    'MAX_CONTENT_LENGTH': 16 * 1024 * 1024,
+}
+
+# Blueprint name -> (module defining it as `bp`, default url prefix)
+BLUEPRINTS = {
+    'formatter': ('app', ''),
+    'analyzer': ('docanalyze', '/analyzer'),
+    'smart': ('docformat', '/smart'),
+}
+
+# Shared by every blueprint mounted on the current app
+admission = LocalProxy(lambda: current_app.extensions['admission'])
+stage_cache = LocalProxy(lambda: current_app.extensions['stage_cache'])
+inflight = LocalProxy(lambda: current_app.extensions['inflight'])
+outputs = LocalProxy(lambda: current_app.extensions['output_store'])
+
+
+# ================== FACTORY ==================
+def create_app(config=None, mounts=None):
+    """
+    Build one app serving the formatter, analyzer and smart formatter.
+
+    mounts maps blueprint name -> url prefix and defaults to all of
+    BLUEPRINTS. Nothing heavy (torch, transformers, pdf2image, COM) is
+    imported here; the routes that need those import them on first use.
+    """
+    start = time.perf_counter()
+    if mounts is None:
+        mounts = {name: prefix for name, (_, prefix) in BLUEPRINTS.items()}
+
+    modules = {name: timed_import(BLUEPRINTS[name][0]) for name in mounts}
+
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    for module in (ui, ingest, output_store, fair_scheduler, *modules.values()):
+        for key, value in getattr(module, 'DEFAULT_CONFIG', {}).items():
+            app.config.setdefault(key, value)
+    app.config.update(config or {})
+
+    # Absolute, so send_file finds files wherever the server was started from
+    for key in ('UPLOAD_FOLDER', 'OUTPUT_FOLDER'):
+        app.config[key] = os.path.abspath(app.config[key])
+        os.makedirs(app.config[key], exist_ok=True)
+
+    CORS(app)
+    app.extensions['admission'] = AdmissionController(app.config)
+    app.extensions['stage_cache'] = StageCache.from_config(app.config)
+    app.extensions['inflight'] = SingleFlight()
+    init_profiling(app)
+    fair_scheduler.init_scheduler(app)
+    ingest.init_ingest(app)
+    output_store.init_output_store(app)
+
+    for name, prefix in mounts.items():
+        app.register_blueprint(modules[name].bp, url_prefix=prefix or None)
+    ui.compile_pages(app)
+
+    print_startup_report(time.perf_counter() - start)
+    return app
+
+
+def print_startup_report(elapsed):
+    """Imports timed so far; `python -X importtime server.py` has the full tree"""
+    print(f"App created in {elapsed * 1000:.0f} ms")
+    for name, ms in import_report().items():
+        print(f"  import {name:<28} {ms:8.1f} ms")
+
+
+# ================== RUN ==================
+if __name__ == '__main__':
+    create_app().run(debug=True, port=5000)
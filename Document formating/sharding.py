@@ -0,0 +1,125 @@
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from lxml import etree
+from docx import Document
+from docx.oxml import parse_xml
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+
+from docxstream import W, P, TBL, ParagraphClassifier, paragraph_text
+
+
+# ================== DEFAULTS ==================
+DEFAULT_CONFIG = {
+    # Documents whose admission cost estimate reaches this are sharded.
+    # None disables sharding.
+    'SHARD_MIN_COST': 16 * 1024 * 1024,
+    # Preferred number of body paragraphs/tables per shard
+    'SHARD_SIZE': 2000,
+    'SHARD_WORKERS': os.cpu_count() or 1,
+}
+
+
+# ================== PLANNING ==================
+def _ends_section(elem):
+    return elem.tag == P and elem.find(f'{W}pPr/{W}sectPr') is not None
+
+
+def plan_shards(body, shard_size):
+    """
+    Split the body's paragraphs and tables into shards of about shard_size
+    blocks. Shards end at a section break where possible and are forced to
+    end at twice shard_size inside very long sections.
+    Other body children (sectPr, bookmarks, content controls) stay in place.
+    """
+    shards = []
+    current = []
+    for child in body:
+        if child.tag not in (P, TBL):
+            continue
+        current.append(child)
+        if ((len(current) >= shard_size and _ends_section(child))
+                or len(current) >= 2 * shard_size):
+            shards.append(current)
+            current = []
+    if current:
+        shards.append(current)
+    return shards
+
+
+# ================== WORKER ==================
+def _format_shard(fragments, classifier, config):
+    """Classify and format one shard - runs in a worker process"""
+    # Same per-paragraph/per-table code as the serial docformat.format_docx
+    import docformat
+
+    out = []
+    for xml in fragments:
+        elem = parse_xml(xml)
+        if elem.tag == P:
+            ptype = None
+            text = paragraph_text(elem)
+            if text.strip():
+                ptype, _ = classifier.classify(elem, text)
+            docformat.format_paragraph(Paragraph(elem, None), ptype, config)
+        else:
+            docformat.format_table(Table(elem, None), config)
+        out.append(etree.tostring(elem))
+    return out
+
+
+_executor = None
+_executor_workers = None
+_executor_lock = threading.Lock()
+
+
+def get_shard_executor(workers):
+    """The shared shard process pool, rebuilt when the worker count changes"""
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is not None and _executor_workers != workers:
+            # Shards already submitted to the old pool still run to completion
+            _executor.shutdown(wait=False)
+            _executor = None
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('spawn'))
+            _executor_workers = workers
+        return _executor
+
+
+# ================== PARALLEL FORMAT ==================
+def format_docx_sharded(input_path, output_path, config, workers, shard_size):
+    """
+    docformat.format_docx for one very large document, spread over processes.
+
+    The body is cut into shards at section/block boundaries, every shard is
+    classified and formatted in a worker, and the formatted XML replaces the
+    original elements in place. Parsing and saving the package stay serial in
+    this process; only classification and formatting run in parallel. Formatting never adds relationships, so the
+    r:id references inside the fragments stay valid in the merged package
+    and the output matches the serial path.
+    """
+    doc = Document(input_path)
+    with zipfile.ZipFile(input_path) as zf:
+        classifier = ParagraphClassifier.from_package(zf)
+
+    body = doc.element.body
+    shards = plan_shards(body, shard_size)
+    executor = get_shard_executor(workers)
+
+    futures = [executor.submit(_format_shard,
+                               [etree.tostring(elem) for elem in shard],
+                               classifier, config)
+               for shard in shards]
+
+    for shard, future in zip(shards, futures):
+        for old, xml in zip(shard, future.result()):
+            body.replace(old, parse_xml(xml))
+
+    doc.save(output_path)
+    return len(shards)
@@ -0,0 +1,76 @@
+import copy
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+def _waiter_error(error):
+    """
+    A copy of the leader's exception for one waiter. Raising the shared
+    instance from several threads would pile every waiter's frames onto
+    the one traceback.
+    """
+    try:
+        return copy.copy(error)
+    except Exception:
+        # Exceptions whose __init__ doesn't take their args back
+        return RuntimeError(f"Coalesced job failed: {error}")
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent jobs: while a job for a key is running,
+    later callers with the same key wait for it and share its result
+    (or its exception) instead of running their own copy.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.counters = {'leaders': 0, 'coalesced': 0, 'in_flight': 0}
+
+    def do(self, key, fn):
+        """Run fn for key, or join the run already in flight. Returns (result, coalesced)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.counters['coalesced'] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.counters['leaders'] += 1
+                self.counters['in_flight'] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise _waiter_error(call.error) from call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                self.counters['in_flight'] -= 1
+            call.done.set()
+
+        if call.waiters:
+            print(f"Shared result with {call.waiters} coalesced request(s)")
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
@@ -0,0 +1,223 @@
+import hashlib
+import os
+import pickle
+import threading
+import zipfile
+from collections import OrderedDict
+
+
+# ================== DEFAULTS ==================
+DEFAULT_CONFIG = {
+    'STAGE_CACHE_MEMORY_MB': 256,
+    # None keeps the cache in memory only
+    'STAGE_CACHE_FOLDER': 'cache',
+    'STAGE_CACHE_DISK_MB': 2048,
+}
+
+# Parts that change on every save without changing what gets rendered
+VOLATILE_PARTS = ('docProps/', 'customXml/')
+
+
+# ================== KEYS ==================
+def file_digest(path):
+    """sha256 of a whole file"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def stream_digest(stream):
+    """sha256 of a seekable stream (e.g. an upload), rewound afterwards"""
+    h = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+        h.update(chunk)
+    stream.seek(0)
+    return h.hexdigest()
+
+
+def content_digest(path):
+    """
+    Hash of the rendered content of a DOCX: the name and decompressed bytes of
+    every part. Metadata parts are ignored, so a re-saved copy of the same
+    document hashes the same.
+    """
+    h = hashlib.blake2b()
+    with zipfile.ZipFile(path) as zf:
+        for info in sorted(zf.infolist(), key=lambda i: i.filename):
+            if info.filename.startswith(VOLATILE_PARTS):
+                continue
+            h.update(f"{info.filename}:{info.file_size}\n".encode())
+            with zf.open(info) as part:
+                for chunk in iter(lambda: part.read(1024 * 1024), b''):
+                    h.update(chunk)
+    return h.hexdigest()
+
+
+def image_digest(image):
+    h = hashlib.sha256()
+    h.update(f"{image.mode}:{image.size}".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def tensors_digest(tensors):
+    """Hash of a dict of tensors (e.g. a model encoding)"""
+    h = hashlib.sha256()
+    for key in sorted(tensors):
+        value = tensors[key]
+        h.update(f"{key}:{tuple(value.shape)}:{value.dtype}".encode())
+        h.update(value.cpu().numpy().tobytes())
+    return h.hexdigest()
+
+
+# ================== CACHE ==================
+class StageCache:
+    """
+    Two-tier cache for intermediate pipeline results.
+    Values are stored pickled, so every hit returns a fresh copy that the
+    caller is free to modify. The memory tier is an LRU bounded by pickled
+    size; evicted entries stay available from the disk tier, which is bounded
+    the same way and survives restarts.
+    """
+
+    def __init__(self, max_memory_bytes, folder=None, max_disk_bytes=0):
+        self.max_memory_bytes = max_memory_bytes
+        self.folder = folder
+        self.max_disk_bytes = max_disk_bytes
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+            self._load_disk_index()
+
+    @classmethod
+    def from_config(cls, config):
+        settings = {key: config.get(key, value)
+                    for key, value in DEFAULT_CONFIG.items()}
+        return cls(settings['STAGE_CACHE_MEMORY_MB'] * 1024 * 1024,
+                   settings['STAGE_CACHE_FOLDER'],
+                   settings['STAGE_CACHE_DISK_MB'] * 1024 * 1024)
+
+    def _load_disk_index(self):
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.endswith('.pkl'):
+                path = os.path.join(self.folder, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.folder, f"{key}.pkl")
+
+    @staticmethod
+    def _key(namespace, key):
+        # Also the file name on disk, so any key (paths, model names) is safe
+        return hashlib.sha256(f"{namespace}\0{key}".encode()).hexdigest()
+
+    # -------- memory tier (caller holds the lock) --------
+    def _remember(self, key, data):
+        if len(data) > self.max_memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    # -------- disk tier --------
+    def _write_disk(self, key, data):
+        if not self.folder or len(data) > self.max_disk_bytes:
+            return
+
+        tmp = self._path(key) + f".{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self._path(key))
+
+        evict = []
+        with self._lock:
+            self._disk_bytes -= self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            while self._disk_bytes > self.max_disk_bytes:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                evict.append(old_key)
+
+        for old_key in evict:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def _read_disk(self, key):
+        with self._lock:
+            if key not in self._disk:
+                return None
+            self._disk.move_to_end(key)
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+            os.utime(self._path(key))
+            return data
+        except OSError:
+            with self._lock:
+                self._disk_bytes -= self._disk.pop(key, 0)
+            return None
+
+    # -------- public API --------
+    def get(self, namespace, key, default=None):
+        key = self._key(namespace, key)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return pickle.loads(data)
+
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self.counters['misses'] += 1
+                return default
+            self.counters['disk_hits'] += 1
+            self._remember(key, data)
+        return pickle.loads(data)
+
+    def put(self, namespace, key, value):
+        key = self._key(namespace, key)
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._remember(key, data)
+        self._write_disk(key, data)
+
+    def get_or_compute(self, namespace, key, compute):
+        """Return the cached value, or compute, store and return it (None is not cached)"""
+        value = self.get(namespace, key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.put(namespace, key, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters,
+                        memory_entries=len(self._memory),
+                        memory_mb=round(self._memory_bytes / 1024 / 1024, 1),
+                        disk_entries=len(self._disk),
+                        disk_mb=round(self._disk_bytes / 1024 / 1024, 1))
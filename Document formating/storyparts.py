@@ -0,0 +1,55 @@
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.oxml import serialize_part_xml
+from docx.opc.part import XmlPart
+from docx.oxml import parse_xml
+from docx.oxml.ns import qn
+from docx.text.run import Run
+
+
+# Relationship types (from the main document part) that point at story parts.
+# Headers/footers cover default, first-page and even-page variants alike.
+STORY_RELTYPES = (
+    RT.HEADER,
+    RT.FOOTER,
+    RT.FOOTNOTES,
+    RT.ENDNOTES,
+    RT.COMMENTS,
+)
+
+
+def iter_story_parts(doc):
+    """
+    Yield the root element of every distinct story part of the document exactly once:
+    the main body, every header/footer, footnotes, endnotes and comments.
+
+    Parts python-docx has no class for (footnotes, endnotes...) are parsed from
+    their blob and written back once the caller is done with the element.
+    """
+    seen = set()
+    parts = [doc.part]
+    for rel in doc.part.rels.values():
+        if not rel.is_external and rel.reltype in STORY_RELTYPES:
+            parts.append(rel.target_part)
+
+    for part in parts:
+        # Linked headers/footers are shared between sections - one pass per part
+        if id(part) in seen:
+            continue
+        seen.add(id(part))
+
+        if isinstance(part, XmlPart):
+            yield part.element
+        else:
+            element = parse_xml(part.blob)
+            yield element
+            part._blob = serialize_part_xml(element)
+
+
+def iter_story_runs(doc):
+    """
+    Yield a Run for every w:r in every story part - including runs inside
+    tables, nested tables, hyperlinks, content controls and text boxes (w:txbxContent).
+    """
+    for element in iter_story_parts(doc):
+        for r in element.iter(qn('w:r')):
+            yield Run(r, None)
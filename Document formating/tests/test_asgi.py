@@ -0,0 +1,138 @@
+import asyncio
+import json
+import threading
+
+import pytest
+from flask import request, send_file
+
+from server import create_app
+
+
+@pytest.fixture
+def adapter(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    import asgi
+
+    app = create_app({'WORKER_POOL_SIZE': 0, 'STAGE_CACHE_FOLDER': None,
+                      'ASGI_ROUTE_LIMITS': {'/slow': (1, 5)},
+                      'ASGI_QUEUE_TIMEOUT': 0.2,
+                      'ASGI_SPOOL_MEMORY': 16})
+    app.release = threading.Event()
+    download = tmp_path / 'download.bin'
+    download.write_bytes(b'x' * 100000)
+
+    @app.route('/slow')
+    def slow():
+        app.release.wait(5)
+        return 'done'
+
+    @app.route('/echo', methods=['POST'])
+    def echo():
+        return request.get_data()
+
+    @app.route('/download')
+    def download_file():
+        return send_file(str(download))
+
+    return asgi.ASGIAdapter(app)
+
+
+async def call(adapter, method, path, body=b'', chunk=None, extensions=None):
+    """One request through the adapter, as an ASGI server would make it"""
+    chunk = chunk or max(len(body), 1)
+    parts = [body[i:i + chunk] for i in range(0, len(body), chunk)] or [b'']
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+             'headers': [(b'host', b'test')], 'http_version': '1.1',
+             'scheme': 'http', 'server': ('test', 80), 'client': ('127.0.0.1', 1),
+             'extensions': extensions or {}}
+
+    async def receive():
+        return {'type': 'http.request', 'body': parts.pop(0), 'more_body': bool(parts)}
+
+    response = {'body': b'', 'messages': []}
+
+    async def send(message):
+        response['messages'].append(message['type'])
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = dict(message['headers'])
+        elif message['type'] == 'http.response.zerocopysend':
+            response['zerocopy'] = (message['offset'], message['count'])
+        else:
+            response['body'] += message.get('body', b'')
+
+    await adapter(scope, receive, send)
+    return response
+
+
+def test_light_route(adapter):
+    response = asyncio.run(call(adapter, 'GET', '/api/health'))
+    assert response['status'] == 200
+    assert json.loads(response['body'])['status']
+
+
+def test_route_limit_rejects_when_full(adapter):
+    async def main():
+        first = asyncio.create_task(call(adapter, 'GET', '/slow'))
+        await asyncio.sleep(0.05)
+        second = await call(adapter, 'GET', '/slow')
+        adapter.wsgi_app.release.set()
+        return await first, second
+
+    first, second = asyncio.run(main())
+    assert first['status'] == 200 and first['body'] == b'done'
+    assert second['status'] == 503
+    assert second['headers'][b'retry-after'] == b'5'
+    assert adapter.stats()['/slow']['rejected'] == 1
+    assert adapter.stats()['/slow']['active'] == 0
+
+
+def test_spooled_body_round_trip(adapter):
+    # Both the request and the response are larger than the in-memory spool
+    body = bytes(range(256)) * 40
+    response = asyncio.run(call(adapter, 'POST', '/echo', body, chunk=1000))
+    assert response['status'] == 200
+    assert response['body'] == body
+    assert response['headers'][b'content-length'] == str(len(body)).encode()
+
+
+def test_file_response_uses_zerocopysend(adapter):
+    extensions = {'http.response.zerocopysend': {}}
+    response = asyncio.run(call(adapter, 'GET', '/download', extensions=extensions))
+    assert response['status'] == 200
+    assert response['zerocopy'] == (0, 100000)
+    assert 'http.response.body' not in response['messages']
+
+    plain = asyncio.run(call(adapter, 'GET', '/download'))
+    assert plain['body'] == b'x' * 100000
+
+
+def test_non_docx_upload_refused_while_arriving(adapter):
+    boundary = 'test-boundary'
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; '
+            f'filename="fake.docx"\r\nContent-Type: application/octet-stream\r\n\r\n'
+            ).encode() + b'not a zip file ' * 1000 + f'\r\n--{boundary}--\r\n'.encode()
+
+    async def main():
+        parts = [body[i:i + 1024] for i in range(0, len(body), 1024)]
+        total = len(parts)
+        scope = {'type': 'http', 'method': 'POST', 'path': '/api/format',
+                 'query_string': b'', 'client': ('127.0.0.1', 1),
+                 'headers': [(b'content-type',
+                              f'multipart/form-data; boundary={boundary}'.encode())]}
+
+        async def receive():
+            return {'type': 'http.request', 'body': parts.pop(0), 'more_body': bool(parts)}
+
+        statuses = []
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+
+        await adapter(scope, receive, send)
+        return statuses, total - len(parts)
+
+    statuses, received = asyncio.run(main())
+    assert statuses == [400]
+    assert received < 3
@@ -0,0 +1,141 @@
+import zipfile
+
+from docxstream import (iter_document_elements, load_numbering, load_styles,
+                        section_types, W_NS)
+
+
+def make_docx(path, body, styles='', numbering=None):
+    """A minimal .docx with the given body, styles and numbering XML"""
+    ns = f'xmlns:w="{W_NS}"'
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr('word/document.xml',
+                    f'<w:document {ns}><w:body>{body}</w:body></w:document>')
+        zf.writestr('word/styles.xml', f'<w:styles {ns}>{styles}</w:styles>')
+        if numbering is not None:
+            zf.writestr('word/numbering.xml',
+                        f'<w:numbering {ns}>{numbering}</w:numbering>')
+    return path
+
+
+def para(text, ppr=''):
+    return f'<w:p><w:pPr>{ppr}</w:pPr><w:r><w:t>{text}</w:t></w:r></w:p>'
+
+
+def num_pr(num_id, ilvl=0):
+    return f'<w:numPr><w:ilvl w:val="{ilvl}"/><w:numId w:val="{num_id}"/></w:numPr>'
+
+
+STYLES = '''
+<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/></w:style>
+<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/></w:style>
+'''
+
+NUMBERING = '''
+<w:abstractNum w:abstractNumId="0"><w:lvl w:ilvl="0"><w:numFmt w:val="bullet"/></w:lvl></w:abstractNum>
+<w:abstractNum w:abstractNumId="1"><w:lvl w:ilvl="0"><w:numFmt w:val="none"/></w:lvl></w:abstractNum>
+<w:num w:numId="1"><w:abstractNumId w:val="0"/></w:num>
+<w:num w:numId="2"><w:abstractNumId w:val="1"/></w:num>
+'''
+
+# A list style: numbering.xml's abstractNum 1 only links to the MyList style,
+# whose own numPr points at the numbering that defines the levels
+LINKED_STYLES = STYLES + '''
+<w:style w:type="numbering" w:styleId="MyList"><w:name w:val="My List"/>
+  <w:pPr>''' + num_pr(1) + '''</w:pPr></w:style>
+<w:style w:type="paragraph" w:styleId="ListItem"><w:name w:val="List Item"/>
+  <w:pPr>''' + num_pr(2) + '''</w:pPr></w:style>
+'''
+
+LINKED_NUMBERING = '''
+<w:abstractNum w:abstractNumId="0"><w:lvl w:ilvl="0"><w:numFmt w:val="decimal"/></w:lvl></w:abstractNum>
+<w:abstractNum w:abstractNumId="1"><w:numStyleLink w:val="MyList"/></w:abstractNum>
+<w:num w:numId="1"><w:abstractNumId w:val="0"/></w:num>
+<w:num w:numId="2"><w:abstractNumId w:val="1"/></w:num>
+'''
+
+
+def types(path):
+    return [(record['para_idx'], record['type'])
+            for record in iter_document_elements(path, include_text=False)]
+
+
+def test_direct_numbering_is_list(tmp_path):
+    path = make_docx(tmp_path / 'lists.docx',
+                     para('Intro') +
+                     para('Bullet', num_pr(1)) +
+                     # numFmt none and numId 0 number nothing
+                     para('Unnumbered', num_pr(2)) +
+                     para('Switched off', num_pr(0)) +
+                     para('Numbered heading', '<w:pStyle w:val="Heading1"/>' + num_pr(1)),
+                     STYLES, NUMBERING)
+
+    assert types(path) == [(0, 'PARAGRAPH'), (1, 'LIST'), (2, 'PARAGRAPH'),
+                           (3, 'PARAGRAPH'), (4, 'HEADING')]
+
+
+def test_list_style_link(tmp_path):
+    path = make_docx(tmp_path / 'linked.docx',
+                     para('Item', '<w:pStyle w:val="ListItem"/>') +
+                     para('Plain'),
+                     LINKED_STYLES, LINKED_NUMBERING)
+
+    with zipfile.ZipFile(path) as zf:
+        names, default_id, style_numbering = load_styles(zf)
+        numbering = load_numbering(zf, style_numbering)
+
+    # List styles number paragraphs but are not paragraph styles themselves
+    assert 'MyList' not in names
+    assert default_id == 'Normal'
+    assert style_numbering['MyList'] == ('1', 0)
+    assert numbering == {'1': {0: 'decimal'}, '2': {0: 'decimal'}}
+    assert types(path) == [(0, 'LIST'), (1, 'PARAGRAPH')]
+
+
+def section(section_type=None):
+    """A w:sectPr, in a paragraph's pPr or at the end of the body"""
+    type_xml = f'<w:type w:val="{section_type}"/>' if section_type else ''
+    return f'<w:sectPr>{type_xml}<w:pgSz w:w="11906" w:h="16838"/></w:sectPr>'
+
+
+def pages(path):
+    return [record['page'] for record in iter_document_elements(path, include_text=False)]
+
+
+def test_section_types(tmp_path):
+    path = make_docx(tmp_path / 'sections.docx',
+                     para('One', section()) +
+                     para('Two', section('continuous')) +
+                     para('Three', '<w:sectPr/>') +
+                     para('Four') + section('oddPage'),
+                     STYLES)
+
+    with zipfile.ZipFile(path) as zf:
+        expected = ['nextPage', 'continuous', 'nextPage', 'oddPage']
+        assert section_types(zf) == expected
+        # sectPrs split across chunks
+        for chunk_size in (7, 16, 50):
+            assert section_types(zf, chunk_size) == expected
+
+
+def test_section_breaks_start_pages(tmp_path):
+    # A section's type says how it starts: the break after 'Two' is the
+    # third section's (continuous), the one after 'Three' the body's
+    path = make_docx(tmp_path / 'sections.docx',
+                     para('One') +
+                     para('Two', section()) +
+                     para('Three', section('continuous')) +
+                     para('Four') + section('evenPage'),
+                     STYLES)
+
+    assert pages(path) == [1, 1, 1, 2]
+
+
+def test_rendered_break_after_section_break_counts_once(tmp_path):
+    path = make_docx(tmp_path / 'saved.docx',
+                     para('One', section()) +
+                     '<w:p><w:r><w:lastRenderedPageBreak/><w:t>Two</w:t></w:r></w:p>' +
+                     '<w:p><w:r><w:lastRenderedPageBreak/><w:t>Three</w:t></w:r></w:p>' +
+                     section(),
+                     STYLES)
+
+    assert pages(path) == [1, 2, 3]
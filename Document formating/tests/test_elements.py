@@ -0,0 +1,64 @@
+import pickle
+
+from elements import ElementTable
+
+
+RECORDS = [
+    {'type': 'TITLE', 'para_idx': 0, 'text': 'Report', 'page': 1},
+    {'type': 'PARAGRAPH', 'para_idx': 2, 'text': 'Body text', 'confidence': 0.5},
+    {'type': 'TABLE', 'table_idx': 0, 'text': 'a\tb', 'page': 2},
+    {'type': 'LIST', 'para_idx': 3, 'text': 'First item', 'page': 2},
+]
+
+
+def test_from_records_round_trip():
+    table = ElementTable.from_records(RECORDS)
+
+    assert len(table) == 4
+    assert [table.text_at(row) for row in range(4)] == \
+        ['Report', 'Body text', 'a\tb', 'First item']
+    assert table.to_dicts() == [
+        {'index': 0, 'type': 'TITLE', 'confidence': 1.0, 'offset': [0, 6],
+         'page': 1, 'para_idx': 0, 'text': 'Report'},
+        {'index': 1, 'type': 'PARAGRAPH', 'confidence': 0.5, 'offset': [6, 15],
+         'para_idx': 2, 'text': 'Body text'},
+        {'index': 2, 'type': 'TABLE', 'confidence': 1.0, 'offset': [15, 18],
+         'page': 2, 'table_idx': 0, 'text': 'a\tb'},
+        {'index': 3, 'type': 'LIST', 'confidence': 1.0, 'offset': [18, 28],
+         'page': 2, 'para_idx': 3, 'text': 'First item'},
+    ]
+
+
+def test_para_lookups():
+    table = ElementTable.from_records(RECORDS)
+
+    assert table.type_of_para(0) == 'TITLE'
+    # Paragraph 1 was empty and has no element
+    assert table.type_of_para(1) is None
+    assert table.type_of_para(3) == 'LIST'
+    assert table.type_of_para(99) is None
+    assert table.table_rows() == [2]
+    assert table.uncertain_rows(0.7) == [1]
+
+
+def test_pickle_round_trip():
+    table = ElementTable.from_records(RECORDS)
+    table.set_type(1, 'HEADING', confidence=0.9)
+
+    copy = pickle.loads(pickle.dumps(table))
+
+    assert copy.to_dicts() == table.to_dicts()
+    assert copy.type_of_para(2) == 'HEADING'
+    assert copy.table_rows() == [2]
+    # Still appendable after unpickling
+    copy.append('PARAGRAPH', para_idx=4, text='More')
+    assert copy.text_at(4) == 'More'
+    assert copy.type_of_para(4) == 'PARAGRAPH'
+
+
+def test_confidence_keeps_threshold_values():
+    table = ElementTable.from_records(RECORDS)
+    table.set_type(1, 'HEADING', confidence=0.7)
+
+    assert table.confidence[1] == 0.7
+    assert table.uncertain_rows(0.7) == []
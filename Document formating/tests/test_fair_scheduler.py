@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+
+from fair_scheduler import (DEFAULT_CONFIG, Client, FairLane, FairScheduler,
+                            Job, RateLimited, client_id)
+
+
+def job(name, priority='interactive'):
+    return Job(Client(name, 1, None, 0, None), priority)
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_bulk_never_takes_reserved_slots():
+    lane = FairLane('small', 2, reserved=1)
+    assert lane.acquire(0, job('a', 'bulk'))
+    assert not lane.acquire(0, job('b', 'bulk'))
+    assert lane.acquire(0, job('c'))
+
+
+def test_one_slot_lane_lends_its_bulk_slot():
+    lane = FairLane('large', 1, reserved=1)
+    bulk = job('partner', 'bulk')
+    assert lane.acquire(0, bulk)
+
+    # The interactive job starts beside the bulk job instead of behind it
+    interactive = job('user')
+    assert lane.acquire(0, interactive)
+    assert not lane.acquire(0, job('other'))
+    assert not lane.acquire(0, job('partner', 'bulk'))
+
+    lane.release(bulk, 0)
+    # Back to one slot, held by the interactive job
+    assert not lane.acquire(0, job('other'))
+    lane.release(interactive, 0)
+    assert lane.acquire(0, job('other'))
+
+
+def test_weights_share_a_backlogged_lane():
+    lane = FairLane('small', 1)
+    blocker = job('blocker')
+    assert lane.acquire(0, blocker)
+
+    heavy = Client('heavy', 2, None, 0, None)
+    light = Client('light', 1, None, 0, None)
+    served = []
+
+    def run(client):
+        own = Job(client, 'interactive')
+        assert lane.acquire(10, own)
+        served.append(client.name)
+        lane.release(own, 0)
+
+    threads = [threading.Thread(target=run, args=(client,))
+               for _ in range(12) for client in (heavy, light)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: lane.stats()['waiting'] == len(threads))
+    lane.release(blocker, 0)
+    for thread in threads:
+        thread.join()
+
+    # While both are backlogged, heavy gets two slots for each one of light's
+    assert served[:12].count('heavy') == 8
+    assert served[:12].count('light') == 4
+
+
+def test_timed_out_job_gives_back_its_share():
+    lane = FairLane('small', 1)
+    blocker = job('blocker')
+    assert lane.acquire(0, blocker)
+
+    client = Client('a', 1, None, 0, None)
+    for _ in range(3):
+        assert not lane.acquire(0, Job(client, 'interactive'))
+    assert lane._finish['interactive']['a'] == 0
+
+
+def test_client_header_only_when_trusted():
+    headers = {'X-Client-Id': 'partner'}
+    assert client_id(headers, '10.0.0.1', None) == '10.0.0.1'
+    assert client_id(headers, '10.0.0.1', 'X-Client-Id') == 'partner'
+    assert client_id({}, '10.0.0.1', 'X-Client-Id') == '10.0.0.1'
+
+
+def test_rate_limit_off_by_default():
+    scheduler = FairScheduler(DEFAULT_CONFIG)
+    for _ in range(100):
+        scheduler.job_for('smart.analyze', '10.0.0.1')
+
+
+def test_configured_rate_limit():
+    config = dict(DEFAULT_CONFIG, FAIR_CLIENTS={'p': {'rate': 1, 'burst': 2}})
+    scheduler = FairScheduler(config)
+    scheduler.job_for('smart.analyze', 'p')
+    scheduler.job_for('smart.analyze', 'p')
+    with pytest.raises(RateLimited):
+        scheduler.job_for('smart.analyze', 'p')
+
+
+def test_idle_clients_are_forgotten():
+    scheduler = FairScheduler(dict(DEFAULT_CONFIG, FAIR_MAX_CLIENTS=3))
+    busy = scheduler.job_for('smart.analyze', 'busy')
+    busy.client.queued(1)
+    for i in range(10):
+        scheduler.job_for('smart.analyze', f'client-{i}')
+
+    assert len(scheduler.stats()) == 3
+    # Clients with queued or running jobs are kept
+    assert 'busy' in scheduler.stats()
+    assert 'client-9' in scheduler.stats()
@@ -0,0 +1,52 @@
+from docx import Document
+from docx.enum.text import WD_COLOR_INDEX
+from docx.oxml.ns import qn
+
+from docanalyze import HIGHLIGHT_COLORS, SHADING_FILLS, Highlighter
+from elements import ElementTable
+
+
+def make_document(path):
+    doc = Document()
+    doc.add_paragraph('Intro')
+    table = doc.add_table(rows=1, cols=2)
+    table.cell(0, 0).paragraphs[0].add_run('left')
+    table.cell(0, 1).paragraphs[0].add_run('right')
+    doc.save(path)
+    return path
+
+
+def elements(table_type):
+    return ElementTable.from_records([
+        {'type': 'PARAGRAPH', 'para_idx': 0, 'text': 'Intro'},
+        {'type': table_type, 'table_idx': 0, 'text': 'left | right'},
+    ])
+
+
+def highlight(tmp_path, table_type, mode):
+    highlighter = Highlighter(make_document(tmp_path / 'in.docx'), mode)
+    table = elements(table_type)
+    for row in range(len(table)):
+        highlighter.element(table, row)
+    highlighter.save(tmp_path / 'out.docx')
+    return Document(tmp_path / 'out.docx').tables[0]
+
+
+def test_table_highlighted(tmp_path):
+    table = highlight(tmp_path, 'TABLE', 'runs')
+    assert table.cell(0, 0).paragraphs[0].runs[0].font.highlight_color == \
+        WD_COLOR_INDEX.YELLOW
+
+
+def test_layout_table_gets_paragraph_colour(tmp_path):
+    # The model may relabel an unstyled table as PARAGRAPH (layout)
+    table = highlight(tmp_path, 'PARAGRAPH', 'runs')
+    for cell in table.rows[0].cells:
+        assert cell.paragraphs[0].runs[0].font.highlight_color == \
+            HIGHLIGHT_COLORS['PARAGRAPH']
+
+
+def test_layout_table_shading(tmp_path):
+    table = highlight(tmp_path, 'PARAGRAPH', 'shading')
+    fills = [shd.get(qn('w:fill')) for shd in table._tbl.iter(qn('w:shd'))]
+    assert fills == [SHADING_FILLS[HIGHLIGHT_COLORS['PARAGRAPH']]] * 2
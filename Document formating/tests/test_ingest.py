@@ -0,0 +1,38 @@
+import hashlib
+import io
+import os
+
+from docx import Document
+
+from ingest import UploadSpool, scanner_for
+
+
+def docx_bytes():
+    buffer = io.BytesIO()
+    Document().save(buffer)
+    return buffer.getvalue()
+
+
+def test_persist_leaves_no_open_handle(tmp_path):
+    data = docx_bytes()
+    spool = UploadSpool(str(tmp_path), scanner_for({}))
+    spool.write(data[:1000])
+    spool.write(data[1000:])
+    assert spool.hexdigest() == hashlib.sha256(data).hexdigest()
+
+    target = str(tmp_path / 'upload.docx')
+    spool.persist(target)
+    assert spool._file is None
+    assert os.listdir(tmp_path) == ['upload.docx']
+
+    # Reads reopen the persisted file from the start
+    assert spool.read() == data
+    spool.close()
+    os.remove(target)
+
+
+def test_unpersisted_spool_is_removed(tmp_path):
+    spool = UploadSpool(str(tmp_path), scanner_for({}))
+    spool.write(docx_bytes())
+    spool.close()
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,81 @@
+import types
+
+import pytest
+from PIL import Image
+
+torch = pytest.importorskip('torch')
+
+import docanalyze
+from server import create_app
+
+
+class FakeModel:
+    """Stands in for LayoutLMv3ForTokenClassification: every token gets label 3"""
+
+    def __init__(self, commit):
+        self.config = types.SimpleNamespace(_commit_hash=commit)
+        self.calls = 0
+
+    def __call__(self, input_ids, **_):
+        self.calls += 1
+        logits = torch.zeros(*input_ids.shape, len(docanalyze.LABEL_MAP))
+        logits[..., 3] = 1
+        return types.SimpleNamespace(logits=logits)
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ocr_calls = []
+
+    def ocr_page(image):
+        ocr_calls.append(image)
+        return torch.zeros(3, 4, 4), ['Hello', 'world'], [[0, 0, 1, 1], [1, 1, 2, 2]]
+
+    def encode_windows(pixel_values, words, boxes, stride=docanalyze.WINDOW_STRIDE):
+        encoding = {'input_ids': torch.tensor([[7, 8, 0, 0]]),
+                    'pixel_values': pixel_values.unsqueeze(0)}
+        return encoding, [[0, 1, None, None]]
+
+    monkeypatch.setattr(docanalyze, 'ocr_page', ocr_page)
+    monkeypatch.setattr(docanalyze, 'encode_windows', encode_windows)
+    # The disk tier too: model keys hold '/' and ':'
+    app = create_app({'WORKER_POOL_SIZE': 0,
+                      'STAGE_CACHE_FOLDER': str(tmp_path / 'cache')})
+    app.ocr_calls = ocr_calls
+    return app
+
+
+def test_new_revision_misses_cached_ocr_and_logits(app, monkeypatch):
+    image = Image.new('L', (10, 10))
+    first = FakeModel('aaaa')
+    monkeypatch.setattr(docanalyze, '_model', (None, first))
+
+    with app.app_context():
+        labels = docanalyze.predict_word_labels([image])
+        assert docanalyze.predict_word_labels([image]) == labels
+        assert len(app.ocr_calls) == 1 and first.calls == 1
+
+        second = FakeModel('bbbb')
+        monkeypatch.setattr(docanalyze, '_model', (None, second))
+        assert docanalyze.predict_word_labels([image]) == labels
+        assert len(app.ocr_calls) == 2 and second.calls == 1
+        assert docanalyze.stage_cache.stats()['disk_entries'] == 4
+
+    assert labels == [[('Hello', [0, 0, 1, 1], 'B-HEADING'),
+                       ('world', [1, 1, 2, 2], 'B-HEADING')]]
+
+
+def classifier(id2label):
+    return types.SimpleNamespace(config=types.SimpleNamespace(id2label=id2label))
+
+
+def test_only_a_head_trained_on_the_label_map_is_used():
+    # As loaded from a fine-tuned checkpoint's config.json
+    trained = {str(label_id): label for label_id, label in docanalyze.LABEL_MAP.items()}
+    default = {label_id: f'LABEL_{label_id}' for label_id in docanalyze.LABEL_MAP}
+    missing = {'missing_keys': ['classifier.out_proj.weight', 'classifier.out_proj.bias']}
+
+    assert docanalyze.head_is_trained(classifier(trained), {'missing_keys': []})
+    assert not docanalyze.head_is_trained(classifier(default), {'missing_keys': []})
+    assert not docanalyze.head_is_trained(classifier(trained), missing)
@@ -0,0 +1,106 @@
+import os
+import time
+
+import pytest
+from flask import Flask
+
+from output_store import OutputStore
+
+
+@pytest.fixture
+def app():
+    return Flask(__name__)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return OutputStore(str(tmp_path / 'store'), ttl=60, max_bytes=1000)
+
+
+def put(store, tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return store.put(str(path), name)
+
+
+def test_put_and_send(app, store, tmp_path):
+    key = put(store, tmp_path, 'a.docx', b'x' * 100)
+
+    with app.test_request_context():
+        response = store.send(key)
+        assert response.status_code == 200
+        assert response.headers['X-Output-Key'] == key
+        assert response.headers['Cache-Control'] == 'private, no-store'
+        assert b''.join(response.response) == b'x' * 100
+        assert store.stats()['pinned'] == 1
+        response.close()
+    assert store.stats()['pinned'] == 0
+
+
+def test_identical_outputs_share_a_blob(store, tmp_path):
+    first = put(store, tmp_path, 'a.docx', b'same')
+    second = put(store, tmp_path, 'b.docx', b'same')
+
+    assert first != second
+    stats = store.stats()
+    assert (stats['entries'], stats['blobs'], stats['deduplicated']) == (2, 1, 1)
+
+
+def test_expired_key_is_swept(app, store, tmp_path):
+    key = put(store, tmp_path, 'a.docx', b'x' * 100)
+    digest = store.get(key)['digest']
+    store._entries[key]['expires'] = time.time() - 1
+
+    assert store.get(key) is None
+    assert store.sweep() == 1
+    assert not os.path.exists(store.blob_path(digest))
+    assert not os.path.exists(store._meta_path(key))
+    with app.test_request_context():
+        response, status = store.send(key)
+    assert status == 404
+
+
+def test_send_after_eviction_is_404(app, store, tmp_path):
+    key = put(store, tmp_path, 'a.docx', b'x' * 100)
+    entry = store.get(key)
+    store._entries[key]['expires'] = 0
+    store.sweep()
+
+    # A route that looked the entry up just before the sweep
+    with app.test_request_context():
+        response, status = store.send(key, entry)
+    assert status == 404
+
+
+def test_oldest_keys_are_evicted_over_quota(store, tmp_path):
+    keys = [put(store, tmp_path, f'{i}.docx', bytes([i]) * 400) for i in range(3)]
+
+    assert store.sweep() == 1
+    assert store.get(keys[0]) is None
+    assert store.get(keys[1]) is not None
+    assert store.stats()['evicted'] == 1
+
+
+def test_pinned_keys_survive_sweeps(app, store, tmp_path):
+    keys = [put(store, tmp_path, f'{i}.docx', bytes([i]) * 400) for i in range(2)]
+
+    with app.test_request_context():
+        response = store.send(keys[0])
+        put(store, tmp_path, 'big.docx', b'z' * 400)
+        store._entries[keys[0]]['expires'] = 0
+        # Neither expired nor evicted while it is being downloaded
+        store.sweep()
+        assert keys[0] in store._entries
+        assert store.get(keys[1]) is None
+        response.close()
+
+    store.sweep()
+    assert keys[0] not in store._entries
+
+
+def test_index_survives_restart(store, tmp_path):
+    key = put(store, tmp_path, 'a.docx', b'x' * 100)
+
+    reopened = OutputStore(store.folder, ttl=60, max_bytes=1000)
+    assert reopened.get(key)['name'] == 'a.docx'
+    assert reopened.stats()['blobs'] == 1
@@ -0,0 +1,38 @@
+import threading
+
+import pytest
+
+from pipeline import pipeline
+
+
+def test_stages_run_in_order():
+    results = list(pipeline(('numbers', range(5)),
+                            [('double', lambda n: n * 2), ('inc', lambda n: n + 1)]))
+    assert results == [1, 3, 5, 7, 9]
+
+
+def test_stage_error_reaches_the_consumer():
+    def fail_on_three(n):
+        if n == 3:
+            raise ValueError('bad item 3')
+        return n
+
+    results = []
+    with pytest.raises(ValueError, match='bad item 3'):
+        for item in pipeline(('numbers', range(10)),
+                             [('check', fail_on_three), ('inc', lambda n: n + 1)]):
+            results.append(item)
+    # Everything before the failure still came through
+    assert results == [1, 2, 3]
+    assert not [t for t in threading.enumerate() if t.name.startswith('pipeline-')]
+
+
+def test_source_error_reaches_the_consumer():
+    def source():
+        yield 1
+        raise OSError('render failed')
+
+    stream = pipeline(('render', source()), [('inc', lambda n: n + 1)])
+    assert next(stream) == 2
+    with pytest.raises(OSError, match='render failed'):
+        next(stream)
@@ -0,0 +1,46 @@
+import io
+import zipfile
+
+import pytest
+from docx import Document
+
+from server import create_app
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return create_app({'WORKER_POOL_SIZE': 0, 'STAGE_CACHE_FOLDER': None}).test_client()
+
+
+def docx_bytes(truncate_body=False):
+    document = Document()
+    document.add_paragraph().add_run('Bold heading').bold = True
+    document.add_paragraph('Body text.')
+    buffer = io.BytesIO()
+    document.save(buffer)
+    if not truncate_body:
+        return buffer.getvalue()
+
+    out = io.BytesIO()
+    with zipfile.ZipFile(buffer) as src, zipfile.ZipFile(out, 'w') as zf:
+        for info in src.infolist():
+            data = src.read(info)
+            if info.filename == 'word/document.xml':
+                data = data[:len(data) // 2]
+            zf.writestr(info, data)
+    return out.getvalue()
+
+
+def test_preview_renders_runs(client):
+    response = client.post('/api/preview', data={
+        'file': (io.BytesIO(docx_bytes()), 'doc.docx')})
+    assert response.status_code == 200
+    assert 'font-weight:bold;">Bold heading</span>' in response.get_json()['html']
+
+
+@pytest.mark.parametrize('url', ['/api/preview', '/analyzer/structure'])
+def test_malformed_document_xml_is_rejected(client, url):
+    response = client.post(url, data={
+        'file': (io.BytesIO(docx_bytes(truncate_body=True)), 'bad.docx')})
+    assert response.status_code == 400
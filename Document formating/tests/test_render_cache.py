@@ -0,0 +1,65 @@
+import io
+
+import pytest
+from docx import Document
+from PIL import Image
+
+import docanalyze
+from server import create_app
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return create_app({'WORKER_POOL_SIZE': 0, 'STAGE_CACHE_FOLDER': None})
+
+
+@pytest.fixture
+def docx_path(tmp_path):
+    document = Document()
+    run = document.add_paragraph().add_run('Bold heading')
+    run.bold = True
+    document.add_paragraph('Body text that is long enough to be a paragraph.')
+    path = tmp_path / 'doc.docx'
+    document.save(path)
+    return str(path)
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    calls = []
+
+    def fake(path, pages=None, dpi=100, grayscale=True, prefetch=2):
+        calls.append(pages)
+        for page in (pages or [1, 2, 3]):
+            yield page, Image.new('L', (10, 10), page)
+
+    monkeypatch.setattr(docanalyze, 'iter_page_images', fake)
+    return calls
+
+
+def test_whole_document_render_is_cached(app, docx_path, renders):
+    with app.app_context():
+        first = list(docanalyze.iter_rendered_pages(docx_path, None))
+        second = list(docanalyze.iter_rendered_pages(docx_path, None))
+        subset = list(docanalyze.iter_rendered_pages(docx_path, [2]))
+
+    assert renders == [None]
+    assert [page for page, _ in first] == [1, 2, 3]
+    assert [page for page, _ in second] == [1, 2, 3]
+    assert [image.getpixel((0, 0)) for _, image in second] == [1, 2, 3]
+    assert [page for page, _ in subset] == [2]
+
+
+@pytest.mark.parametrize('settings', [{'LAYOUTLM_STUB': True},
+                                      {'LAYOUTLM_STUB': False, 'LAYOUTLM_MODEL': None}])
+def test_no_model_renders_nothing(app, docx_path, renders, tmp_path, settings):
+    app.config.update(settings)
+    output = tmp_path / 'out.docx'
+    with app.test_request_context():
+        elements = docanalyze.extract_text_from_docx(docx_path)
+        docanalyze.analyze_document(docx_path, elements, str(output),
+                                    dict(app.config, LAYOUTLM_MIN_CONFIDENCE=1.1))
+
+    assert renders == []
+    assert Document(io.BytesIO(output.read_bytes())).paragraphs
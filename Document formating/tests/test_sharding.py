@@ -0,0 +1,53 @@
+import zipfile
+
+import pytest
+from docx import Document
+
+import docformat
+import sharding
+
+CONFIG = {'title_font': 'Georgia', 'title_size': 20, 'bold_titles': True,
+          'heading_font': 'Arial', 'heading_size': 14,
+          'para_font': 'Calibri', 'para_size': 11, 'highlight': True}
+
+
+@pytest.fixture
+def docx_path(tmp_path):
+    document = Document()
+    document.add_paragraph('Report', style='Title')
+    for section in range(4):
+        document.add_heading(f'Section {section}', level=1)
+        for n in range(5):
+            document.add_paragraph(f'Paragraph {n} of section {section} has body text.')
+        table = document.add_table(rows=2, cols=2)
+        table.cell(0, 0).text = f'Cell {section}'
+        document.add_paragraph('Item', style='List Bullet')
+        document.add_section()
+    path = tmp_path / 'sections.docx'
+    document.save(path)
+    return str(path)
+
+
+def document_xml(path):
+    with zipfile.ZipFile(path) as zf:
+        return zf.read('word/document.xml')
+
+
+def test_sharded_output_matches_serial(docx_path, tmp_path):
+    serial = str(tmp_path / 'serial.docx')
+    sharded = str(tmp_path / 'sharded.docx')
+
+    elements = docformat.extract_text_structure(docx_path)
+    docformat.format_docx(docx_path, elements, serial, CONFIG)
+    shards = sharding.format_docx_sharded(docx_path, sharded, CONFIG, 2, 5)
+
+    assert shards > 1
+    assert document_xml(sharded) == document_xml(serial)
+
+
+def test_executor_follows_worker_count():
+    first = sharding.get_shard_executor(1)
+    assert sharding.get_shard_executor(1) is first
+    second = sharding.get_shard_executor(2)
+    assert second is not first
+    assert second._max_workers == 2
@@ -0,0 +1,31 @@
+import zipfile
+
+from stage_cache import StageCache, content_digest
+
+
+def test_disk_tier_takes_any_key(tmp_path):
+    key = 'microsoft/layoutlmv3-base@main:0123abcd'
+    cache = StageCache(1 << 20, str(tmp_path), 1 << 20)
+    cache.put('ocr', key, ['words'])
+
+    # A fresh cache has an empty memory tier, so this is read from disk
+    reopened = StageCache(1 << 20, str(tmp_path), 1 << 20)
+    assert reopened.get('ocr', key) == ['words']
+    assert reopened.get('logits', key) is None
+    assert reopened.counters['disk_hits'] == 1
+    assert all(name.endswith('.pkl') for name in (p.name for p in tmp_path.iterdir()))
+
+
+def write_docx(path, body, title):
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr('word/document.xml', body)
+        zf.writestr('docProps/core.xml', title)
+
+
+def test_content_digest_hashes_part_bytes(tmp_path):
+    write_docx(tmp_path / 'a.docx', '<w:document>one</w:document>', 'first')
+    write_docx(tmp_path / 'b.docx', '<w:document>one</w:document>', 'second save')
+    write_docx(tmp_path / 'c.docx', '<w:document>two</w:document>', 'first')
+
+    assert content_digest(tmp_path / 'a.docx') == content_digest(tmp_path / 'b.docx')
+    assert content_digest(tmp_path / 'a.docx') != content_digest(tmp_path / 'c.docx')
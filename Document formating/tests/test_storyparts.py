@@ -0,0 +1,74 @@
+import zipfile
+
+from docx import Document
+from docx.oxml.ns import qn
+from lxml import etree
+
+from app import format_docx
+from docxstream import W_NS
+
+
+FOOTNOTES_REL = ('http://schemas.openxmlformats.org/officeDocument/2006/'
+                 'relationships/footnotes')
+FOOTNOTES_TYPE = ('application/vnd.openxmlformats-officedocument.'
+                  'wordprocessingml.footnotes+xml')
+FOOTNOTES = (
+    f'<w:footnotes xmlns:w="{W_NS}">'
+    '<w:footnote w:id="1"><w:p>'
+    '<w:r><w:rPr><w:i/></w:rPr><w:t>Italic note</w:t></w:r>'
+    '</w:p></w:footnote></w:footnotes>')
+
+
+def make_document(path):
+    """Body, a header with a bold run, and a footnotes part (a plain blob part)"""
+    doc = Document()
+    doc.add_paragraph('Body text')
+    header = doc.sections[0].header.paragraphs[0]
+    header.add_run('Bold header').bold = True
+    doc.save(path)
+
+    # python-docx has no footnotes support - add the part by hand
+    with zipfile.ZipFile(path) as zf:
+        parts = {name: zf.read(name) for name in zf.namelist()}
+    parts['word/footnotes.xml'] = FOOTNOTES.encode()
+    parts['word/_rels/document.xml.rels'] = parts['word/_rels/document.xml.rels'].replace(
+        b'</Relationships>',
+        f'<Relationship Id="rIdNotes" Type="{FOOTNOTES_REL}" '
+        f'Target="footnotes.xml"/></Relationships>'.encode())
+    parts['[Content_Types].xml'] = parts['[Content_Types].xml'].replace(
+        b'</Types>',
+        f'<Override PartName="/word/footnotes.xml" ContentType="{FOOTNOTES_TYPE}"/>'
+        f'</Types>'.encode())
+    with zipfile.ZipFile(path, 'w') as zf:
+        for name, data in parts.items():
+            zf.writestr(name, data)
+    return path
+
+
+def run_props(root):
+    return [(r.findtext(qn('w:t')), r.find(qn('w:rPr')))
+            for r in root.iter(qn('w:r'))]
+
+
+def test_every_story_part_is_written_back(tmp_path):
+    source = make_document(tmp_path / 'in.docx')
+    output = tmp_path / 'out.docx'
+
+    assert format_docx(str(source), str(output), 'Arial', '11')
+
+    doc = Document(output)
+    body = doc.paragraphs[0].runs[0]
+    assert (body.font.name, body.font.size.pt) == ('Arial', 11)
+
+    header = doc.sections[0].header.paragraphs[0].runs[0]
+    assert (header.font.name, header.font.size.pt) == ('Arial', 11)
+    # Existing formatting survives
+    assert header.bold
+
+    with zipfile.ZipFile(output) as zf:
+        notes = etree.fromstring(zf.read('word/footnotes.xml'))
+    [(text, rpr)] = run_props(notes)
+    assert text == 'Italic note'
+    assert rpr.find(qn('w:i')) is not None
+    assert rpr.find(qn('w:rFonts')).get(qn('w:ascii')) == 'Arial'
+    assert rpr.find(qn('w:sz')).get(qn('w:val')) == '22'
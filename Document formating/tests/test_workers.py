@@ -0,0 +1,35 @@
+import os
+import time
+
+import pytest
+
+from workers import WorkerPool, WorkerPoolBusy
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool(1, max_jobs=100, max_rss_mb=1024, queue_timeout=0.5)
+    yield pool
+    pool.close()
+
+
+def test_run(pool):
+    assert pool.run('os.path:join', 'a', 'b') == os.path.join('a', 'b')
+
+
+def test_busy_pool_times_out(pool):
+    worker = pool._idle.get()
+    started = time.monotonic()
+    with pytest.raises(WorkerPoolBusy):
+        pool.run('os.path:join', 'a', 'b')
+    assert time.monotonic() - started < 2
+    pool._idle.put(worker)
+
+
+def test_pool_without_workers_fails_fast(pool):
+    pool._idle.get()
+    pool.lost = pool.size
+    started = time.monotonic()
+    with pytest.raises(WorkerPoolBusy, match='No worker processes left'):
+        pool.run('os.path:join', 'a', 'b')
+    assert time.monotonic() - started < 0.1
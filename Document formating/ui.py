@@ -0,0 +1,72 @@
+import gzip
+import hashlib
+
+from flask import current_app, request, Response, render_template_string
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# ================== DEFAULTS ==================
+DEFAULT_CONFIG = {
+    'PAGE_CACHE_CONTROL': 'public, max-age=300',
+}
+
+# endpoint -> inline template, filled in by the blueprint modules
+TEMPLATES = {}
+
+
+def register(endpoint, template):
+    TEMPLATES[endpoint] = template
+
+
+# ================== COMPILING ==================
+class CompiledPage:
+    """A rendered UI page with its encoded variants and their ETags"""
+
+    def __init__(self, html):
+        body = html.encode('utf-8')
+        digest = hashlib.sha256(body).hexdigest()[:32]
+
+        # encoding -> (body, etag); each encoding is its own representation
+        self.variants = {'identity': (body, f'"{digest}"'),
+                         'gzip': (gzip.compress(body, 9, mtime=0), f'"{digest}-gz"')}
+        if brotli is not None:
+            self.variants['br'] = (brotli.compress(body), f'"{digest}-br"')
+
+    def pick(self, accept_encodings):
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accept_encodings[encoding]:
+                return encoding
+        return 'identity'
+
+
+def compile_pages(app):
+    """Render every registered page of the app once, with its url_for links"""
+    pages = {}
+    with app.test_request_context():
+        for endpoint, template in TEMPLATES.items():
+            if endpoint in app.view_functions:
+                pages[endpoint] = CompiledPage(render_template_string(template))
+    app.extensions['ui_pages'] = pages
+
+
+# ================== SERVING ==================
+def serve(endpoint):
+    page = current_app.extensions['ui_pages'][endpoint]
+    encoding = page.pick(request.accept_encodings)
+    body, etag = page.variants[encoding]
+
+    headers = {
+        'ETag': etag,
+        'Cache-Control': current_app.config['PAGE_CACHE_CONTROL'],
+        'Vary': 'Accept-Encoding',
+    }
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+
+    if request.if_none_match.contains(etag.strip('"')):
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype='text/html', headers=headers)
@@ -0,0 +1,348 @@
+import atexit
+import importlib
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+
+import profiling
+
+
+# ================== DEFAULTS ==================
+DEFAULT_CONFIG = {
+    # Worker processes to format in; 0 runs formatting in the web process itself
+    'WORKER_POOL_SIZE': 0,
+    # Recycle a worker after this many jobs...
+    'WORKER_MAX_JOBS': 200,
+    # ...or once its resident memory passes this many MB
+    'WORKER_MAX_RSS_MB': 1024,
+    # Seconds to wait for a replacement worker to finish importing
+    'WORKER_START_TIMEOUT': 120,
+    # Seconds a job waits for a free worker before it gets 503
+    'WORKER_QUEUE_TIMEOUT': 30,
+}
+
+# Attempts at starting a replacement before the pool runs one short
+REPLACE_ATTEMPTS = 5
+
+
+class WorkerCrashed(Exception):
+    """Raised when a worker process died while running a job"""
+
+
+class WorkerJobError(Exception):
+    """Raised in the caller when the job itself raised inside the worker"""
+
+
+class WorkerPoolBusy(Exception):
+    """Raised when no worker became free in time, or none are left"""
+
+
+# ================== MEMORY ==================
+def current_rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import resource
+        # Peak rather than current RSS, but the best available without /proc
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if os.uname().sysname == 'Darwin' else usage * 1024
+    except ImportError:
+        return 0
+
+
+# ================== WORKER PROCESS ==================
+def _resolve(target, cache):
+    func = cache.get(target)
+    if func is None:
+        module_name, func_name = target.split(':')
+        func = getattr(importlib.import_module(module_name), func_name)
+        cache[target] = func
+    return func
+
+
+def _worker_main(conn, preload):
+    # Prewarm: pay for the heavy imports before we report ready
+    for module_name in preload:
+        importlib.import_module(module_name)
+    conn.send(('ready', current_rss()))
+
+    functions = {}
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+
+        target, args, kwargs = job
+        profiling._local.timings = {}
+        try:
+            result = _resolve(target, functions)(*args, **kwargs)
+            reply = ('ok', result)
+        except Exception as e:
+            traceback.print_exc()
+            reply = ('error', f"{type(e).__name__}: {e}")
+        timings = profiling.current_timings()
+        profiling._local.timings = None
+
+        conn.send(reply + (timings, current_rss()))
+
+
+class Worker:
+    def __init__(self, ctx, preload):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main,
+                                   args=(child_conn, preload), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        self.rss = 0
+        self.rss_high_water = 0
+
+    def wait_ready(self, timeout):
+        try:
+            if not self.conn.poll(timeout):
+                raise WorkerCrashed('Worker did not start in time')
+            status, rss = self.conn.recv()
+        except (EOFError, OSError):
+            raise WorkerCrashed(
+                f'Worker {self.process.pid} died while starting')
+        self._note_rss(rss)
+
+    def run(self, target, args, kwargs):
+        try:
+            self.conn.send((target, args, kwargs))
+            status, value, timings, rss = self.conn.recv()
+        except (EOFError, OSError, BrokenPipeError):
+            raise WorkerCrashed(
+                f'Worker {self.process.pid} died (exit code {self.process.exitcode})')
+
+        self.jobs += 1
+        self._note_rss(rss)
+        return status, value, timings
+
+    def _note_rss(self, rss):
+        self.rss = rss
+        self.rss_high_water = max(self.rss_high_water, rss)
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, BrokenPipeError):
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+        self.conn.close()
+
+
+# ================== SUPERVISOR ==================
+class WorkerPool:
+    """
+    Runs formatting jobs in child processes and recycles each worker after
+    max_jobs jobs or once its RSS passes max_rss. A worker is only retired
+    between jobs, so in-flight work always finishes, and a replacement only
+    joins the pool once its imports are done.
+    """
+
+    def __init__(self, size, max_jobs, max_rss_mb, preload=(),
+                 start_timeout=120, queue_timeout=30):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.preload = list(preload)
+        self.start_timeout = start_timeout
+        self.queue_timeout = queue_timeout
+
+        self._ctx = multiprocessing.get_context('spawn')
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._workers = set()
+
+        self.jobs = 0
+        self.recycles = {'jobs': 0, 'rss': 0, 'crash': 0}
+        self.lost = 0
+        self.rss_high_water = 0
+
+        starting = [self._spawn() for _ in range(size)]
+        try:
+            for worker in starting:
+                worker.wait_ready(self.start_timeout)
+                self._idle.put(worker)
+        except WorkerCrashed:
+            # Don't leak the workers that did start
+            self.close()
+            raise
+
+    @classmethod
+    def from_config(cls, config, preload=()):
+        settings = {key: config.get(key, value)
+                    for key, value in DEFAULT_CONFIG.items()}
+        if settings['WORKER_POOL_SIZE'] <= 0:
+            return None
+        return cls(settings['WORKER_POOL_SIZE'],
+                   settings['WORKER_MAX_JOBS'],
+                   settings['WORKER_MAX_RSS_MB'],
+                   preload=preload,
+                   start_timeout=settings['WORKER_START_TIMEOUT'],
+                   queue_timeout=settings['WORKER_QUEUE_TIMEOUT'])
+
+    def _spawn(self):
+        worker = Worker(self._ctx, self.preload)
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+
+    def _replace(self, worker, reason):
+        with self._lock:
+            self._workers.discard(worker)
+            self.recycles[reason] += 1
+            self.rss_high_water = max(self.rss_high_water, worker.rss_high_water)
+            closed = self._closed
+        print(f"Recycling worker {worker.process.pid} ({reason}, "
+              f"{worker.jobs} jobs, {worker.rss / 1024 / 1024:.0f} MB)")
+        worker.stop()
+        if closed:
+            return
+
+        def prewarm():
+            delay = 1
+            for attempt in range(REPLACE_ATTEMPTS):
+                replacement = self._spawn()
+                try:
+                    replacement.wait_ready(self.start_timeout)
+                except WorkerCrashed as e:
+                    with self._lock:
+                        self._workers.discard(replacement)
+                    replacement.stop()
+                    print(f"Replacement worker failed to start: {e}")
+                    # Keep the pool at full size - try again with a fresh process
+                    time.sleep(delay)
+                    delay *= 2
+                    continue
+                self._idle.put(replacement)
+                return
+            with self._lock:
+                self.lost += 1
+            print(f"Giving up on a replacement worker after {REPLACE_ATTEMPTS} attempts")
+
+        threading.Thread(target=prewarm, daemon=True).start()
+
+    def run(self, target, *args, **kwargs):
+        """
+        Run target ("module:function") in a worker and return its result.
+        Waits up to queue_timeout for a warm worker; raises WorkerPoolBusy
+        after that, or straight away once every replacement has failed.
+        """
+        deadline = time.monotonic() + self.queue_timeout
+        while True:
+            with self._lock:
+                if self.lost >= self.size:
+                    raise WorkerPoolBusy('No worker processes left')
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise WorkerPoolBusy('No worker became free in time')
+            try:
+                # Short waits, so a pool that loses its last worker is noticed
+                worker = self._idle.get(timeout=min(remaining, 1))
+                break
+            except queue.Empty:
+                continue
+        try:
+            status, value, timings = worker.run(target, args, kwargs)
+        except WorkerCrashed:
+            self._replace(worker, 'crash')
+            raise
+
+        with self._lock:
+            self.jobs += 1
+            self.rss_high_water = max(self.rss_high_water, worker.rss_high_water)
+
+        if worker.jobs >= self.max_jobs:
+            self._replace(worker, 'jobs')
+        elif worker.rss >= self.max_rss:
+            self._replace(worker, 'rss')
+        else:
+            self._idle.put(worker)
+
+        profiling.merge_timings(timings)
+        if status == 'error':
+            raise WorkerJobError(value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            workers = [{'pid': w.process.pid,
+                        'jobs': w.jobs,
+                        'rss_mb': round(w.rss / 1024 / 1024, 1),
+                        'rss_high_water_mb': round(w.rss_high_water / 1024 / 1024, 1)}
+                       for w in self._workers]
+            return {
+                'size': self.size,
+                'idle': self._idle.qsize(),
+                'jobs': self.jobs,
+                'recycles': dict(self.recycles),
+                'lost': self.lost,
+                'rss_high_water_mb': round(
+                    max([self.rss_high_water] +
+                        [w.rss_high_water for w in self._workers]) / 1024 / 1024, 1),
+                'workers': workers,
+            }
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            worker.stop()
+
+
+# ================== SHARED POOL ==================
+_pools = {}
+_starting = {}
+_pools_lock = threading.Lock()
+
+
+def get_worker_pool(config, preload=(), start=True):
+    """
+    Lazily start the pool for this preload set.
+    Returns None when pooling is disabled, or when start=False and it isn't running yet.
+    """
+    key = tuple(preload)
+    while True:
+        with _pools_lock:
+            if key in _pools:
+                return _pools[key]
+            if not start:
+                return None
+            started = _starting.get(key)
+            if started is None:
+                started = _starting[key] = threading.Event()
+                break
+        # Another request is starting this pool
+        started.wait()
+
+    # Started outside the lock: spawning waits for every worker's imports,
+    # and stats/health callers must not block behind it
+    try:
+        pool = WorkerPool.from_config(config, preload=preload)
+        if pool is not None:
+            atexit.register(pool.close)
+        with _pools_lock:
+            _pools[key] = pool
+        return pool
+    finally:
+        with _pools_lock:
+            del _starting[key]
+        started.set()